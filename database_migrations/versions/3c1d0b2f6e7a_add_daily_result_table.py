@@ -0,0 +1,31 @@
+"""add daily_result table
+
+Revision ID: 3c1d0b2f6e7a
+Revises: 6f1b895840a
+Create Date: 2015-06-02 10:14:37.512093
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3c1d0b2f6e7a'
+down_revision = '6f1b895840a'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'daily_result',
+        sa.Column('metric_key', sa.String(length=40), nullable=False,
+                  primary_key=True),
+        sa.Column('user_id', sa.Integer(), nullable=False,
+                  primary_key=True, autoincrement=False),
+        sa.Column('result', sa.String(length=1000), nullable=False),
+        sa.Column('created', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_daily_result_created', 'daily_result', ['created'])
+
+
+def downgrade():
+    op.drop_table('daily_result')
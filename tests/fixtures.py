@@ -10,6 +10,7 @@ from wikimetrics.utils import (
     parse_date, format_date, parse_pretty_date, format_pretty_date, UNICODE_NULL
 )
 from wikimetrics.configurables import db
+from wikimetrics.api import bot_user_cache
 from wikimetrics.models import (
     UserStore,
     WikiUserStore,
@@ -21,6 +22,7 @@ from wikimetrics.models import (
     CohortTagStore,
     ReportStore,
     TaskErrorStore,
+    DailyResultStore,
     Revision,
     Page,
     MediawikiUser,
@@ -635,6 +637,7 @@ class DatabaseTest(unittest.TestCase):
         """
         session.add(MediawikiUserGroups(ug_user=user_id, ug_group='bot'))
         session.commit()
+        bot_user_cache.invalidate()
 
     def setUp(self):
         #****************************************************************
@@ -685,6 +688,7 @@ class DatabaseTest(unittest.TestCase):
         self.session.query(CohortStore).delete()
         self.session.query(UserStore).delete()
         self.session.query(TaskErrorStore).delete()
+        self.session.query(DailyResultStore).delete()
         self.session.query(ReportStore).delete()
         self.session.commit()
         self.session.remove()
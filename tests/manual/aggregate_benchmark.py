@@ -0,0 +1,73 @@
+import time
+import random
+from decimal import Decimal
+from nose.tools import assert_equal
+from nose.plugins.attrib import attr
+from tests.fixtures import DatabaseTest
+from wikimetrics.enums import Aggregation
+from wikimetrics.metrics import NamespaceEdits
+from wikimetrics.models import AggregateReport, UserResults
+from wikimetrics.utils import r
+
+
+class AggregateBenchmark(DatabaseTest):
+
+    def setUp(self):
+        DatabaseTest.setUp(self)
+        self.common_cohort_1()
+
+        self.user_count = 1000000
+        self.results_by_user = {
+            user_id: {'edits': random.randint(0, 1000)}
+            for user_id in xrange(self.user_count)
+        }
+        self.user_results = UserResults.from_metric_results(
+            self.results_by_user, 'wiki', self.cohort.id
+        )
+        self.report = AggregateReport(NamespaceEdits(), self.cohort, {})
+        self.types_of_aggregate = [Aggregation.SUM, Aggregation.AVG, Aggregation.STD]
+
+    @attr('manual')
+    def test_aggregate_one_million_results(self):
+        start = time.time()
+        by_column = self.report.calculate(self.user_results, self.types_of_aggregate)
+        columns_time = time.time() - start
+
+        start = time.time()
+        by_user = self.report.calculate(self.results_by_user, self.types_of_aggregate)
+        users_time = time.time() - start
+
+        start = time.time()
+        per_value = decimal_per_value_aggregates(self.results_by_user)
+        per_value_time = time.time() - start
+
+        print('aggregating {0} results: {1:.2f}s by column, {2:.2f}s by user, '
+              '{3:.2f}s with a Decimal per value and a pass per aggregate'.format(
+                  self.user_count, columns_time, users_time, per_value_time))
+        assert_equal(by_column, by_user)
+        assert_equal(by_column[Aggregation.SUM], per_value[Aggregation.SUM])
+        assert_equal(by_column[Aggregation.AVG], per_value[Aggregation.AVG])
+
+
+def decimal_per_value_aggregates(results_by_user):
+    """
+    The way aggregates used to be computed, kept here to compare against:
+    a Decimal for each value, and separate passes for the average and the
+    standard deviation
+    """
+    total = Decimal(0)
+    count = 0
+    for result in results_by_user.itervalues():
+        total += Decimal(result['edits'])
+        count += 1
+    average = r(total / count)
+
+    square_diffs = Decimal(0)
+    for result in results_by_user.itervalues():
+        square_diffs += Decimal(pow(Decimal(result['edits']) - average, 2))
+
+    return {
+        Aggregation.SUM: {'edits': r(total)},
+        Aggregation.AVG: {'edits': r(average)},
+        Aggregation.STD: {'edits': r(r(square_diffs / count).sqrt())},
+    }
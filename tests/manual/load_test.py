@@ -1,8 +1,12 @@
+import resource
 from datetime import datetime, timedelta
 from nose.tools import assert_true, assert_equal
 from nose.plugins.attrib import attr
+from sqlalchemy import func
 from tests.fixtures import DatabaseTest, i, d
 from wikimetrics.metrics import NamespaceEdits
+from wikimetrics.enums import TimeseriesChoices
+from wikimetrics.models import Revision
 
 
 class ManualLoad(DatabaseTest):
@@ -39,3 +43,42 @@ class ManualLoad(DatabaseTest):
         print('{0} results for {1} editors'.format(len(results), len(self.editors)))
         assert_true(len(results) == len(self.editors))
         assert_equal(results[self.editors[0].user_id]['edits'], self.revision_count)
+    
+    @attr('manual')
+    def test_edits_timeseries_memory(self):
+        """
+        Compares the peak memory used by an hourly timeseries with rows streamed
+        and with all rows fetched at once.  The peak resident size only grows, so
+        the streamed run has to go first for the comparison to mean anything.
+        """
+        one_day = timedelta(days=1)
+        metric = NamespaceEdits(
+            start_date=self.revisions[0].rev_timestamp - one_day,
+            end_date=self.revisions[-1].rev_timestamp + one_day,
+            timeseries=TimeseriesChoices.HOUR,
+        )
+        
+        def peak_memory_growth(stream_chunk_size):
+            metric.stream_chunk_size = stream_chunk_size
+            before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            query_results = metric.submetrics_by_user(
+                self.edits_query(metric), [(metric.id, 1, 0)], date_index=2
+            )
+            after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            assert_equal(len(query_results), len(self.editors))
+            return after - before
+        
+        streamed = peak_memory_growth(10000)
+        fetched = peak_memory_growth(None)
+        print('peak memory growth: {0} KB streamed, {1} KB fetching all rows'.format(
+            streamed, fetched
+        ))
+        assert_true(streamed <= fetched)
+    
+    def edits_query(self, metric):
+        query = self.mwSession.query(Revision.rev_user, func.count())\
+            .filter(Revision.rev_user.in_(self.editor_ids))\
+            .filter(Revision.rev_timestamp > metric.start_date.data)\
+            .filter(Revision.rev_timestamp <= metric.end_date.data)\
+            .group_by(Revision.rev_user)
+        return metric.apply_timeseries(query)
@@ -0,0 +1,116 @@
+import time
+from datetime import datetime, timedelta
+from nose.tools import assert_equal
+from nose.plugins.attrib import attr
+from tests.fixtures import DatabaseTest, i
+from wikimetrics.metrics import Survival
+from wikimetrics.utils import format_date
+
+
+# how Survival used to filter revisions, on the difference of unix timestamps
+UNIX_TIMESTAMP_SQL = """
+ SELECT rev_user, count(*) AS rev_count
+   FROM revision
+            INNER JOIN
+        page        ON page.page_id = revision.rev_page
+            INNER JOIN
+        user        ON user.user_id = revision.rev_user
+  WHERE rev_user IN ({user_ids})
+    AND page.page_namespace IN (0)
+    AND unix_timestamp(revision.rev_timestamp) -
+        unix_timestamp(user.user_registration)
+            BETWEEN :start AND :end
+  GROUP BY rev_user
+"""
+
+# the query of one registration bucket of Metric.revisions_in_windows
+RANGE_SQL = """
+ SELECT rev_user, rev_timestamp
+   FROM revision
+            INNER JOIN
+        page        ON page.page_id = revision.rev_page
+  WHERE rev_user IN ({user_ids})
+    AND page.page_namespace IN (0)
+    AND rev_timestamp >= :start
+    AND rev_timestamp <= :end
+  ORDER BY rev_user, rev_timestamp
+"""
+
+
+class TimestampPredicatesBenchmark(DatabaseTest):
+
+    def setUp(self):
+        DatabaseTest.setUp(self)
+
+        # ******* EXPERIMENT HERE
+        self.editor_count = 500
+        self.revisions_per_editor = 200
+
+        one_hour = timedelta(hours=1)
+        self.registration = datetime(2013, 1, 1)
+        self.create_test_cohort(
+            editor_count=self.editor_count,
+            revisions_per_editor=self.revisions_per_editor,
+            user_registrations=i(self.registration),
+            revision_timestamps=[
+                [
+                    i(self.registration + one_hour * (editor + revision))
+                    for revision in range(self.revisions_per_editor)
+                ]
+                for editor in range(self.editor_count)
+            ],
+            revision_lengths=10,
+        )
+        self.survival_hours = 24
+        self.sunset_in_hours = 48
+        self.number_of_edits = 40
+
+    @attr('manual')
+    def test_survival_with_range_predicates(self):
+        user_ids = ','.join(str(user_id) for user_id in self.editor_ids)
+        survival_end = self.survival_hours + self.sunset_in_hours
+
+        old_sql = UNIX_TIMESTAMP_SQL.format(user_ids=user_ids)
+        old_params = {
+            'start': self.survival_hours * 3600,
+            'end': survival_end * 3600,
+        }
+        start = time.time()
+        old_counts = self.mwSession.execute(old_sql, old_params).fetchall()
+        old_time = time.time() - start
+
+        metric = Survival(
+            namespaces=[0],
+            survival_hours=self.survival_hours,
+            sunset_in_hours=self.sunset_in_hours,
+            number_of_edits=self.number_of_edits,
+        )
+        start = time.time()
+        results = metric(self.editor_ids, self.mwSession)
+        new_time = time.time() - start
+
+        new_sql = RANGE_SQL.format(user_ids=user_ids)
+        new_params = {
+            'start': format_date(
+                self.registration + timedelta(hours=self.survival_hours)),
+            'end': format_date(self.registration + timedelta(hours=survival_end)),
+        }
+        print('unix_timestamp predicates:')
+        for row in self.mwSession.execute('EXPLAIN ' + old_sql, old_params):
+            print(row)
+        print('range predicates:')
+        for row in self.mwSession.execute('EXPLAIN ' + new_sql, new_params):
+            print(row)
+        print('survival of {0} editors with {1} revisions each: {2:.2f}s with '
+              'unix_timestamp predicates, {3:.2f}s with range predicates'.format(
+                  self.editor_count, self.revisions_per_editor, old_time, new_time))
+
+        old_survivors = set(
+            user_id for user_id, rev_count in old_counts
+            if rev_count >= self.number_of_edits
+        )
+        new_survivors = set(
+            user_id for user_id, result in results.iteritems()
+            if result[Survival.id]
+        )
+        assert_equal(old_survivors, new_survivors)
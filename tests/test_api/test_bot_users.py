@@ -0,0 +1,46 @@
+from nose.tools import assert_equals
+
+from tests.fixtures import DatabaseTest, mediawiki_project
+from wikimetrics.api import BotUserCache
+from wikimetrics.models import MediawikiUserGroups
+
+
+class BotUserCacheTest(DatabaseTest):
+
+    def setUp(self):
+        DatabaseTest.setUp(self)
+        self.common_cohort_1()
+        self.cache = BotUserCache(ttl=60)
+
+    def add_bot(self, user_id):
+        # unlike make_bot, this leaves the caches alone
+        self.mwSession.add(MediawikiUserGroups(ug_user=user_id, ug_group='bot'))
+        self.mwSession.commit()
+
+    def test_bots_are_cached_by_project(self):
+        self.add_bot(self.editors[0].user_id)
+        bots = self.cache.get(mediawiki_project, self.mwSession)
+        assert_equals(bots, frozenset([self.editors[0].user_id]))
+
+        self.add_bot(self.editors[1].user_id)
+        assert_equals(self.cache.get(mediawiki_project, self.mwSession), bots)
+        assert_equals(self.cache.get(None, self.mwSession), frozenset([
+            self.editors[0].user_id, self.editors[1].user_id
+        ]))
+
+    def test_invalidate(self):
+        self.cache.get(mediawiki_project, self.mwSession)
+        self.add_bot(self.editors[0].user_id)
+        self.cache.invalidate(mediawiki_project)
+
+        bots = self.cache.get(mediawiki_project, self.mwSession)
+        assert_equals(bots, frozenset([self.editors[0].user_id]))
+
+    def test_no_ttl_disables_cache(self):
+        self.cache._ttl = 0
+        self.cache.get(mediawiki_project, self.mwSession)
+        self.add_bot(self.editors[0].user_id)
+
+        bots = self.cache.get(mediawiki_project, self.mwSession)
+        assert_equals(bots, frozenset([self.editors[0].user_id]))
+        assert_equals(self.cache.entries, {})
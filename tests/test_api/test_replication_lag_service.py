@@ -126,3 +126,35 @@ class ReplicationLagServiceTest(DatabaseTest):
         ])
 
         self.assertTrue(service.is_any_lagged())
+
+    def test_lagged_projects(self):
+        # Setup of wiki
+        self._add_edit(hour_offset=1, name='foo', mw_session=self.mwSession)
+
+        # Setup of wiki2
+        self._add_edit(hour_offset=4, name='bar', mw_session=self.mwSession2)
+
+        service = ReplicationLagService(mw_projects=[
+            mediawiki_project,
+            second_mediawiki_project,
+        ])
+        lags = service.get_lags()
+
+        self.assertEqual(service.get_lagged_projects(), set([second_mediawiki_project]))
+        self.assertTrue(lags[mediawiki_project] < timedelta(hours=2))
+        self.assertTrue(lags[second_mediawiki_project] > timedelta(hours=3))
+
+    def test_lag_checks_are_cached(self):
+        ReplicationLagService.clear_cache()
+        self._add_edit(hour_offset=4, name='foo')
+        service = ReplicationLagService(
+            mw_projects=[mediawiki_project],
+            cache_ttl=3600,
+        )
+        self.assertTrue(service.is_any_lagged())
+
+        self._add_edit(hour_offset=1, name='bar')
+        self.assertTrue(service.is_any_lagged())
+
+        ReplicationLagService.clear_cache()
+        self.assertFalse(service.is_any_lagged())
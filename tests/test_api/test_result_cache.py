@@ -0,0 +1,222 @@
+from datetime import datetime, timedelta
+from mock import patch
+from nose.tools import assert_equals, assert_true, assert_not_equals
+
+from tests.fixtures import DatabaseTest, mediawiki_project
+from wikimetrics.api import MetricResultCache
+from wikimetrics.metrics import NamespaceEdits
+from wikimetrics.models import MetricReport
+from wikimetrics.models.report_nodes import metric_report
+from wikimetrics.enums import TimeseriesChoices
+
+
+class MetricResultCacheTest(DatabaseTest):
+
+    def setUp(self):
+        DatabaseTest.setUp(self)
+        self.common_cohort_1()
+        self.cache = MetricResultCache(max_results=10, ttl=60)
+        self.metric = NamespaceEdits(
+            namespaces=[0],
+            start_date='2012-12-31 22:59:59',
+            end_date='2013-01-01 12:00:00',
+        )
+
+    def test_key_ignores_user_order(self):
+        key = self.cache.key(self.metric, mediawiki_project, [1, 2, 3])
+        assert_equals(key, self.cache.key(self.metric, mediawiki_project, [3, 1, 2]))
+        assert_not_equals(key, self.cache.key(self.metric, mediawiki_project, [1, 2]))
+        assert_not_equals(key, self.cache.key(self.metric, 'other', [1, 2, 3]))
+
+    def test_recent_end_date_is_not_cached(self):
+        metric = NamespaceEdits(
+            namespaces=[0],
+            start_date=datetime.now() - timedelta(days=1),
+            end_date=datetime.now(),
+        )
+        assert_equals(self.cache.key(metric, mediawiki_project, [1]), None)
+        assert_equals(self.cache.bypasses, 1)
+
+    def test_hit_and_miss(self):
+        key = self.cache.key(self.metric, mediawiki_project, [1])
+        assert_equals(self.cache.get(key), None)
+        self.cache.set(key, {1: {'edits': 2}})
+
+        assert_equals(self.cache.get(key), {1: {'edits': 2}})
+        assert_equals(self.cache.hits, 1)
+        assert_equals(self.cache.misses, 1)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.set('a', dict.fromkeys(range(4)))
+        self.cache.set('b', dict.fromkeys(range(4)))
+        self.cache.get('a')
+        self.cache.set('c', dict.fromkeys(range(4)))
+
+        assert_equals(self.cache.entries.keys(), ['a', 'c'])
+        assert_equals(self.cache.size, 8)
+
+    def test_expired_entries_miss(self):
+        self.cache._ttl = -1
+        self.cache.set('a', {1: {'edits': 2}})
+
+        assert_equals(self.cache.get('a'), None)
+        assert_equals(self.cache.size, 0)
+
+    def test_metric_report_uses_cache(self):
+        saved_cache = metric_report.metric_result_cache
+        metric_report.metric_result_cache = self.cache
+        try:
+            report = MetricReport(
+                self.metric, self.cohort.id, self.editor_ids, mediawiki_project
+            )
+            first = report.run()
+            second = report.run()
+        finally:
+            metric_report.metric_result_cache = saved_cache
+
+        assert_equals(first, second)
+        assert_equals(self.cache.misses, 1)
+        assert_equals(self.cache.hits, 1)
+        assert_true(self.cache.size > 0)
+
+    def test_users_are_cached_separately(self):
+        metric_key = self.cache.metric_key(self.metric, mediawiki_project)
+        self.cache.set_users(metric_key, {1: {'edits': 2}, 2: {'edits': 3}})
+
+        cached, missing = self.cache.get_users(metric_key, [2, 3])
+        assert_equals(cached, {2: {'edits': 3}})
+        assert_equals(missing, [3])
+        assert_equals(self.cache.user_hits, 1)
+        assert_equals(self.cache.user_misses, 1)
+
+    def test_metric_report_only_queries_new_users(self):
+        saved_cache = metric_report.metric_result_cache
+        metric_report.metric_result_cache = self.cache
+        try:
+            first = MetricReport(
+                self.metric, self.cohort.id, self.editor_ids[:2], mediawiki_project
+            ).run()
+            second = MetricReport(
+                self.metric, self.cohort.id, self.editor_ids, mediawiki_project
+            ).run()
+        finally:
+            metric_report.metric_result_cache = saved_cache
+
+        assert_equals(self.cache.user_hits, 2)
+        assert_equals(self.cache.user_misses, 2 + len(self.editor_ids) - 2)
+        assert_equals(second[self.editor(0)], first[self.editor(0)])
+        assert_equals(len(second), len(self.editor_ids))
+
+    def test_additive_metric_reuses_daily_results(self):
+        saved_cache = metric_report.metric_result_cache
+        metric_report.metric_result_cache = self.cache
+        self.cache._max_results = 1000
+        overlapping = NamespaceEdits(
+            namespaces=[0],
+            start_date='2012-12-30 00:00:00',
+            end_date='2013-01-01 12:00:00',
+        )
+        try:
+            first = MetricReport(
+                self.metric, self.cohort.id, self.editor_ids, mediawiki_project
+            ).run()
+            user_misses = self.cache.user_misses
+            second = MetricReport(
+                overlapping, self.cohort.id, self.editor_ids, mediawiki_project
+            ).run()
+        finally:
+            metric_report.metric_result_cache = saved_cache
+
+        # the results of 2013-01-01 were cached by the first run, the two days
+        # before had to be queried
+        assert_equals(self.cache.user_hits, len(self.editor_ids))
+        assert_equals(self.cache.user_misses - user_misses, 2 * len(self.editor_ids))
+        assert_equals(first, MetricReport(
+            self.metric, self.cohort.id, self.editor_ids, mediawiki_project
+        ).run())
+        assert_equals(
+            second[self.editor(0)]['edits'],
+            overlapping(self.editor_ids, self.mwSession)[self.editors[0].user_id]['edits']
+        )
+
+    def test_uncached_days_are_queried_together(self):
+        saved_cache = metric_report.metric_result_cache
+        metric_report.metric_result_cache = self.cache
+        self.cache._max_results = 1000
+        window = NamespaceEdits(
+            namespaces=[0],
+            start_date='2012-12-30 00:00:00',
+            end_date='2013-01-01 12:00:00',
+        )
+        try:
+            with patch.object(
+                NamespaceEdits, '__call__',
+                autospec=True, side_effect=NamespaceEdits.__call__,
+            ) as call:
+                results = MetricReport(
+                    window, self.cohort.id, self.editor_ids, mediawiki_project
+                ).run()
+            assert_equals(call.call_count, 1)
+
+            # the three days were cached by the single query
+            MetricReport(
+                self.metric, self.cohort.id, self.editor_ids, mediawiki_project
+            ).run()
+        finally:
+            metric_report.metric_result_cache = saved_cache
+
+        assert_equals(self.cache.user_hits, 2 * len(self.editor_ids))
+        assert_equals(
+            results[self.editor(0)]['edits'],
+            window(self.editor_ids, self.mwSession)[self.editors[0].user_id]['edits']
+        )
+
+    def test_slices_including_their_end_are_cached_separately(self):
+        saved_cache = metric_report.metric_result_cache
+        metric_report.metric_result_cache = self.cache
+        metrics = []
+        for slices_include_end in (False, True):
+            metric = NamespaceEdits(
+                namespaces=[0],
+                start_date='2012-12-30 00:00:00',
+                end_date='2013-01-02 00:00:00',
+                timeseries=TimeseriesChoices.DAY,
+            )
+            metric.slices_include_end = slices_include_end
+            metrics.append(metric)
+        try:
+            for metric in metrics:
+                MetricReport(
+                    metric, self.cohort.id, self.editor_ids, mediawiki_project
+                ).run()
+        finally:
+            metric_report.metric_result_cache = saved_cache
+
+        assert_not_equals(
+            self.cache.metric_key(metrics[0], mediawiki_project),
+            self.cache.metric_key(metrics[1], mediawiki_project),
+        )
+        assert_equals(self.cache.hits, 0)
+        assert_equals(self.cache.misses, 2)
+
+    def test_daily_results_outlive_the_worker_cache(self):
+        saved_cache = metric_report.metric_result_cache
+        metric_report.metric_result_cache = self.cache
+        try:
+            first = MetricReport(
+                self.metric, self.cohort.id, self.editor_ids, mediawiki_project
+            ).run()
+            # as if another worker, or this one after a restart, ran the report
+            metric_report.metric_result_cache = MetricResultCache(max_results=10)
+            with patch.object(
+                NamespaceEdits, '__call__',
+                autospec=True, side_effect=NamespaceEdits.__call__,
+            ) as call:
+                second = MetricReport(
+                    self.metric, self.cohort.id, self.editor_ids, mediawiki_project
+                ).run()
+        finally:
+            metric_report.metric_result_cache = saved_cache
+
+        assert_equals(call.call_count, 0)
+        assert_equals(first, second)
@@ -24,6 +24,8 @@ class WriteReportTaskTest(unittest.TestCase):
         file_manager.get_public_report_path = MagicMock(return_value=self.fake_path)
         file_manager.coalesce_recurrent_reports = MagicMock(return_value=self.results)
         file_manager.remove_old_report_files = MagicMock()
+        file_manager.append_run = MagicMock()
+        file_manager.report_lock = MagicMock()
         self.file_manager = file_manager
     
     def test_happy_case(self):
@@ -39,6 +41,10 @@ class WriteReportTaskTest(unittest.TestCase):
         assert_equals(self.file_manager.get_public_report_path.call_count, 1)
         assert_equals(self.file_manager.coalesce_recurrent_reports.call_count, 1)
         assert_equals(self.file_manager.remove_old_report_files.call_count, 1)
+        self.file_manager.report_lock.assert_called_with('123')
+        self.file_manager.append_run.assert_called_with(
+            '123', today.strftime('%Y-%m-%d'), self.results
+        )
         self.file_manager.write_data.assert_called_with(concatenated_report_filepath,
                                                         json_string(self.results))
     
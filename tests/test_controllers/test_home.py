@@ -12,6 +12,11 @@ class TestHomeController(WebTest):
         response = self.app.get('/about')
         assert_equal(response.status_code, 200)
     
+    def test_db_pool_status(self):
+        response = self.app.get('/status/db-pool')
+        assert_equal(response.status_code, 200)
+        assert_true(response.data.find('checked_out') >= 0)
+    
     def test_favicon(self):
         response = self.app.get('/favicon.ico')
         assert_equal(response.status_code, 200)
@@ -16,9 +16,10 @@ from wikimetrics.models import (
 from wikimetrics.api import PublicReportFileManager
 from wikimetrics.exceptions import InvalidCohort
 from wikimetrics.controllers.reports import (
-    get_celery_task,
+    get_celery_task, get_simple_csv,
 )
 from wikimetrics.configurables import app, queue
+from wikimetrics.enums import Aggregation
 
 
 @contextmanager
@@ -788,6 +789,38 @@ class BasicTests(unittest.TestCase):
         failure = mock_report.get_result_safely('')
         assert_equal(failure['failure'], 'result not available')
 
+    def test_simple_csv_is_streamed_by_line(self):
+        task_result = {
+            Aggregation.IND: {'1|wiki|1': {'edits': 2}},
+            Aggregation.SUM: {'edits': 2},
+        }
+        lines = get_simple_csv(task_result, None, {'Metric': 'Edits'}, lambda keys: {})
+        assert_equal(next(lines), 'user_id,user_name,project,edits\r\n1,,wiki,2\r\n')
+        assert_equal(list(lines), [
+            'Sum,,,2\r\n', ',,,\r\n', ',,,\r\n',
+            'parameters,,,\r\n', 'Metric,Edits,,\r\n',
+        ])
+
+    def test_csv_user_names_are_looked_up_by_chunk(self):
+        task_result = {Aggregation.IND: dict(
+            ('{0}|wiki|1'.format(user_id), {'edits': user_id})
+            for user_id in range(5)
+        )}
+        looked_up = []
+
+        def user_names(wiki_user_keys):
+            looked_up.append(len(wiki_user_keys))
+            return dict((key, 'name-' + key.user_id) for key in wiki_user_keys)
+
+        with patch('wikimetrics.controllers.reports.USER_NAMES_PER_QUERY', 2):
+            lines = get_simple_csv(task_result, None, {}, user_names)
+            first = next(lines)
+            assert_equal(looked_up, [2])
+            rest = list(lines)
+
+        assert_equal(looked_up, [2, 2, 1])
+        assert_equal(len([l for l in [first] + rest if ',name-' in l]), 5)
+
 
 class ProgramMetricsReportControllerTest(ControllerAsyncTest):
 
@@ -1,4 +1,5 @@
 import os
+from tempfile import NamedTemporaryFile
 from unittest import TestCase
 from nose.tools import assert_equals, assert_true
 from nose.plugins.attrib import attr
@@ -6,7 +7,7 @@ from sqlalchemy.event import listen
 
 from tests.fixtures import QueueTest, mediawiki_project
 from wikimetrics.configurables import db, parse_db_connection_string, queue
-from wikimetrics.database import fetch_mw_projects
+from wikimetrics.database import fetch_mw_projects, Database
 from wikimetrics.schedules.daily import get_session_and_leave_open
 from wikimetrics.models import ReportStore, MediawikiUser
 
@@ -60,6 +61,41 @@ class DatabaseSetupTest(TestCase):
         s = db.get_mw_session(mediawiki_project)
         s.execute('select 1').fetchall()
     
+    def test_wikimetrics_pool_status(self):
+        s = db.get_session()
+        s.execute('select 1').fetchall()
+        status = db.get_pool_status()['wikimetrics']
+        assert_true(status['checkouts'] >= 1)
+        assert_true(status['checked_out'] >= 1)
+        assert_true(status['max_wait_time'] <= status['total_wait_time'])
+        s.remove()
+        assert_equals(db.get_pool_status()['wikimetrics']['checked_out'], 0)
+    
+    def test_get_mw_host_map(self):
+        with NamedTemporaryFile() as dblist:
+            dblist.write('# projects on s1\nenwiki\n\nsimplewiki\n')
+            dblist.flush()
+            sharded_db = Database({
+                'MEDIAWIKI_ENGINE_URL_TEMPLATE': 'mysql://u:p@localhost/{0}_p',
+                'MEDIAWIKI_HOST_ENGINE_URL_TEMPLATE': 'mysql://u:p@{0}/',
+                'MEDIAWIKI_HOST_DBLISTS': {'s1.labsdb': dblist.name},
+                'SQL_ECHO': False,
+            })
+            host_map = sharded_db.get_mw_host_map()
+        
+        assert_equals(host_map, {'enwiki': 's1.labsdb', 'simplewiki': 's1.labsdb'})
+        assert_equals(sharded_db.get_mw_host('enwiki'), 's1.labsdb')
+        assert_equals(sharded_db.get_mw_database_name('enwiki'), 'enwiki_p')
+        # projects on the same host share the same pooled engine
+        assert_true(
+            sharded_db.get_mw_engine('enwiki') is
+            sharded_db.get_mw_engine('simplewiki')
+        )
+        assert_equals(sharded_db.get_mw_engine('enwiki').url.host, 's1.labsdb')
+    
+    def test_get_mw_host_map_not_configured(self):
+        assert_equals(Database({}).get_mw_host_map(), {})
+    
     #def test_get_fresh_project_host_map(self):
         #project_host_map_cache_file = 'mw_projects_set.json'
         # # make sure any cached file is deleted
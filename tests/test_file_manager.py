@@ -1,7 +1,10 @@
 import io
 import os
+import shutil
+import tempfile
 import unittest
 import json
+import threading
 from mock import Mock
 from nose.tools import assert_equal, raises, assert_true
 from logging import RootLogger
@@ -101,6 +104,140 @@ class PublicReportFileMangerTest(unittest.TestCase):
         assert_equal({k for k in full_report['result'][Aggregation.IND]}, users_reported)
         assert_equal({k for k in full_report['result'][Aggregation.AVG]['edits']}, dates)
 
+    def test_write_data_leaves_no_temporary_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            file_path = os.path.join(directory, 'report.json')
+            self.api.write_data(file_path, 'first')
+            self.api.write_data(file_path, 'second')
+
+            with open(file_path) as saved_report:
+                assert_equal(saved_report.read(), 'second')
+            assert_equal(os.listdir(directory), ['report.json'])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_coalesce_run(self):
+        self.api.root_dir = tempfile.mkdtemp()
+        try:
+            path = self.api.get_public_report_path('0002', recurrent=True, create=True)
+            parameters = {'Metric_timeseries': 'none', 'Metric_end_date': '2014-07-01'}
+            self.api.write_data(
+                os.path.join(path, COALESCED_REPORT_FILE),
+                json.dumps({
+                    'parameters': parameters,
+                    'result': {Aggregation.SUM: {'edits': {'2014-07-01': 10}}},
+                })
+            )
+            # would break the coalesced report if it was read
+            self.api.write_data(os.path.join(path, '2014-06-30'), 'not json')
+
+            coalesced = self.api.coalesce_run('0002', {
+                'parameters': dict(parameters, Metric_end_date='2014-07-02'),
+                'result': {Aggregation.SUM: {'edits': 12}},
+            })
+
+            assert_equal(coalesced['result'], {
+                Aggregation.SUM: {'edits': {'2014-07-01': 10, '2014-07-02': 12}},
+            })
+            assert_equal(self.logger.exception.call_count, 0)
+        finally:
+            shutil.rmtree(self.api.root_dir)
+
+    def test_coalesce_segments(self):
+        self.api.root_dir = tempfile.mkdtemp()
+        try:
+            parameters = {'Metric_timeseries': 'none'}
+            for day, edits in (('2014-06-30', 3), ('2014-07-01', 10), ('2014-07-02', 12)):
+                self.api.append_run('0003', day, {
+                    'parameters': dict(parameters, Metric_end_date=day),
+                    'result': {Aggregation.SUM: {'edits': edits}},
+                })
+            # a rerun of a day replaces its earlier results
+            self.api.append_run('0003', '2014-07-01', {
+                'parameters': dict(parameters, Metric_end_date='2014-07-01'),
+                'result': {Aggregation.SUM: {'edits': 11}},
+            })
+
+            manifest = self.api.read_manifest('0003')
+            assert_equal(manifest['segments']['2014-07'], {
+                'first': '2014-07-01', 'last': '2014-07-02', 'runs': 3
+            })
+            everything = self.api.coalesce_segments('0003')
+            assert_equal(everything['result'], {Aggregation.SUM: {'edits': {
+                '2014-06-30': 3, '2014-07-01': 11, '2014-07-02': 12
+            }}})
+            july = self.api.coalesce_segments('0003', start='2014-07-01')
+            assert_equal(july['result'], {Aggregation.SUM: {'edits': {
+                '2014-07-01': 11, '2014-07-02': 12
+            }}})
+            # the segments directory is not mistaken for a daily file
+            self.api.remove_old_report_files('0003')
+            assert_equal(self.logger.exception.call_count, 0)
+        finally:
+            shutil.rmtree(self.api.root_dir)
+
+    def test_coalesce_segments_keeps_history(self):
+        self.api.root_dir = tempfile.mkdtemp()
+        try:
+            path = self.api.get_public_report_path('0005', recurrent=True, create=True)
+            parameters = {'Metric_timeseries': 'none'}
+            # a report coalesced before it had segments
+            self.api.write_data(
+                os.path.join(path, COALESCED_REPORT_FILE),
+                json.dumps({
+                    'parameters': dict(parameters, Metric_end_date='2014-06-02'),
+                    'result': {Aggregation.SUM: {'edits': {
+                        '2014-06-01': 1, '2014-06-02': 2
+                    }}},
+                })
+            )
+            assert_equal(
+                self.api.coalesce_segments('0005')['result'],
+                {Aggregation.SUM: {'edits': {'2014-06-01': 1, '2014-06-02': 2}}}
+            )
+
+            self.api.append_run('0005', '2014-06-03', {
+                'parameters': dict(parameters, Metric_end_date='2014-06-03'),
+                'result': {Aggregation.SUM: {'edits': 3}},
+            })
+            everything = self.api.coalesce_segments('0005')
+            assert_equal(everything['result'], {Aggregation.SUM: {'edits': {
+                '2014-06-01': 1, '2014-06-02': 2, '2014-06-03': 3
+            }}})
+            recent = self.api.coalesce_segments('0005', start='2014-06-02')
+            assert_equal(recent['result'], {Aggregation.SUM: {'edits': {
+                '2014-06-02': 2, '2014-06-03': 3
+            }}})
+            assert_equal(self.logger.exception.call_count, 0)
+        finally:
+            shutil.rmtree(self.api.root_dir)
+
+    def test_report_lock_is_exclusive(self):
+        self.api.root_dir = tempfile.mkdtemp()
+        try:
+            acquired = threading.Event()
+
+            def write_other_day():
+                with self.api.report_lock('0004'):
+                    acquired.set()
+
+            with self.api.report_lock('0004'):
+                other = threading.Thread(target=write_other_day)
+                other.start()
+                assert_true(not acquired.wait(0.2))
+            other.join()
+            assert_true(acquired.is_set())
+
+            # the lock file is not mistaken for a run
+            path = self.api.get_public_report_path('0004', recurrent=True)
+            self.api.remove_old_report_files('0004')
+            assert_equal(self.api.coalesce_recurrent_reports('0004'), {})
+            assert_true(os.path.isfile(os.path.join(path, '.lock')))
+            assert_equal(self.logger.exception.call_count, 0)
+        finally:
+            shutil.rmtree(self.api.root_dir)
+
     @raises(PublicReportIOError)
     def test_remove_recurrent_report(self):
         # Attempt to delete a non-existent recurrent report directory
@@ -72,6 +72,22 @@ class BytesAddedTest(DatabaseTest):
         assert_equal(results[self.editors[0].user_id], expected1)
         assert_equal(results[self.editors[1].user_id], expected2)
     
+    def test_fetches_parent_lengths_in_chunks(self):
+        metric = BytesAdded(
+            namespaces=[0],
+            start_date='2013-01-01 00:00:00',
+            end_date='2013-01-03 00:00:00',
+        )
+        metric.parent_chunk_size = 1
+        
+        results = metric(self.editor_ids, self.mwSession)
+        assert_equal(results[self.editors[0].user_id], {
+            'net_sum': -90,
+            'absolute_sum': 110,
+            'positive_only_sum': 10,
+            'negative_only_sum': -100,
+        })
+    
     def test_uses_date_range(self):
         
         metric = BytesAdded(
@@ -1,5 +1,7 @@
 from datetime import datetime
-from nose.tools import assert_true, assert_equal
+from mock import Mock, patch
+from nose.tools import assert_true, assert_equal, assert_raises
+from sqlalchemy.exc import DatabaseError
 from tests.fixtures import QueueDatabaseTest, DatabaseTest, mediawiki_project
 
 from wikimetrics.configurables import db
@@ -81,6 +83,69 @@ class NamespaceEditsDatabaseTest(DatabaseTest):
         )
         assert_true(not metric.validate())
 
+    def test_filters_through_a_temporary_table(self):
+        saved_inline_max = db.config.get('MEDIAWIKI_FILTER_INLINE_MAX')
+        db.config['MEDIAWIKI_FILTER_INLINE_MAX'] = 1
+        try:
+            self.test_filters_out_other_editors()
+            self.test_finds_edits()
+        finally:
+            db.config['MEDIAWIKI_FILTER_INLINE_MAX'] = saved_inline_max
+
+    def test_metric_report_runs_in_chunks(self):
+        saved_inline_max = db.config.get('MEDIAWIKI_FILTER_INLINE_MAX')
+        saved_temp_table_min = db.config.get('MEDIAWIKI_FILTER_TEMP_TABLE_MIN')
+        db.config['MEDIAWIKI_FILTER_INLINE_MAX'] = 1
+        db.config['MEDIAWIKI_FILTER_TEMP_TABLE_MIN'] = 100
+        metric = NamespaceEdits(
+            namespaces=[0],
+            start_date='2012-12-31 22:59:59',
+            end_date='2013-01-01 12:00:00',
+        )
+        try:
+            results = MetricReport(
+                metric, self.cohort.id, self.editor_ids, mediawiki_project
+            ).run()
+        finally:
+            db.config['MEDIAWIKI_FILTER_INLINE_MAX'] = saved_inline_max
+            db.config['MEDIAWIKI_FILTER_TEMP_TABLE_MIN'] = saved_temp_table_min
+
+        assert_equal(len(results), len(self.editor_ids))
+        assert_equal(results[self.editor(0)]['edits'], 3)
+        assert_equal(results[self.editor(1)]['edits'], 1)
+
+    def test_metric_report_drops_temporary_tables(self):
+        saved_inline_max = db.config.get('MEDIAWIKI_FILTER_INLINE_MAX')
+        saved_temp_table_min = db.config.get('MEDIAWIKI_FILTER_TEMP_TABLE_MIN')
+        db.config['MEDIAWIKI_FILTER_INLINE_MAX'] = 1
+        db.config['MEDIAWIKI_FILTER_TEMP_TABLE_MIN'] = 1
+        metric = NamespaceEdits(
+            namespaces=[0],
+            start_date='2012-12-31 22:59:59',
+            end_date='2013-01-01 12:00:00',
+        )
+        hexes = ['{0:032x}'.format(n) for n in range(8)]
+        uuids = [Mock(hex=h) for h in hexes]
+        try:
+            with patch('wikimetrics.metrics.metric.uuid4', side_effect=uuids) as uuid4:
+                results = MetricReport(
+                    metric, self.cohort.id, self.editor_ids, mediawiki_project
+                ).run()
+        finally:
+            db.config['MEDIAWIKI_FILTER_INLINE_MAX'] = saved_inline_max
+            db.config['MEDIAWIKI_FILTER_TEMP_TABLE_MIN'] = saved_temp_table_min
+
+        assert_equal(results[self.editor(0)]['edits'], 3)
+        # revisions and archives each refer to their own table
+        assert_equal(uuid4.call_count, 2)
+        session = db.get_mw_session(mediawiki_project)
+        for h in hexes[:2]:
+            with assert_raises(DatabaseError):
+                session.execute(
+                    'SELECT * FROM wikimetrics_user_ids_{0}'.format(h[:16])
+                )
+            session.rollback()
+
     def test_filters_out_other_editors_with_archive(self):
         self.archive_revisions()
         self.test_filters_out_other_editors()
@@ -0,0 +1,88 @@
+from nose.tools import assert_equal
+
+from tests.fixtures import DatabaseTest, d
+from wikimetrics.utils import format_pretty_date as s
+from wikimetrics.metrics import (
+    ProgramEditMetrics, RollingActiveEditor, PagesCreated, PagesEdited, BytesAdded
+)
+
+
+class ProgramEditMetricsTest(DatabaseTest):
+
+    def setUp(self):
+        DatabaseTest.setUp(self)
+
+        # registration for all the editors below
+        self.r = r = 20140101000000
+        # exactly 30 days after registration
+        self.m = m = 20140131000000
+        self.start_date = s(d(m))
+        self.end_date = s(d(20140201000000))
+
+        self.create_test_cohort(
+            editor_count=4,
+            revisions_per_editor=8,
+            revision_timestamps=[
+                [r + 1, r + 2, r + 3, r + 4, r + 5, m + 6, m + 7, m + 8],
+                [r + 1, r + 2, r + 3, m + 4, m + 5, m + 6, m + 7, m + 8],
+                [r + 1, r + 2, r + 3, r + 4, r + 5, r + 6, r + 7, r + 8],
+                [r + 1, r + 2, r + 3, r + 4, m + 0, m + 6, m + 7, m + 8],
+            ],
+            user_registrations=r,
+            revision_lengths=[
+                [10, 20, 30, 40, 50, 60, 70, 80],
+                [10, 5, 30, 15, 50, 25, 70, 35],
+                [10, 20, 30, 40, 50, 60, 70, 80],
+                [10, 0, 30, 0, 50, 0, 70, 0],
+            ],
+        )
+
+    def assert_same_as_separate_metrics(self):
+        metric = ProgramEditMetrics(
+            namespaces=[0],
+            start_date=self.start_date,
+            end_date=self.end_date,
+        )
+        results = metric(self.editor_ids, self.mwSession)
+
+        separate_metrics = [
+            (RollingActiveEditor(end_date=self.start_date), 'rolling_active_editor'),
+            (PagesCreated(
+                namespaces=[0],
+                start_date=self.start_date,
+                end_date=self.end_date,
+            ), 'pages_created'),
+            (PagesEdited(
+                namespaces=[0],
+                start_date=self.start_date,
+                end_date=self.end_date,
+            ), 'pages_edited'),
+            (BytesAdded(
+                namespaces=[0],
+                start_date=self.start_date,
+                end_date=self.end_date,
+            ), 'absolute_sum'),
+        ]
+        for separate_metric, submetric in separate_metrics:
+            separate_results = separate_metric(self.editor_ids, self.mwSession)
+            for user_id in self.editor_ids:
+                assert_equal(
+                    results[user_id][submetric],
+                    separate_results[user_id][submetric],
+                )
+        return results
+
+    def test_same_as_separate_metrics(self):
+        results = self.assert_same_as_separate_metrics()
+        assert_equal(results[self.editors[0].user_id]['rolling_active_editor'], 1)
+        assert_equal(results[self.editors[1].user_id]['rolling_active_editor'], 0)
+        assert_equal(results[self.editors[0].user_id]['pages_edited'], 1)
+        assert_equal(results[self.editors[2].user_id]['pages_edited'], 0)
+
+    def test_same_as_separate_metrics_with_archives_and_bots(self):
+        self.make_bot(self.editors[2].user_id, self.mwSession)
+        self.archive_revisions()
+        results = self.assert_same_as_separate_metrics()
+        assert_equal(results[self.editors[2].user_id]['rolling_active_editor'], 0)
+        assert_equal(results[self.editors[3].user_id]['rolling_active_editor'], 1)
+        assert_equal(results[self.editors[0].user_id]['absolute_sum'], 0)
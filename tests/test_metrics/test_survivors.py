@@ -149,3 +149,36 @@ class SurvivalTest(DatabaseTest):
             self.e2: {'censored': 0, Survival.id: 0},
             self.e3: {'censored': 0, Survival.id: 0},
         })
+
+
+class SurvivalRegistrationBucketTest(DatabaseTest):
+    
+    def setUp(self):
+        one_hour = timedelta(hours=1)
+        reg = datetime(2013, 1, 1)
+        
+        DatabaseTest.setUp(self)
+        # registered 10 hours apart, so read in the same bucket
+        self.create_test_cohort(
+            editor_count=2,
+            revisions_per_editor=1,
+            user_registrations=[i(reg), i(reg + one_hour * 10)],
+            revision_timestamps=[
+                [i(reg + one_hour * 12)],
+                [i(reg + one_hour * 16)],
+            ],
+            revision_lengths=10
+        )
+        self.e1 = self.editors[0].user_id
+        self.e2 = self.editors[1].user_id
+    
+    def test_each_user_has_their_own_window(self):
+        metric = Survival(
+            namespaces=[0],
+            survival_hours=5,
+            sunset_in_hours=5,
+        )
+        results = metric(self.editor_ids, self.mwSession)
+        
+        assert_equal(results[self.e1][Survival.id], 0)
+        assert_equal(results[self.e2][Survival.id], 1)
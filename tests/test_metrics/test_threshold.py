@@ -130,3 +130,16 @@ class ThresholdTest(DatabaseTest):
         
         assert_equal(results[self.e1][Threshold.time_to_threshold_id], 25, tz_note)
         assert_equal(results[self.e2][Threshold.time_to_threshold_id], None, tz_note)
+    
+    def test_nth_edit_of_each_user(self):
+        metric = Threshold(
+            namespaces=[0],
+            threshold_hours=72,
+            number_of_edits=2,
+        )
+        results = metric(self.editor_ids, self.mwSession)
+        
+        assert_equal(results[self.e1][Threshold.id], True, tz_note)
+        assert_equal(results[self.e2][Threshold.id], True, tz_note)
+        assert_equal(results[self.e1][Threshold.time_to_threshold_id], 25, tz_note)
+        assert_equal(results[self.e2][Threshold.time_to_threshold_id], 40, tz_note)
@@ -2,6 +2,7 @@ from collections import OrderedDict
 from datetime import datetime
 from nose.tools import assert_equals
 from wikimetrics.metrics.timeseries_metric import TimeseriesMetric
+from wikimetrics.metrics import NamespaceEdits
 from wikimetrics.enums import TimeseriesChoices
 from tests.fixtures import DatabaseTest
 
@@ -213,3 +214,52 @@ class TimeseriesTest(DatabaseTest):
         expected['2013-03-01 00:00:00'] = 1
         
         assert_equals(r, {1: {'test': expected}})
+    
+    def test_streamed_results_match_fetching_all_rows(self):
+        self.common_cohort_1()
+        metric = NamespaceEdits(
+            namespaces=[0],
+            start_date='2012-12-31 00:00:00',
+            end_date='2013-01-02 00:00:00',
+            timeseries=TimeseriesChoices.HOUR,
+        )
+        metric.stream_chunk_size = 1
+        streamed = metric(self.editor_ids, self.mwSession)
+        metric.stream_chunk_size = None
+        fetched = metric(self.editor_ids, self.mwSession)
+        
+        assert_equals(streamed, fetched)
+        assert_equals(
+            streamed[self.editors[0].user_id]['edits']['2013-01-01 00:00:00'], 1
+        )
+    
+    def test_split_by_day(self):
+        metric = NamespaceEdits(
+            start_date='2012-12-31 22:59:59',
+            end_date='2013-01-02 12:00:00',
+        )
+        days = [
+            (day.start_date.data, day.end_date.data)
+            for day in metric.split_by_day()
+        ]
+        
+        assert_equals(days, [
+            (datetime(2012, 12, 31, 22, 59, 59), datetime(2013, 1, 1)),
+            (datetime(2013, 1, 1), datetime(2013, 1, 2)),
+            (datetime(2013, 1, 2), datetime(2013, 1, 2, 12)),
+        ])
+        assert_equals(metric.start_date.data, datetime(2012, 12, 31, 22, 59, 59))
+    
+    def test_daily_results_add_up_to_the_window(self):
+        self.common_cohort_1()
+        metric = NamespaceEdits(
+            namespaces=[0],
+            start_date='2012-12-31 00:00:00',
+            end_date='2013-01-02 00:00:00',
+        )
+        by_day = [day(self.editor_ids, self.mwSession) for day in metric.split_by_day()]
+        
+        assert_equals(len(by_day), 2)
+        assert_equals(
+            metric.sum_results(by_day), metric(self.editor_ids, self.mwSession)
+        )
@@ -35,6 +35,11 @@ class CohortStoreTest(DatabaseTest):
         assert_equal(wikiusers[3].mediawiki_userid in user_ids, True)
         assert_equal(len(user_ids), 2)
     
+    def test_projects(self):
+        projects = [project for project, uids in self.cohort.group_by_project()]
+        
+        assert_equal(self.cohort.projects(), projects)
+    
     def test_group_by_project(self):
         wikiusers = self.session.query(WikiUserStore).all()
         print [(w.mediawiki_userid, w.valid, w.mediawiki_username) for w in wikiusers]
@@ -1,9 +1,13 @@
+from mock import Mock
 from nose.tools import assert_equals, assert_true
+from wikimetrics.configurables import db
 from wikimetrics.metrics import metric_classes
 from wikimetrics.models import (
     MultiProjectMetricReport,
 )
-from ..fixtures import QueueDatabaseTest, DatabaseTest
+from ..fixtures import (
+    QueueDatabaseTest, DatabaseTest, mediawiki_project, second_mediawiki_project
+)
 
 
 class MultiProjectMetricReportTest(QueueDatabaseTest):
@@ -61,3 +65,32 @@ class MultiProjectMetricReportWithoutQueueTest(DatabaseTest):
         mr = MultiProjectMetricReport(self.cohort, metric)
         
         assert_true(str(mr).find('MultiProjectMetricReport') >= 0)
+    
+    def test_run_children_in_parallel(self):
+        metric = metric_classes['NamespaceEdits'](
+            name='NamespaceEdits',
+            namespaces=[0, 1, 2],
+            start_date='2013-05-01 00:00:00',
+            end_date='2013-09-01 00:00:00',
+        )
+        mr = MultiProjectMetricReport(self.cohort, metric)
+        mr.children = [
+            Mock(project=project, run=Mock(return_value={key: value}))
+            for project, key, value in [
+                (mediawiki_project, '1|wiki|1', 1),
+                (second_mediawiki_project, '2|wiki2|1', 2),
+                (mediawiki_project, '3|wiki|1', 3),
+            ]
+        ]
+        
+        saved_concurrency = db.config.get('MEDIAWIKI_REPORT_CONCURRENCY')
+        db.config['MEDIAWIKI_REPORT_CONCURRENCY'] = 2
+        try:
+            child_results = mr.run_children()
+        finally:
+            db.config['MEDIAWIKI_REPORT_CONCURRENCY'] = saved_concurrency
+        
+        # results come back in the order of the children, whatever thread ran them
+        assert_equals(child_results, [{'1|wiki|1': 1}, {'2|wiki2|1': 2}, {'3|wiki|1': 3}])
+        for child in mr.children:
+            child.run.assert_called_once_with()
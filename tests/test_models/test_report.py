@@ -2,9 +2,11 @@
 from nose.tools import assert_equals, assert_true, assert_raises
 from wikimetrics.metrics import metric_classes
 from wikimetrics.models import (
-    Report, ReportNode, ReportLeaf, MetricReport, ReportStore, TaskErrorStore
+    Report, ReportNode, ReportLeaf, MetricReport, ReportStore, TaskErrorStore,
+    ReportStatusWriter,
 )
 from wikimetrics.models import queue_task
+from wikimetrics.configurables import queue
 from ..fixtures import QueueDatabaseTest, DatabaseTest
 
 
@@ -84,6 +86,106 @@ class QueueTaskTest(QueueDatabaseTest):
         pr_working = self.session.query(ReportStore).get(fr.persistent_id)
         assert_equals(pr_working.status, 'WORKING')
         assert_equals(pr_working.queue_result_key, '1')
+    
+    def stored_status(self, report):
+        return self.session.query(ReportStore.status)\
+            .filter(ReportStore.id == report.persistent_id)\
+            .scalar()
+    
+    def test_status_writer_buffers_until_flush(self):
+        fr = FakeReport()
+        fr.status_writer = ReportStatusWriter(root_id=fr.persistent_id)
+        fr.set_status('STARTED', task_id='task-1')
+        fr.set_status('SUCCESS')
+        assert_equals(self.stored_status(fr), 'PENDING')
+        
+        fr.status_writer.flush()
+        assert_equals(self.stored_status(fr), 'SUCCESS')
+        pr = self.session.query(ReportStore).get(fr.persistent_id)
+        assert_equals(pr.queue_result_key, 'task-1')
+    
+    def test_status_writer_root_only(self):
+        root = FakeReport()
+        other = FakeReport()
+        writer = ReportStatusWriter(root_id=root.persistent_id, root_only=True)
+        root.status_writer = writer
+        other.status_writer = writer
+        root.set_status('SUCCESS')
+        other.set_status('SUCCESS')
+        writer.flush()
+        
+        assert_equals(self.stored_status(root), 'SUCCESS')
+        assert_equals(self.stored_status(other), 'PENDING')
+    
+    def test_status_writer_different_changes(self):
+        first = FakeReport()
+        second = FakeReport()
+        writer = ReportStatusWriter(root_id=first.persistent_id)
+        first.status_writer = writer
+        second.status_writer = writer
+        first.set_status('SUCCESS', task_id='task-1')
+        second.set_status('FAILURE')
+        writer.flush()
+        
+        assert_equals(self.stored_status(first), 'SUCCESS')
+        assert_equals(self.stored_status(second), 'FAILURE')
+        stored = self.session.query(ReportStore)
+        assert_equals(stored.get(first.persistent_id).queue_result_key, 'task-1')
+        assert_equals(stored.get(second.persistent_id).queue_result_key, None)
+
+
+class DistributedReportTest(QueueDatabaseTest):
+    
+    def setUp(self):
+        QueueDatabaseTest.setUp(self)
+        self.remote = [FakeReport(), FakeReport()]
+        self.local = FakeReport()
+        projects = ListNode(children=self.remote)
+        projects.distribute_children = True
+        self.root = ListNode(children=[projects, self.local], store=True)
+    
+    def test_remote_leaves(self):
+        assert_equals(self.root.remote_leaves(), self.remote)
+    
+    def test_finish_distributed(self):
+        results = self.root.finish_distributed(['remote 1', 'remote 2'])
+        
+        assert_equals(results, [['remote 1', 'remote 2'], 'hello world'])
+        pr = self.session.query(ReportStore).get(self.root.persistent_id)
+        assert_equals(pr.status, 'SUCCESS')
+    
+    def test_failing_leaf_fails_the_tree(self):
+        self.remote[1].callback = fail_leaf
+        saved_distributed = queue.conf.get('DISTRIBUTED_REPORTS')
+        queue.conf['DISTRIBUTED_REPORTS'] = True
+        try:
+            self.root.run()
+        except ValueError:
+            # eager chords can also raise the error of the leaf
+            pass
+        finally:
+            queue.conf['DISTRIBUTED_REPORTS'] = saved_distributed
+        
+        self.session.expire_all()
+        pr = self.session.query(ReportStore).get(self.root.persistent_id)
+        assert_equals(pr.status, 'FAILURE')
+        task_error = TaskErrorStore.get(self.session, 'report', self.root.persistent_id)
+        assert_true(task_error is not None)
+        for leaf in self.remote:
+            pr = self.session.query(ReportStore).get(leaf.persistent_id)
+            assert_equals(pr.status, 'FAILURE')
+
+
+def fail_leaf():
+    raise ValueError('the leaf failed')
+
+
+class ListNode(ReportNode):
+    """
+    A node that returns the results of its children as they are
+    """
+    def finish(self, child_results):
+        return child_results
 
 
 class FakeReport(Report):
@@ -1,7 +1,10 @@
+from mock import patch
 from nose.tools import assert_equals, raises, assert_true, assert_is_not_none
 
 from tests.fixtures import QueueDatabaseTest, d
-from wikimetrics.models import RunProgramMetricsReport, ReportStore, WikiUserStore
+from wikimetrics.models import (
+    RunProgramMetricsReport, ReportStore, WikiUserStore, Revision, Archive
+)
 from wikimetrics.utils import parse_pretty_date, format_pretty_date
 from wikimetrics.enums import Aggregation
 from wikimetrics.api import CohortService
@@ -89,10 +92,17 @@ class RunProgramMetricsReportTest(QueueDatabaseTest):
         jr.task.delay(jr).get()
 
     def test_basic_response(self):
+        self.assert_basic_response(single_scan=False)
+
+    def test_basic_response_with_single_scan(self):
+        self.assert_basic_response(single_scan=True)
+
+    def run_report(self, single_scan):
         jr = RunProgramMetricsReport(self.cohort.id,
                                      parse_pretty_date('2015-01-01 00:00:00'),
                                      parse_pretty_date('2015-01-31 00:00:00'),
                                      self.owner_user_id)
+        jr.single_scan = single_scan
         results = jr.task.delay(jr).get()
         self.session.commit()
         
@@ -102,7 +112,10 @@ class RunProgramMetricsReportTest(QueueDatabaseTest):
         result_key = self.session.query(ReportStore) \
             .get(jr.persistent_id) \
             .result_key
-        results = results[result_key]
+        return results[result_key]
+
+    def assert_basic_response(self, single_scan):
+        results = self.run_report(single_scan)
         assert_equals(
             len(results[Aggregation.SUM]),
             6)
@@ -118,3 +131,34 @@ class RunProgramMetricsReportTest(QueueDatabaseTest):
             results[Aggregation.SUM]['rolling_active_editor'], 0)
         assert_equals(
             results[Aggregation.SUM]['bytes_added'], 10)
+
+    def test_single_scan_matches_separate_reports(self):
+        r = self.r
+        # an edit right on the start date, only in the rolling window
+        self.mwSession.add(Revision(
+            rev_page=self.page.page_id,
+            rev_user=self.editors[1].user_id,
+            rev_timestamp=d(r),
+            rev_len=30,
+            rev_parent_id=0,
+        ))
+        # archived revisions without a page id, on and after the start date
+        self.mwSession.add_all([
+            Archive(ar_user=self.editors[0].user_id, ar_timestamp=d(r),
+                    ar_namespace=0, ar_page_id=None, ar_parent_id=0),
+            Archive(ar_user=self.editors[0].user_id, ar_timestamp=d(r + 10),
+                    ar_namespace=0, ar_page_id=None, ar_parent_id=0),
+            Archive(ar_user=self.editors[1].user_id, ar_timestamp=d(r + 10),
+                    ar_namespace=0, ar_page_id=None, ar_parent_id=None),
+            Archive(ar_user=self.editors[1].user_id, ar_timestamp=d(r + 11),
+                    ar_namespace=1, ar_page_id=None, ar_parent_id=0),
+        ])
+        self.mwSession.commit()
+
+        # keep the cohort for the second run
+        with patch.object(CohortService, 'delete_owner_cohort'):
+            separate_results = self.run_report(single_scan=False)
+        single_scan_results = self.run_report(single_scan=True)
+
+        assert_equals(single_scan_results, separate_results)
+        assert_equals(separate_results[Aggregation.SUM]['pages_created'], 2)
@@ -7,13 +7,15 @@ from celery.exceptions import SoftTimeLimitExceeded
 from celery import states
 
 from tests.fixtures import QueueDatabaseTest, DatabaseTest
+from tests.fixtures import mediawiki_project, second_mediawiki_project
 from wikimetrics.api import ReplicationLagService
 from wikimetrics.models import RunReport, ReportStore, WikiUserStore, CohortWikiUserStore
+from wikimetrics.models import BackfillReport
 from wikimetrics.exceptions import InvalidCohort
 from wikimetrics.metrics import metric_classes
 from wikimetrics.utils import stringify, strip_time
 from wikimetrics.enums import Aggregation, TimeseriesChoices
-from wikimetrics.configurables import queue
+from wikimetrics.configurables import queue, db
 from wikimetrics.schedules.daily import recurring_reports
 
 
@@ -609,20 +611,66 @@ class RunReportScheduledTest(QueueDatabaseTest):
 
         return recurrent_runs
 
-    @patch.object(ReplicationLagService, 'is_any_lagged', return_value=False)
-    def test_scheduler_without_lag(self, is_any_lagged_mock):
+    @patch.object(ReplicationLagService, 'get_lagged_projects', return_value=set())
+    def test_scheduler_without_lag(self, get_lagged_projects_mock):
         recurrent_runs = self.inject_and_fetch_recurrent_run()
 
         # make sure we have one and no more than one recurrent run
         assert_equals(len(recurrent_runs), 1)
 
-    @patch.object(ReplicationLagService, 'is_any_lagged', return_value=True)
-    def test_scheduler_with_lag(self, is_any_lagged_mock):
+    @patch.object(ReplicationLagService, 'get_lagged_projects', return_value=set())
+    def test_scheduler_plans_reports_in_batches(self, get_lagged_projects_mock):
+        saved_batch_size = queue.conf.get('RECURRENT_REPORTS_PER_TASK')
+        queue.conf['RECURRENT_REPORTS_PER_TASK'] = 1
+        try:
+            first_runs = self.inject_and_fetch_recurrent_run()
+            second_runs = self.inject_and_fetch_recurrent_run()
+        finally:
+            queue.conf['RECURRENT_REPORTS_PER_TASK'] = saved_batch_size
+
+        assert_equals(len(first_runs), 1)
+        assert_equals(len(second_runs), 1)
+
+    @patch.object(
+        ReplicationLagService, 'get_lagged_projects',
+        return_value=set([mediawiki_project])
+    )
+    def test_scheduler_with_lag(self, get_lagged_projects_mock):
         recurrent_runs = self.inject_and_fetch_recurrent_run()
 
         # make sure we no recurrent run has been scheduled
         assert_equals(len(recurrent_runs), 0)
 
+    @patch.object(
+        ReplicationLagService, 'get_lagged_projects',
+        return_value=set([second_mediawiki_project])
+    )
+    def test_scheduler_with_lag_on_other_projects(self, get_lagged_projects_mock):
+        recurrent_runs = self.inject_and_fetch_recurrent_run()
+
+        # the cohort only has users on mediawiki_project, so it is not deferred
+        assert_equals(len(recurrent_runs), 1)
+
+    def inject_with_latest_edit(self, latest_edit):
+        saved_check = db.config.get('REPLICATION_LAG_CHECK_COHORT_PROJECTS')
+        db.config['REPLICATION_LAG_CHECK_COHORT_PROJECTS'] = True
+        try:
+            with patch.object(
+                ReplicationLagService, '_latest_edit', return_value=latest_edit
+            ):
+                return self.inject_and_fetch_recurrent_run()
+        finally:
+            db.config['REPLICATION_LAG_CHECK_COHORT_PROJECTS'] = saved_check
+
+    def test_scheduler_with_lag_on_unmonitored_projects(self):
+        # mediawiki_project is not in REPLICATION_LAG_MW_PROJECTS
+        recurrent_runs = self.inject_with_latest_edit(datetime.now() - timedelta(1))
+        assert_equals(len(recurrent_runs), 0)
+
+    def test_scheduler_without_lag_on_unmonitored_projects(self):
+        recurrent_runs = self.inject_with_latest_edit(datetime.now())
+        assert_equals(len(recurrent_runs), 1)
+
     def test_user_id_assigned_properly(self):
         parameters = {
             'name': 'Bytes - test',
@@ -654,3 +702,49 @@ class RunReportScheduledTest(QueueDatabaseTest):
             .filter(ReportStore.user_id == None) \
             .one()[0]
         assert_equals(no_user_id, 0)
+
+    def test_backfill_matches_daily_runs(self):
+        parameters = {
+            'name': 'Edits - test',
+            'cohort': {
+                'id': self.cohort.id,
+                'name': self.cohort.name,
+            },
+            'metric': {
+                'name': 'NamespaceEdits',
+                'namespaces': [0, 1, 2],
+                'start_date': '2013-01-01 00:00:00',
+                'end_date': '2013-01-03 00:00:00',
+                'individualResults': True,
+                'aggregateResults': True,
+                'aggregateSum': True,
+                'aggregateAverage': True,
+                'aggregateStandardDeviation': False,
+            },
+            'recurrent': True,
+        }
+        jr = RunReport(parameters, user_id=self.owner_user_id)
+        jr.task.delay(jr).get()
+        parent = self.session.query(ReportStore).get(jr.persistent_id)
+        parent.created = datetime(2012, 12, 30)
+        self.session.commit()
+
+        day_runs = list(RunReport.create_reports_for_missed_days(
+            parent, self.session, no_more_than=4
+        ))
+        expected = [
+            day_run.task.delay(day_run).get().values()[0] for day_run in day_runs
+        ]
+
+        assert_true(BackfillReport.can_backfill(parent, day_runs))
+        backfill = BackfillReport(parent, day_runs)
+        backfill.task.delay(backfill).get()
+
+        assert_equals(
+            [day_run.created for day_run in backfill.day_runs],
+            [datetime(2012, 12, 30) + timedelta(days=d) for d in range(4)]
+        )
+        assert_equals(
+            [day_run.children[0].results for day_run in backfill.day_runs],
+            expected
+        )
@@ -0,0 +1,62 @@
+import pickle
+import unittest
+from collections import OrderedDict
+from nose.tools import assert_equal, assert_true
+
+from wikimetrics.models import UserResults
+from wikimetrics.utils import NO_RESULTS, stringify
+
+
+class UserResultsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.wiki = UserResults.from_metric_results(
+            {1: {'edits': 2}, 2: {'edits': 3}}, 'wiki', 10
+        )
+        self.wiki2 = UserResults.from_metric_results(
+            {1: {'edits': 4}}, 'wiki2', 10
+        )
+
+    def test_reads_like_a_dictionary(self):
+        assert_equal(len(self.wiki), 2)
+        assert_equal(self.wiki['1|wiki|10'], {'edits': 2})
+        assert_true('2|wiki|10' in self.wiki)
+        assert_true('3|wiki|10' not in self.wiki)
+        assert_equal(self.wiki, {'1|wiki|10': {'edits': 2}, '2|wiki|10': {'edits': 3}})
+
+    def test_stores_columns(self):
+        assert_equal(self.wiki.columns.keys(), [('edits', None)])
+        assert_equal(list(self.wiki.columns[('edits', None)]), [2, 3])
+        assert_equal(self.wiki.groups, [('wiki', '10')])
+
+    def test_timeseries(self):
+        timeseries = OrderedDict()
+        timeseries['2013-01-01 00:00:00'] = 1
+        timeseries['2013-01-02 00:00:00'] = 0
+        results = UserResults.from_metric_results({1: {'edits': timeseries}}, 'wiki', 10)
+
+        assert_equal(results.columns.keys(), [
+            ('edits', '2013-01-01 00:00:00'),
+            ('edits', '2013-01-02 00:00:00'),
+        ])
+        assert_equal(results['1|wiki|10']['edits'].keys(), timeseries.keys())
+
+    def test_merge(self):
+        merged = UserResults.merge([
+            self.wiki, self.wiki2, {NO_RESULTS: {'edits': 0}}
+        ])
+
+        assert_equal(merged, {
+            '1|wiki|10': {'edits': 2},
+            '2|wiki|10': {'edits': 3},
+            '1|wiki2|10': {'edits': 4},
+            NO_RESULTS: {'edits': 0},
+        })
+        assert_equal(list(merged.columns[('edits', None)]), [2, 3, 4])
+        assert_equal(merged.other.keys(), [NO_RESULTS])
+
+    def test_pickle_and_json(self):
+        unpickled = pickle.loads(pickle.dumps(self.wiki))
+
+        assert_equal(unpickled, self.wiki)
+        assert_equal(stringify(results=unpickled), stringify(results=dict(self.wiki)))
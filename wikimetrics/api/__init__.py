@@ -4,6 +4,8 @@ from cohorts import *
 from tags import *
 from replication_lag import *
 from reports import *
+from result_cache import *
+from bot_users import *
 from batch import *
 
 # ignore flake8 because of F403 violation
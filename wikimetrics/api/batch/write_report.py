@@ -1,4 +1,5 @@
 import os
+import json
 import celery
 from celery.exceptions import SoftTimeLimitExceeded
 from celery.utils.log import get_task_logger
@@ -73,22 +74,28 @@ class WriteReportTask(object):
         try:
             # TODO kind of cumbersome api on file_manager, look into simplifying
             self.file_manager.write_data(self.filepath, self.results)
-            self.create_coalesced_report()
-            self.file_manager.remove_old_report_files(self.report_id)
+            data = json.loads(self.results)
+            # runs of other days of this report may be written at the same time
+            with self.file_manager.report_lock(self.report_id):
+                self.file_manager.append_run(self.report_id, self.created_string, data)
+                if queue.conf.get('PUBLIC_REPORT_FULL_FILE', True):
+                    self.create_coalesced_report(data)
+                self.file_manager.remove_old_report_files(self.report_id)
         except SoftTimeLimitExceeded:
             task_logger.error('timeout exceeded for {0}'.format(
                 current_task.request.id
             ))
             raise
     
-    def create_coalesced_report(self):
+    def create_coalesced_report(self, data):
         """
-        Creates coalesced report.
+        Creates coalesced report, by merging the results of this run into the
+        existing coalesced report, see PublicReportFileManager.coalesce_run
         
-        for CR: should we create the report everytime or make sure to create it
-        only if coalesced report on disk is more than one day old?.
+        Parameters:
+            data    : the results of this run, as loaded from json
         """
-        data = self.file_manager.coalesce_recurrent_reports(self.report_id)
+        data = self.file_manager.coalesce_run(self.report_id, data)
         
         if data is not None:
             coalesced_report_file_path = os.path.join(self.path, COALESCED_REPORT_FILE)
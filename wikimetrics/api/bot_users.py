@@ -0,0 +1,83 @@
+import time
+from threading import Lock
+from celery.utils.log import get_task_logger
+from wikimetrics.configurables import db
+from wikimetrics.models.mediawiki import MediawikiUserGroups
+
+
+__all__ = ['BotUserCache', 'bot_user_cache']
+
+task_logger = get_task_logger(__name__)
+
+
+class BotUserCache(object):
+    """
+    Caches the ids of the bots of each project, the users in the 'bot' user group,
+    so the metrics that exclude bots don't read user_groups again for every report.
+    Entries expire after BOT_USER_CACHE_TTL seconds, from the database
+    configuration, and can be invalidated explicitly.  Setting that to 0 disables
+    the cache.
+
+    The cache lives in the memory of each worker process, and can be used from the
+    threads of MultiProjectMetricReport.
+    """
+
+    def __init__(self, ttl=None):
+        """
+        Parameters:
+            ttl : seconds the bots of a project are reused for, defaults to
+                  BOT_USER_CACHE_TTL from the database config
+        """
+        self._ttl = ttl
+        self.lock = Lock()
+        # project -> (expiration time, frozenset of bot user ids)
+        self.entries = {}
+
+    @property
+    def ttl(self):
+        if self._ttl is not None:
+            return self._ttl
+        return db.config.get('BOT_USER_CACHE_TTL', 3600)
+
+    def get(self, project, session):
+        """
+        Returns the ids of the bots of a project, from the cache if they were read
+        less than ttl seconds ago
+
+        Parameters:
+            project : the mediawiki project, None to read the bots without caching
+            session : sqlalchemy session open on the database of that project
+
+        Returns:
+            a frozenset of user ids
+        """
+        if project is not None:
+            with self.lock:
+                entry = self.entries.get(project)
+            if entry is not None and entry[0] > time.time():
+                return entry[1]
+
+        bot_user_ids = frozenset(
+            row[0] for row in session.query(MediawikiUserGroups.ug_user)
+            .filter(MediawikiUserGroups.ug_group == 'bot')
+            .all()
+        )
+        task_logger.info('found {0} bots on {1}'.format(len(bot_user_ids), project))
+
+        if project is not None and self.ttl > 0:
+            with self.lock:
+                self.entries[project] = (time.time() + self.ttl, bot_user_ids)
+        return bot_user_ids
+
+    def invalidate(self, project=None):
+        """
+        Forgets the bots of a project, or of all projects if project is None
+        """
+        with self.lock:
+            if project is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(project, None)
+
+
+bot_user_cache = BotUserCache()
@@ -46,7 +46,7 @@ class CohortService(object):
         else:
             return list(c)
 
-    def get_wikiusernames_for_cohort(self, cohort_id, session):
+    def get_wikiusernames_for_cohort(self, cohort_id, session, user_ids=None):
         """
         Convenience function for the UI to retrieve
         wikiuser names given a cohort_id
@@ -54,6 +54,8 @@ class CohortService(object):
         Parameters:
             cohort_id
             session
+            user_ids    : if not None, only the names of the users of the cohort
+                          with these mediawiki user ids are retrieved
         Returns:
             Dictionary keyed by WikiUserKey or empty dictionary
             if records not found.
@@ -61,10 +63,13 @@ class CohortService(object):
         user_names = {}
 
         try:
-            results = session.query(WikiUserStore.mediawiki_username,
-                                    WikiUserStore.project,
-                                    WikiUserStore.mediawiki_userid)\
-                .filter(WikiUserStore.validating_cohort == cohort_id).all()
+            query = session.query(WikiUserStore.mediawiki_username,
+                                  WikiUserStore.project,
+                                  WikiUserStore.mediawiki_userid)\
+                .filter(WikiUserStore.validating_cohort == cohort_id)
+            if user_ids is not None:
+                query = query.filter(WikiUserStore.mediawiki_userid.in_(user_ids))
+            results = query.all()
 
         except NoResultFound:
             return user_names
@@ -2,8 +2,11 @@ import os
 import os.path
 import json
 import shutil
+import tempfile
 import collections
+import fcntl
 
+from contextlib import contextmanager
 from datetime import timedelta
 from wikimetrics.exceptions import PublicReportIOError
 from wikimetrics.utils import update_dict, parse_date_from_public_report_file, today
@@ -16,6 +19,23 @@ RESERVED_FILENAME_CHARACTERS = {' ', os.sep, ':', '<', '>', '"', '/', '\\', '|',
 # Filename used for coalesced report files
 COALESCED_REPORT_FILE = 'full_report.json'
 
+# Prefix of the files write_data writes to before renaming them
+TEMPORARY_FILE_PREFIX = '.tmp-'
+
+# File of a recurrent report directory locked while its runs are written, see
+# PublicReportFileManager.report_lock.  Like temporary files, it is hidden so it is
+# never mistaken for a run.
+LOCK_FILE = '.lock'
+
+# Directory of a recurrent report holding its runs in monthly segment files, one line
+# of JSON per run, and the manifest listing the segments
+SEGMENTS_DIRECTORY = 'segments'
+SEGMENT_EXTENSION = '.jsonl'
+MANIFEST_FILE = 'manifest.json'
+# File of the segments directory holding the runs coalesced before the first segment
+# was appended, see PublicReportFileManager.seed_segments
+SEED_FILE = 'seed.json'
+
 
 class PublicReportFileManager():
     """
@@ -71,7 +91,9 @@ class PublicReportFileManager():
 
     def write_data(self, file_path, data):
         """
-        Writes data to a given path
+        Writes data to a given path.  The data is first written to a temporary
+        file in the same directory, which is then renamed to file_path, so readers
+        never see a partially written file.
         
         Parameters
            file_path : The path to which we are writing the public report
@@ -81,10 +103,19 @@ class PublicReportFileManager():
             PublicReportIOError
             if an IOError was raised when creating the public report
         """
+        temp_path = None
         try:
-            with open(file_path, 'w') as saved_report:
+            handle, temp_path = tempfile.mkstemp(
+                dir=os.path.dirname(file_path), prefix=TEMPORARY_FILE_PREFIX
+            )
+            with os.fdopen(handle, 'w') as saved_report:
                 saved_report.write(data)
-        except IOError:
+            # mkstemp only lets the owner read the file
+            os.chmod(temp_path, 0644)
+            os.rename(temp_path, file_path)
+        except (IOError, OSError):
+            if temp_path is not None and os.path.isfile(temp_path):
+                os.remove(temp_path)
             msg = 'Could not create public report at: {0}'.format(file_path)
             self.logger.exception(msg)
             raise PublicReportIOError(msg)
@@ -157,6 +188,34 @@ class PublicReportFileManager():
             self.logger.exception(msg)
             raise PublicReportIOError(msg)
 
+    @contextmanager
+    def report_lock(self, report_id):
+        """
+        Context manager holding an exclusive lock on the directory of a recurrent
+        report, so runs of several days of the same report, in parallel tasks or
+        workers, can be written to it safely.  The lock is an flock on LOCK_FILE,
+        so it works between processes sharing the public directory, and between
+        threads of one process.
+
+        Parameters
+            report_id : unique identifier for the recurrent report, a string
+        """
+        path = self.get_public_report_path(report_id, recurrent=True, create=True)
+        lock_path = os.sep.join((path, LOCK_FILE))
+        try:
+            lock_file = open(lock_path, 'a')
+        except IOError:
+            msg = 'Could not open public report lock at: {0}'.format(lock_path)
+            self.logger.exception(msg)
+            raise PublicReportIOError(msg)
+
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+        finally:
+            # closing the file releases the lock
+            lock_file.close()
+
     def remove_old_report_files(self, report_id, days_ago=10):
         """
         Removes the individual (single-day) report files from the report folder
@@ -171,7 +230,9 @@ class PublicReportFileManager():
             raise PublicReportIOError(msg)
 
         for filename in os.listdir(path):
-            if filename != COALESCED_REPORT_FILE:
+            if filename != COALESCED_REPORT_FILE\
+                    and not filename.startswith('.')\
+                    and os.path.isfile(os.sep.join((path, filename))):
                 file_date = parse_date_from_public_report_file(filename)
                 if file_date <= limit_day:
                     full_path = os.sep.join((path, filename))
@@ -200,7 +261,7 @@ class PublicReportFileManager():
 
             # Get a list of filenames with COALESCED_REPORT_FILE at 1st position,
             # so that new individual reports override the current full report.
-            filenames = os.listdir(path)
+            filenames = [f for f in os.listdir(path) if not f.startswith('.')]
             if COALESCED_REPORT_FILE in filenames:
                 filenames.remove(COALESCED_REPORT_FILE)
                 filenames.insert(0, COALESCED_REPORT_FILE)
@@ -226,6 +287,193 @@ class PublicReportFileManager():
             self.logger.exception(msg)
             raise PublicReportIOError(msg)
 
+    def coalesce_run(self, report_id, data):
+        """
+        Merges the results of a single run into the coalesced report of a series of
+        recurrent, public reports.  Only the current coalesced report file is read,
+        instead of the files of every run, so the cost does not grow with the
+        history of the report.  If there is no readable coalesced report yet, this
+        falls back to coalesce_recurrent_reports.
+
+        Parameters
+            report_id : unique identifier for the report, a string
+            data      : the json result of the new run, already written to the
+                        report directory
+
+        Returns
+            A JSON object containing the coalesced reports
+        """
+        path = self.get_public_report_path(report_id, recurrent=True)
+        full_path = os.sep.join((path, COALESCED_REPORT_FILE))
+        try:
+            with open(full_path, 'r') as saved_report:
+                coalesced_reports = json.load(saved_report)
+            _merge_run(coalesced_reports, data)
+            return coalesced_reports
+        except (IOError, ValueError, KeyError):
+            self.logger.info('Coalescing all of public report {0}'.format(report_id))
+            return self.coalesce_recurrent_reports(report_id)
+
+    def get_segments_path(self, report_id, create=False):
+        """
+        Parameters
+           report_id : unique identifier for the recurrent report, a string
+           create : a boolean specifying if this method should create the returned
+                    directory path on the file system
+
+        Returns
+           The path to the directory of the segment files of a recurrent report
+        """
+        path = self.get_public_report_path(report_id, recurrent=True)
+        if create:
+            self.ensure_dir(path, SEGMENTS_DIRECTORY)
+        return os.sep.join((path, SEGMENTS_DIRECTORY))
+
+    def read_manifest(self, report_id):
+        """
+        Reads the manifest of the segment files of a recurrent report
+
+        Parameters
+            report_id : unique identifier for the report, a string
+
+        Returns
+            A dictionary with a 'segments' key, mapping each month, as YYYY-MM,
+            to a dictionary with the first and last dates and the number of runs
+            appended to the segment of that month
+        """
+        manifest_path = os.sep.join((self.get_segments_path(report_id), MANIFEST_FILE))
+        try:
+            with open(manifest_path, 'r') as manifest_file:
+                return json.load(manifest_file)
+        except (IOError, ValueError):
+            return {'segments': {}}
+
+    def append_run(self, report_id, date_string, data):
+        """
+        Appends the results of a single run of a recurrent, public report to the
+        segment file of its month, and updates the manifest.  Unlike the coalesced
+        report, this does not need to read any previous results, except for the
+        first append, which seeds the segments with them, see seed_segments.
+        Running a day again appends it again, and the last run of a day wins when
+        the segments are coalesced.
+
+        Parameters
+            report_id   : unique identifier for the report, a string
+            date_string : the date of the run, as YYYY-MM-DD
+            data        : the json result of the run
+        """
+        path = self.get_segments_path(report_id, create=True)
+        manifest = self.read_manifest(report_id)
+        if not manifest.get('seeded'):
+            self.seed_segments(report_id)
+            manifest['seeded'] = True
+
+        month = date_string[:7]
+        segment_path = os.sep.join((path, month + SEGMENT_EXTENSION))
+        try:
+            with open(segment_path, 'a') as segment:
+                segment.write(json.dumps({'date': date_string, 'run': data}) + '\n')
+        except IOError:
+            msg = 'Could not append to public report segment at: {0}'.format(
+                segment_path)
+            self.logger.exception(msg)
+            raise PublicReportIOError(msg)
+
+        segment_info = manifest['segments'].setdefault(
+            month, {'first': date_string, 'last': date_string, 'runs': 0}
+        )
+        segment_info['first'] = min(segment_info['first'], date_string)
+        segment_info['last'] = max(segment_info['last'], date_string)
+        segment_info['runs'] += 1
+        self.write_data(os.sep.join((path, MANIFEST_FILE)), json.dumps(manifest))
+
+    def seed_segments(self, report_id):
+        """
+        Keeps the runs of a recurrent report from before it had segments, as coalesced
+        by coalesce_recurrent_reports from its full report and run files, in the seed
+        file of its segments.  The segments are coalesced on top of it, so reports
+        that were running before segments existed don't lose their history.
+
+        Parameters
+            report_id : unique identifier for the report, a string
+        """
+        history = self.coalesce_recurrent_reports(report_id)
+        seed_path = os.sep.join((self.get_segments_path(report_id), SEED_FILE))
+        self.write_data(seed_path, json.dumps(history))
+
+    def read_history(self, report_id):
+        """
+        Reads the runs of a recurrent report from before it had segments: its seed
+        file, or if no segment was appended yet, its full report and run files.
+
+        Parameters
+            report_id : unique identifier for the report, a string
+
+        Returns
+            A JSON object containing the coalesced reports
+        """
+        seed_path = os.sep.join((self.get_segments_path(report_id), SEED_FILE))
+        try:
+            with open(seed_path, 'r') as seed:
+                return json.load(seed)
+        except (IOError, ValueError):
+            pass
+
+        if not os.path.isdir(self.get_public_report_path(report_id, recurrent=True)):
+            return {}
+        return self.coalesce_recurrent_reports(report_id)
+
+    def coalesce_segments(self, report_id, start=None, end=None):
+        """
+        Coalesces the runs of a recurrent, public report stored in its segment
+        files, in the same format as coalesce_recurrent_reports.  Only the segments
+        of the months between start and end are read, on top of the runs from
+        before the report had segments, see read_history.
+
+        Parameters
+            report_id : unique identifier for the report, a string
+            start     : the first date to include, as YYYY-MM-DD, None for no limit
+            end       : the last date to include, as YYYY-MM-DD, None for no limit
+
+        Returns
+            A JSON object containing the coalesced reports
+        """
+        coalesced_reports = self.read_history(report_id)
+        _pick_dates(coalesced_reports, start, end)
+        path = self.get_segments_path(report_id)
+        segments = self.read_manifest(report_id)['segments']
+
+        for month in sorted(segments):
+            if start is not None and segments[month]['last'] < start:
+                continue
+            if end is not None and segments[month]['first'] > end:
+                continue
+
+            segment_path = os.sep.join((path, month + SEGMENT_EXTENSION))
+            try:
+                with open(segment_path, 'r') as segment:
+                    for line in segment:
+                        try:
+                            entry = json.loads(line)
+                            if start is not None and entry['date'] < start:
+                                continue
+                            if end is not None and entry['date'] > end:
+                                continue
+                            _merge_run(coalesced_reports, entry['run'])
+
+                        except KeyError, e:
+                            msg = 'Key "{}" not in segment "{}"'.format(e, segment_path)
+                            self.logger.exception(msg)
+                        except ValueError:
+                            msg = 'Error parsing segment "{}"'.format(segment_path)
+                            self.logger.exception(msg)
+            except IOError:
+                msg = 'Could not read public report segment {0}'.format(segment_path)
+                self.logger.exception(msg)
+                raise PublicReportIOError(msg)
+
+        return coalesced_reports
+
 
 def _merge_run(coalesced, data):
     """
@@ -263,3 +511,35 @@ def _merge_run(coalesced, data):
                         }
 
     update_dict(coalesced['result'], data['result'])
+
+
+def _pick_dates(coalesced, start, end):
+    """
+    Helper function, removes the dates outside of start and end from the results of
+    a coalesced report, in place
+
+    Parameters
+        coalesced   : the coalesced report, as returned by coalesce_recurrent_reports
+        start       : the first date to keep, as YYYY-MM-DD, None for no limit
+        end         : the last date to keep, as YYYY-MM-DD, None for no limit
+    """
+    if start is None and end is None:
+        return
+
+    def pick(timeseries):
+        if not isinstance(timeseries, dict):
+            return timeseries
+        return dict(
+            (date, value) for date, value in timeseries.iteritems()
+            if (start is None or date[:10] >= start) and
+            (end is None or date[:10] <= end)
+        )
+
+    for aggregate, results in coalesced.get('result', {}).iteritems():
+        if aggregate == Aggregation.IND:
+            for user_results in results.itervalues():
+                for submetric in user_results:
+                    user_results[submetric] = pick(user_results[submetric])
+        else:
+            for submetric in results:
+                results[submetric] = pick(results[submetric])
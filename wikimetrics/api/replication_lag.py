@@ -1,13 +1,22 @@
+import time
+from threading import Lock
+from multiprocessing.pool import ThreadPool
 from datetime import datetime, timedelta
 
 from wikimetrics.configurables import db
 from wikimetrics.models import Revision
 
 
+# project -> (time of the check, timestamp of the most recent edit), shared by all
+# instances of ReplicationLagService in a process, see ReplicationLagService.get_lags
+_latest_edits = {}
+_latest_edits_lock = Lock()
+
+
 class ReplicationLagService():
     """Service to check replication lag of databases"""
 
-    def __init__(self, mw_projects=None, lag_threshold=None):
+    def __init__(self, mw_projects=None, lag_threshold=None, cache_ttl=None):
         """
         Construct service to check database replication lag
 
@@ -21,6 +30,10 @@ class ReplicationLagService():
                 to be lagging. If None, then REPLICATION_LAG_THRESHOLD from the
                 database configuration gets used. If that is unset, '3 hours'
                 gets used. (default: None)
+            cache_ttl     : seconds during which the most recent edit found in a
+                wiki is reused instead of checking again. If None, then
+                REPLICATION_LAG_CACHE_TTL from the database configuration gets
+                used. If that is unset, 60 gets used. (default: None)
         """
         self._mw_projects = mw_projects
         if self._mw_projects is None:
@@ -31,25 +44,127 @@ class ReplicationLagService():
             self._lag_threshold = timedelta(hours=db.config.get(
                 'REPLICATION_LAG_THRESHOLD', 3))
 
-    def _is_mw_project_lagged(self, mw_project):
+        self._cache_ttl = cache_ttl
+        if self._cache_ttl is None:
+            self._cache_ttl = db.config.get('REPLICATION_LAG_CACHE_TTL', 60)
+
+    def _latest_edit(self, mw_project):
         """
-        Determines whether the given wiki is considered lagged or not.
+        Finds the timestamp of the most recent edit in the given wiki, or None if
+        it has no edits.
 
         Parameters:
             mw_project: Name of the wiki to check.
         """
         session = db.get_mw_session(mw_project)
-        timestamp = session.query(Revision.rev_timestamp)\
+        return session.query(Revision.rev_timestamp)\
             .order_by(Revision.rev_timestamp.desc())\
             .limit(1)\
             .scalar()
 
-        return timestamp is None or \
-            timestamp < datetime.now() - self._lag_threshold
+    def _latest_edit_in_thread(self, mw_project):
+        """
+        Same as _latest_edit, for the threads of get_lags.  Removes the
+        thread-local mediawiki session afterwards so connections are not left
+        behind.
+        """
+        try:
+            return self._latest_edit(mw_project)
+        finally:
+            session = db.mediawiki_sessions.get(mw_project)
+            if session is not None:
+                session.remove()
+
+    def get_lags(self, mw_projects=None):
+        """
+        Computes the replication lag of wikis, as the time since their most recent
+        edit.  Wikis that were not checked in the last cache_ttl seconds are
+        checked concurrently, by up to REPLICATION_LAG_CONCURRENCY threads.  As a
+        cached edit timestamp can only be older than the real one, cached lags are
+        never smaller than the real ones.
+
+        Parameters:
+            mw_projects: Names of the wikis to check.  Defaults to the projects
+                this service was constructed with.
+
+        Returns:
+            dictionary from each wiki to its lag, as a timedelta, or None if the
+            wiki has no edits at all
+        """
+        if mw_projects is None:
+            mw_projects = self._mw_projects
+
+        now = time.time()
+        latest_edits = {}
+        with _latest_edits_lock:
+            for mw_project in mw_projects:
+                checked, latest_edit = _latest_edits.get(mw_project, (None, None))
+                if checked is not None and checked > now - self._cache_ttl:
+                    latest_edits[mw_project] = latest_edit
+        to_check = [p for p in set(mw_projects) if p not in latest_edits]
+
+        if to_check:
+            concurrency = min(
+                len(to_check),
+                db.config.get('REPLICATION_LAG_CONCURRENCY', 8),
+            )
+            if concurrency <= 1:
+                checked_edits = map(self._latest_edit, to_check)
+            else:
+                pool = ThreadPool(concurrency)
+                try:
+                    checked_edits = pool.map(self._latest_edit_in_thread, to_check)
+                finally:
+                    pool.terminate()
+
+            with _latest_edits_lock:
+                for mw_project, latest_edit in zip(to_check, checked_edits):
+                    _latest_edits[mw_project] = (now, latest_edit)
+                    latest_edits[mw_project] = latest_edit
+
+        now = datetime.now()
+        return dict(
+            (mw_project, None if latest_edit is None else now - latest_edit)
+            for mw_project, latest_edit in latest_edits.iteritems()
+        )
+
+    def get_lagged_projects(self, mw_projects=None):
+        """
+        Determines which wikis are considered lagged.  Wikis without any edits
+        are considered lagged.
+
+        Parameters:
+            mw_projects: Names of the wikis to check.  Defaults to the projects
+                this service was constructed with.
+
+        Returns:
+            a set of the names of the lagged wikis
+        """
+        return set(
+            mw_project for mw_project, lag in self.get_lags(mw_projects).iteritems()
+            if lag is None or lag > self._lag_threshold
+        )
+
+    def _is_mw_project_lagged(self, mw_project):
+        """
+        Determines whether the given wiki is considered lagged or not.
+
+        Parameters:
+            mw_project: Name of the wiki to check.
+        """
+        return mw_project in self.get_lagged_projects([mw_project])
 
     def is_any_lagged(self):
         """
         Determines whether any of the default projects are considered lagged or
         not.
         """
-        return any(self._is_mw_project_lagged(p) for p in self._mw_projects)
+        return len(self.get_lagged_projects()) > 0
+
+    @classmethod
+    def clear_cache(cls):
+        """
+        Forgets all the edit timestamps found so far
+        """
+        with _latest_edits_lock:
+            _latest_edits.clear()
@@ -0,0 +1,275 @@
+import json
+import time
+from hashlib import sha1
+from threading import Lock
+from datetime import datetime, timedelta
+from collections import OrderedDict
+from celery.utils.log import get_task_logger
+from wikimetrics.configurables import db, queue
+from wikimetrics.utils import BetterEncoder
+
+
+__all__ = ['MetricResultCache', 'metric_result_cache']
+
+task_logger = get_task_logger(__name__)
+
+# form fields that have no effect on the results of a metric
+IGNORED_PARAMETERS = ('csrf_token', 'name', 'label')
+
+
+class MetricResultCache(object):
+    """
+    Caches the results of metrics run on a project for a set of users, so that
+    reruns and identical reports on the same users don't query the replicas again.
+    Entries are keyed on the content of the computation: the metric class, its
+    parameters, the project, and a hash of the sorted user ids.
+
+    Results are also cached by user, under the key of the metric, its parameters and
+    the project only.  When a cohort changes, only the users without cached
+    results need to be queried, see get_users and set_users.
+
+    Results are only cached if the metric's end_date is older than the replication
+    lag window, as more recent results could still change.  Entries expire after
+    METRIC_CACHE_TTL seconds, and the least recently used entries are evicted to
+    keep the cache under METRIC_CACHE_MAX_RESULTS results by user.  Setting that to
+    0 disables the cache.
+
+    The cache lives in the memory of each worker process, and can be used from the
+    threads of MultiProjectMetricReport.
+    """
+
+    def __init__(self, max_results=None, ttl=None):
+        """
+        Parameters:
+            max_results : maximum number of results by user to keep, defaults
+                          to METRIC_CACHE_MAX_RESULTS from the queue config
+            ttl         : seconds an entry stays valid, defaults to
+                          METRIC_CACHE_TTL from the queue config
+        """
+        self._max_results = max_results
+        self._ttl = ttl
+        self.lock = Lock()
+        # key -> (expiration time, number of results, results by user)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.user_hits = 0
+        self.user_misses = 0
+
+    @property
+    def max_results(self):
+        if self._max_results is not None:
+            return self._max_results
+        return queue.conf.get('METRIC_CACHE_MAX_RESULTS', 0)
+
+    @property
+    def ttl(self):
+        if self._ttl is not None:
+            return self._ttl
+        return queue.conf.get('METRIC_CACHE_TTL', 86400)
+
+    def key(self, metric, project, user_ids):
+        """
+        Computes the cache key of a metric run, or None if its results should not be
+        cached, because the cache is disabled or because they could still change.
+
+        Parameters:
+            metric      : an instance of a Metric class
+            project     : the mediawiki project the metric runs on
+            user_ids    : the user ids the metric runs on, None for the whole project
+
+        Returns:
+            a string, or None
+        """
+        return self.users_key(self.metric_key(metric, project), user_ids)
+
+    def metric_key(self, metric, project):
+        """
+        Computes the part of the cache key that identifies the metric, its parameters,
+        and the project.  This is also the key of the results cached by user.
+
+        Returns:
+            a string, or None if the results of this metric should not be cached
+        """
+        if self.max_results <= 0:
+            return None
+
+        if not self.is_closed_window(metric):
+            with self.lock:
+                self.bypasses += 1
+            task_logger.debug('metric cache bypass for {0} on {1}'.format(
+                type(metric).__name__, project
+            ))
+            return None
+
+        parameters = dict(
+            (name, value) for name, value in metric.data.iteritems()
+            if name not in IGNORED_PARAMETERS
+        )
+        # (start, end] slices, see BackfillReport, are not the default [start, end)
+        if getattr(metric, 'slices_include_end', False):
+            parameters['slices_include_end'] = True
+        return sha1(u'|'.join((
+            type(metric).__name__,
+            json.dumps(parameters, cls=BetterEncoder, sort_keys=True),
+            project,
+        )).encode('utf-8')).hexdigest()
+
+    def users_key(self, metric_key, user_ids):
+        """
+        Adds a hash of the sorted user ids to a metric_key
+
+        Returns:
+            a string, or None if metric_key is None
+        """
+        if metric_key is None:
+            return None
+
+        if user_ids is None:
+            users_hash = 'all'
+        else:
+            users_hash = sha1(','.join(str(i) for i in sorted(user_ids))).hexdigest()
+        return sha1('|'.join((metric_key, users_hash))).hexdigest()
+
+    def is_closed_window(self, metric):
+        """
+        Returns True if the metric ends before the replication lag window, so new
+        edits can not change its results anymore
+        """
+        end_date = getattr(metric, 'end_date', None)
+        end_date = getattr(end_date, 'data', None)
+        if not isinstance(end_date, datetime):
+            return False
+
+        lag_window = timedelta(hours=db.config.get('REPLICATION_LAG_THRESHOLD', 3))
+        return end_date < datetime.now() - lag_window
+
+    def get(self, key):
+        """
+        Returns the cached results by user for this key, or None
+        """
+        if key is None:
+            return None
+
+        with self.lock:
+            entry = self.pop_entry(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                # put the entry back at the most recently used end
+                self.entries[key] = entry
+                self.hits += 1
+
+        task_logger.info('metric cache {0} for {1}'.format(
+            'miss' if entry is None else 'hit', key
+        ))
+        return entry and entry[2]
+
+    def set(self, key, results_by_user):
+        """
+        Caches results by user under this key, evicting the least recently used
+        entries if the cache gets too big.
+        """
+        if key is None:
+            return
+
+        with self.lock:
+            self.pop_entry(key)
+            self.entries[key] = (time.time() + self.ttl, len(results_by_user),
+                                 results_by_user)
+            self.size += len(results_by_user)
+            self.evict()
+
+    def get_users(self, metric_key, user_ids):
+        """
+        Looks up the results of each user cached under a metric_key, see set_users
+
+        Returns:
+            a tuple of a dictionary of the cached results of those users,
+            and the list of the user ids that have no cached results
+        """
+        cached = {}
+        missing = []
+        with self.lock:
+            entry = self.pop_entry(metric_key)
+            if entry is not None:
+                self.entries[metric_key] = entry
+            results_by_user = entry[2] if entry is not None else {}
+
+            for user_id in user_ids:
+                if user_id in results_by_user:
+                    cached[user_id] = results_by_user[user_id]
+                else:
+                    missing.append(user_id)
+            self.user_hits += len(cached)
+            self.user_misses += len(missing)
+
+        task_logger.info('metric cache has {0} of {1} users for {2}'.format(
+            len(cached), len(cached) + len(missing), metric_key
+        ))
+        return cached, missing
+
+    def set_users(self, metric_key, results_by_user, ttl=None):
+        """
+        Adds results to the ones cached by user under a metric_key.  The entry
+        expires ttl seconds after it was first created, METRIC_CACHE_TTL seconds
+        by default.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        with self.lock:
+            entry = self.pop_entry(metric_key)
+            if entry is None:
+                expires, cached = time.time() + ttl, {}
+            else:
+                expires, cached = entry[0], entry[2]
+            cached.update(results_by_user)
+            self.entries[metric_key] = (expires, len(cached), cached)
+            self.size += len(cached)
+            self.evict()
+
+    def pop_entry(self, key):
+        """
+        Removes an entry from the cache and returns it, or None if it is missing or
+        expired.  Must be called with self.lock held.
+        """
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+            if entry[0] < time.time():
+                entry = None
+        return entry
+
+    def evict(self):
+        """
+        Evicts the least recently used entries until the cache is small enough.
+        Must be called with self.lock held.
+        """
+        max_results = self.max_results
+        while self.entries and self.size > max_results:
+            evicted_key, evicted = self.entries.popitem(last=False)
+            self.size -= evicted[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def status_dict(self):
+        """
+        Returns the counters of this cache, for monitoring
+        """
+        return {
+            'entries': len(self.entries),
+            'results': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'bypasses': self.bypasses,
+            'user_hits': self.user_hits,
+            'user_misses': self.user_misses,
+        }
+
+
+metric_result_cache = MetricResultCache()
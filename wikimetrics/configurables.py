@@ -2,7 +2,7 @@ import imp
 import os
 import yaml
 import subprocess
-from celery.signals import task_postrun
+from celery.signals import task_postrun, worker_process_init
 from mwoauth import ConsumerToken
 
 
@@ -212,6 +212,13 @@ def task_postrun(*args, **kwargs):
         session.remove()
 
 
+@worker_process_init.connect()
+def worker_process_init(*args, **kwargs):
+    # pooled connections opened before the worker was forked belong to the parent
+    from . import db
+    db.dispose_pools()
+
+
 def get_absolute_path():
     """
     Returns the path to the wikimetrics checkout root
@@ -1,5 +1,6 @@
 from flask import render_template, send_from_directory, url_for
-from wikimetrics.configurables import app
+from wikimetrics.configurables import app, db
+from wikimetrics.utils import json_response
 from authentication import is_public
 
 
@@ -54,6 +55,14 @@ def favicon():
     return send_from_directory(app.static_folder, 'favicon.ico')
 
 
+@app.route('/status/db-pool')
+def db_pool_status():
+    """
+    Returns the state of this process' database connection pools, as json
+    """
+    return json_response(db.get_pool_status())
+
+
 @app.context_processor
 def override_url_for():
     return dict(url_for=dated_url_for)
@@ -1,6 +1,7 @@
 import json
 from copy import deepcopy
 from csv import DictWriter
+from itertools import islice
 from StringIO import StringIO
 from sqlalchemy import or_
 from sqlalchemy.orm.exc import NoResultFound
@@ -13,10 +14,15 @@ from wikimetrics.models import (
     WikiUserKey, TaskErrorStore, ValidateCohort
 )
 from wikimetrics.utils import (
-    json_response, json_error, json_redirect, thirty_days_ago
+    json_response, json_error, json_redirect, thirty_days_ago,
+    parse_date_from_public_report_file,
 )
 from wikimetrics.enums import Aggregation, TimeseriesChoices
 from wikimetrics.api import PublicReportFileManager, CohortService, CentralAuthService
+from authentication import is_public
+
+# individual results whose user names are looked up together, see individual_results
+USER_NAMES_PER_QUERY = 1000
 
 
 @app.before_request
@@ -212,14 +218,16 @@ def report_result_csv(result_key):
         task_result = pj.get_result_safely(result)
         p = pj.pretty_parameters()
 
-        user_names = get_usernames_for_task_result(task_result)
+        # names are looked up as the individual results are written
+        user_names = user_names_lookup()
 
         if 'Metric_timeseries' in p and p['Metric_timeseries'] != TimeseriesChoices.NONE:
-            csv_io = get_timeseries_csv(task_result, pj, p, user_names)
+            csv_lines = get_timeseries_csv(task_result, pj, p, user_names)
         else:
-            csv_io = get_simple_csv(task_result, pj, p, user_names)
+            csv_lines = get_simple_csv(task_result, pj, p, user_names)
 
-        res = Response(csv_io.getvalue(), mimetype='text/csv')
+        # the lines are written as the response is sent, see stream_csv
+        res = Response(csv_lines, mimetype='text/csv')
         res.headers['Content-Disposition'] =\
             'attachment; filename={0}.csv'.format(pj.name)
         return res
@@ -256,18 +264,61 @@ def get_usernames_for_task_result(task_result):
     return user_names
 
 
+def user_names_lookup():
+    """
+    Returns
+        a function that looks up the names of a list of WikiUserKeys of the same
+        cohort, as a dictionary keyed by WikiUserKey, see individual_results
+    """
+    # the CSV is streamed after the request context is gone
+    cohort_service = g.cohort_service
+
+    def lookup(wiki_user_keys):
+        return cohort_service.get_wikiusernames_for_cohort(
+            wiki_user_keys[0].cohort_id,
+            db.get_session(),
+            user_ids=[wiki_user_key.user_id for wiki_user_key in wiki_user_keys],
+        )
+    return lookup
+
+
+def individual_results(task_result, user_names):
+    """
+    Parameters
+        task_result : the result dictionary from Celery
+        user_names  : a function that looks up the names of a list of WikiUserKeys,
+                      see user_names_lookup
+
+    Returns
+        A generator of a tuple of the WikiUserKey, the user name and the results
+        of each user.  Names are looked up USER_NAMES_PER_QUERY users at a time,
+        as the results are generated, so the names of a large cohort are never
+        all held in memory.
+    """
+    results = task_result.get(Aggregation.IND, {}).iteritems()
+    while True:
+        results_chunk = [
+            (WikiUserKey.fromstr(wiki_user_key_str), row)
+            for wiki_user_key_str, row in islice(results, USER_NAMES_PER_QUERY)
+        ]
+        if not results_chunk:
+            return
+        names = user_names([wiki_user_key for wiki_user_key, row in results_chunk])
+        for wiki_user_key, row in results_chunk:
+            yield wiki_user_key, names.get(wiki_user_key, ''), row
+
+
 def get_timeseries_csv(task_result, pj, parameters, user_names):
     """
     Parameters
         task_result : the result dictionary from Celery
         pj          : a pointer to the permanent job
         parameters  : a dictionary of pj.parameters
-        user_names  : dictionary of user names (keyed by (user_id, project))
+        user_names  : a function that looks up user names, see individual_results
 
     Returns
-        A StringIO instance representing timeseries CSV
+        A generator of the lines of the timeseries CSV, see stream_csv
     """
-    csv_io = StringIO()
     if task_result:
         columns = []
 
@@ -284,65 +335,33 @@ def get_timeseries_csv(task_result, pj, parameters, user_names):
         fieldnames = ['user_id', 'user_name', 'project', 'submetric'] + sorted(columns)
     else:
         fieldnames = ['user_id', 'user_name', 'project', 'submetric']
-    writer = DictWriter(csv_io, fieldnames)
-
-    # collect rows to output in CSV
-    task_rows = []
 
-    # Individual Results
-    if Aggregation.IND in task_result:
+    def task_rows():
+        # Individual Results
         # fold user_id into dict so we can use DictWriter to escape things
-        for wiki_user_key_str, row in task_result[Aggregation.IND].iteritems():
-            wiki_user_key = WikiUserKey.fromstr(wiki_user_key_str)
-            user_id = wiki_user_key.user_id
-            project = wiki_user_key.user_project
-            # careful tuple stores user_id like a string
-            user_name = user_names.get(wiki_user_key, '')
+        for wiki_user_key, user_name, row in individual_results(task_result, user_names):
             for subrow in row.keys():
                 task_row = row[subrow].copy()
-                task_row['user_id'] = user_id
+                task_row['user_id'] = wiki_user_key.user_id
                 task_row['user_name'] = user_name
-                task_row['project'] = project
+                task_row['project'] = wiki_user_key.user_project
                 task_row['submetric'] = subrow
-                task_rows.append(task_row)
-
-    # Aggregate Results
-    if Aggregation.SUM in task_result:
-        row = task_result[Aggregation.SUM]
-        for subrow in row.keys():
-            task_row = row[subrow].copy()
-            task_row['user_id'] = Aggregation.SUM
-            task_row['submetric'] = subrow
-            task_rows.append(task_row)
-
-    if Aggregation.AVG in task_result:
-        row = task_result[Aggregation.AVG]
-        for subrow in row.keys():
-            task_row = row[subrow].copy()
-            task_row['user_id'] = Aggregation.AVG
-            task_row['submetric'] = subrow
-            task_rows.append(task_row)
-
-    if Aggregation.STD in task_result:
-        row = task_result[Aggregation.STD]
-        for subrow in row.keys():
-            task_row = row[subrow].copy()
-            task_row['user_id'] = Aggregation.STD
-            task_row['submetric'] = subrow
-            task_rows.append(task_row)
+                yield task_row
 
-    # generate some empty rows to separate the result
-    # from the parameters
-    task_rows.append({})
-    task_rows.append({})
-    task_rows.append({'user_id': 'parameters'})
+        # Aggregate Results
+        for aggregate in (Aggregation.SUM, Aggregation.AVG, Aggregation.STD):
+            if aggregate in task_result:
+                row = task_result[aggregate]
+                for subrow in row.keys():
+                    task_row = row[subrow].copy()
+                    task_row['user_id'] = aggregate
+                    task_row['submetric'] = subrow
+                    yield task_row
 
-    for key, value in sorted(parameters.items()):
-        task_rows.append({'user_id': key , fieldnames[1]: value})
+        for task_row in parameter_rows(parameters, fieldnames):
+            yield task_row
 
-    writer.writeheader()
-    writer.writerows(task_rows)
-    return csv_io
+    return stream_csv(fieldnames, task_rows())
 
 
 def get_simple_csv(task_result, pj, parameters, user_names):
@@ -351,13 +370,11 @@ def get_simple_csv(task_result, pj, parameters, user_names):
         task_result : the result dictionary from Celery
         pj          : a pointer to the permanent job
         parameters  : a dictionary of pj.parameters
-        user_names  : dictionary of user names (keyed by WikiUserKey)
+        user_names  : a function that looks up user names, see individual_results
 
     Returns
-        A StringIO instance representing simple CSV
+        A generator of the lines of the simple CSV, see stream_csv
     """
-
-    csv_io = StringIO()
     if task_result:
         columns = []
 
@@ -374,54 +391,67 @@ def get_simple_csv(task_result, pj, parameters, user_names):
         fieldnames = ['user_id', 'user_name', 'project'] + columns
     else:
         fieldnames = ['user_id', 'user_name', 'project']
-    writer = DictWriter(csv_io, fieldnames)
 
-    # collect rows to output in CSV
-    task_rows = []
-    # Individual Results
-    if Aggregation.IND in task_result:
+    def task_rows():
+        # Individual Results
         # fold user_id into dict so we can use DictWriter to escape things
-        for wiki_user_key_str, row in task_result[Aggregation.IND].iteritems():
-            wiki_user_key = WikiUserKey.fromstr(wiki_user_key_str)
-            user_id = wiki_user_key.user_id
-            project = wiki_user_key.user_project
-
-            # careful tuple stores user_id like a string
-            user_name = user_names.get(wiki_user_key, '')
+        for wiki_user_key, user_name, row in individual_results(task_result, user_names):
             task_row = row.copy()
-            task_row['user_id'] = user_id
+            task_row['user_id'] = wiki_user_key.user_id
             task_row['user_name'] = user_name
-            task_row['project'] = project
-            task_rows.append(task_row)
+            task_row['project'] = wiki_user_key.user_project
+            yield task_row
+
+        # Aggregate Results
+        for aggregate in (Aggregation.SUM, Aggregation.AVG, Aggregation.STD):
+            if aggregate in task_result:
+                task_row = task_result[aggregate].copy()
+                task_row['user_id'] = aggregate
+                yield task_row
 
-    # Aggregate Results
-    if Aggregation.SUM in task_result:
-        task_row = task_result[Aggregation.SUM].copy()
-        task_row['user_id'] = Aggregation.SUM
-        task_rows.append(task_row)
+        for task_row in parameter_rows(parameters, fieldnames):
+            yield task_row
 
-    if Aggregation.AVG in task_result:
-        task_row = task_result[Aggregation.AVG].copy()
-        task_row['user_id'] = Aggregation.AVG
-        task_rows.append(task_row)
+    return stream_csv(fieldnames, task_rows())
 
-    if Aggregation.STD in task_result:
-        task_row = task_result[Aggregation.STD].copy()
-        task_row['user_id'] = Aggregation.STD
-        task_rows.append(task_row)
 
+def parameter_rows(parameters, fieldnames):
+    """
+    Generates the rows listing the parameters of a report, at the end of its CSV
+    """
     # generate some empty rows to separate the result
     # from the parameters
-    task_rows.append({})
-    task_rows.append({})
-    task_rows.append({'user_id': 'parameters'})
+    yield {}
+    yield {}
+    yield {'user_id': 'parameters'}
 
     for key, value in sorted(parameters.items()):
-        task_rows.append({'user_id': key , fieldnames[1]: value})
+        yield {'user_id': key , fieldnames[1]: value}
+
+
+def stream_csv(fieldnames, rows):
+    """
+    Writes rows as CSV one at a time, so a Response can send them as they are
+    generated instead of holding the whole file in memory
+
+    Parameters
+        fieldnames  : the columns of the CSV
+        rows        : an iterable of dictionaries keyed by fieldnames
 
+    Returns
+        A generator of the header line followed by the line of each row
+    """
+    csv_io = StringIO()
+    writer = DictWriter(csv_io, fieldnames)
     writer.writeheader()
-    writer.writerows(task_rows)
-    return csv_io
+    for row in rows:
+        writer.writerow(row)
+        # the header goes out with the first row
+        yield csv_io.getvalue()
+        csv_io.seek(0)
+        csv_io.truncate()
+    if csv_io.tell():
+        yield csv_io.getvalue()
 
 
 @app.route('/reports/result/<result_key>.json')
@@ -473,6 +503,34 @@ def rerun_report(report_id):
     return json_response(message='Report scheduled for rerun')
 
 
+@app.route('/reports/public/<int:report_id>/full_report.json')
+@is_public
+def public_report_json(report_id):
+    """
+    Serves the coalesced results of a public, recurrent report from its monthly
+    segment files, see PublicReportFileManager.append_run.  Unlike the static
+    full_report.json, the start_date and end_date query parameters, as YYYY-MM-DD,
+    restrict it to a range of days without reading the rest of its history.
+    """
+    session = db.get_session()
+    report = session.query(ReportStore).get(report_id)
+    if report is None or not report.public or not report.recurrent:
+        return json_error('no public recurrent report with id: {0}'.format(report_id))
+
+    start = request.args.get('start_date')
+    end = request.args.get('end_date')
+    try:
+        for date_string in (start, end):
+            if date_string is not None:
+                parse_date_from_public_report_file(date_string)
+    except ValueError:
+        return json_error('dates must be formatted as YYYY-MM-DD')
+
+    return json_response(
+        g.file_manager.coalesce_segments(report_id, start=start, end=end)
+    )
+
+
 # @app.route('/reports/kill/<result_key>')
 # def report_kill(result_key):
 #     return 'not implemented'
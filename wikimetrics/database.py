@@ -7,7 +7,8 @@ It uses Flask's handy config module to configure itself.
 import json
 import os
 
-from threading import Lock
+from time import time
+from threading import Lock, BoundedSemaphore
 from os.path import exists
 from urllib2 import urlopen
 
@@ -16,7 +17,8 @@ from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import exc
 from sqlalchemy import event
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import NullPool, QueuePool
+from sqlalchemy.engine.url import make_url
 
 __all__ = [
     'Database',
@@ -37,6 +39,58 @@ class SerializableBase(object):
         return {c.name : getattr(self, c.name) for c in self.__table__.columns}
 
 
+class MeasuredQueuePool(QueuePool):
+    """
+    A QueuePool that keeps track of how many connections were checked out and of how
+    long callers waited to get them, including the time to open new connections.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(MeasuredQueuePool, self).__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def _do_get(self):
+        start = time()
+        try:
+            return super(MeasuredQueuePool, self)._do_get()
+        finally:
+            wait_time = time() - start
+            self.checkouts += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+
+    def status_dict(self):
+        """
+        Returns:
+            dictionary with the current state of the pool and its wait times in seconds
+        """
+        return {
+            'size': self.size(),
+            'checked_out': self.checkedout(),
+            'overflow': self.overflow(),
+            'checkouts': self.checkouts,
+            'total_wait_time': self.total_wait_time,
+            'max_wait_time': self.max_wait_time,
+        }
+
+
+def ping_connection(dbapi_connection, connection_record, connection_proxy):
+    """
+    Pool checkout listener that makes sure pooled connections are still alive.
+    Raising DisconnectionError makes the pool discard the connection and try
+    the checkout again with a new one.
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('SELECT 1')
+    except Exception:
+        raise exc.DisconnectionError()
+    finally:
+        cursor.close()
+
+
 class Database(object):
     """
     Basically a collection of all database related objects and methods.
@@ -63,13 +117,16 @@ class Database(object):
 
         self.mediawiki_engines = {}
         self.mediawiki_sessions = {}
+        self.mediawiki_host_engines = {}
+        self.mediawiki_host_semaphores = {}
 
         self.centralauth_engine = None
         self.centralauth_sessionmaker = None
         self.centralauth_session = None
 
-        # we instantiate mw_project_set lazily
+        # we instantiate mw_project_set and mw_host_map lazily
         self.mw_project_set = None
+        self.mw_host_map = None
 
     def get_engine(self):
         """
@@ -82,16 +139,51 @@ class Database(object):
             # If changing the parameters to create_engine below, be
             # sure to also reflect them in
             # database_migrations/env.py's create_engine.
+            # The pool parameters are the exception, migrations don't need a pool.
             self.wikimetrics_engine = create_engine(
                 self.config['WIKIMETRICS_ENGINE_URL'],
                 echo=self.config['SQL_ECHO'],
                 connect_args={"charset" : "utf8"},
-                # pool_size=self.config['WIKIMETRICS_POOL_SIZE'],
-                poolclass=NullPool,
+                poolclass=MeasuredQueuePool,
+                pool_size=self.config.get('WIKIMETRICS_POOL_SIZE', 5),
+                max_overflow=self.config.get('WIKIMETRICS_POOL_MAX_OVERFLOW', 10),
+                pool_timeout=self.config.get('WIKIMETRICS_POOL_TIMEOUT', 30),
+                pool_recycle=self.config.get('WIKIMETRICS_POOL_RECYCLE', 3600),
             )
+            if self.config.get('WIKIMETRICS_POOL_PRE_PING', True):
+                event.listen(self.wikimetrics_engine, 'checkout', ping_connection)
 
         return self.wikimetrics_engine
 
+    def get_pool_status(self):
+        """
+        Reports on the connection pools of the wikimetrics engine and of the pooled
+        mediawiki host engines that have been created so far.
+
+        Returns:
+            dictionary from 'wikimetrics' or a mediawiki host name to the
+            MeasuredQueuePool.status_dict of its engine's pool
+        """
+        engines = dict(self.mediawiki_host_engines)
+        engines['wikimetrics'] = self.get_engine()
+        return {
+            name: engine.pool.status_dict()
+            for name, engine in engines.items()
+            if isinstance(engine.pool, MeasuredQueuePool)
+        }
+
+    def dispose_pools(self):
+        """
+        Closes all the pooled connections.  Pools are re-created empty, so they can
+        still be used.  Processes forked after connections were opened, like celery
+        workers, should call this first so they never share a connection with their
+        parent process.
+        """
+        if self.wikimetrics_engine is not None:
+            self.wikimetrics_engine.dispose()
+        for host, engine in self.mediawiki_host_engines.items():
+            engine.dispose()
+
     def get_session(self):
         """
         On the first run, instantiates the Wikimetrics session maker
@@ -133,13 +225,24 @@ class Database(object):
         if project not in self.mediawiki_sessions:
             import wikimetrics.models.mediawiki
             engine = self.get_mw_engine(project)
-            if self.config['DEBUG']:
+            mw_sessionmaker = sessionmaker(engine)
+
+            if project in self.get_mw_host_map():
+                # the engine is shared by all projects on the host, so every
+                # connection the session checks out has to select its database
+                database = self.get_mw_database_name(project)
+
+                def use_project_database(session, transaction, connection):
+                    connection.execute('USE `{0}`'.format(database))
+                event.listen(mw_sessionmaker, 'after_begin', use_project_database)
+
+            elif self.config['DEBUG']:
                 self.MediawikiBase.metadata.create_all(
                     engine,
                     checkfirst=True
                 )
 
-            self.mediawiki_sessions[project] = scoped_session(sessionmaker(engine))
+            self.mediawiki_sessions[project] = scoped_session(mw_sessionmaker)
 
         # an unhandled exception would leave the session in a bad state, roll it back:
         if not self.mediawiki_sessions[project].is_active:
@@ -155,8 +258,16 @@ class Database(object):
 
         Returns:
             new or cached sqlalchemy engine connected to the appropriate database.
+            For projects listed in MEDIAWIKI_HOST_DBLISTS this is the pooled engine
+            shared by all the projects on the same host, and it is not connected to
+            any database in particular, so use get_mw_session to query these.
         """
         if project not in self.mediawiki_engines:
+            host = self.get_mw_host_map().get(project)
+            if host is not None:
+                self.mediawiki_engines[project] = self.get_mw_host_engine(host)
+                return self.mediawiki_engines[project]
+
             engine_template = self.config['MEDIAWIKI_ENGINE_URL_TEMPLATE']
 
             self.mediawiki_engines[project] = create_engine(
@@ -166,14 +277,111 @@ class Database(object):
                 # because we are hitting 900 projects in parallel at the same time,
                 # pooling does not work as we exhaust our allowed connections for the
                 # labsdb user.  This is because we connect with database-specific URIs
-                # TODO: connect to all mediawiki databases with one generic URI and
-                #       re-enable pooling
-                # NOTE: when doing this, don't use s4.labsdb as quarry has dibs :)
+                # NOTE: projects listed in MEDIAWIKI_HOST_DBLISTS connect with one
+                #       generic URI per host and are pooled, see get_mw_host_engine
                 poolclass=NullPool,
             )
 
         return self.mediawiki_engines[project]
 
+    def get_mw_host_engine(self, host):
+        """
+        Create a pooled sqlalchemy engine for a mediawiki database host.  The engine
+        is connected with MEDIAWIKI_HOST_ENGINE_URL_TEMPLATE, which does not name a
+        database, so a single pool of at most MEDIAWIKI_POOL_SIZE connections
+        (plus MEDIAWIKI_POOL_MAX_OVERFLOW) serves all the projects on the host.
+
+        Parameters:
+            host    : name of the database host, as used in MEDIAWIKI_HOST_DBLISTS
+
+        Returns:
+            new or cached sqlalchemy engine connected to the host
+        """
+        with lock:
+            if host not in self.mediawiki_host_engines:
+                engine_template = self.config['MEDIAWIKI_HOST_ENGINE_URL_TEMPLATE']
+
+                self.mediawiki_host_engines[host] = create_engine(
+                    engine_template.format(host),
+                    echo=self.config['SQL_ECHO'],
+                    convert_unicode=True,
+                    poolclass=MeasuredQueuePool,
+                    pool_size=self.config.get('MEDIAWIKI_POOL_SIZE', 5),
+                    max_overflow=self.config.get('MEDIAWIKI_POOL_MAX_OVERFLOW', 0),
+                    pool_recycle=self.config.get('MEDIAWIKI_POOL_RECYCLE', 3600),
+                )
+            return self.mediawiki_host_engines[host]
+
+    def get_mw_host_map(self):
+        """
+        Reads the dblist files configured in MEDIAWIKI_HOST_DBLISTS, a dictionary
+        from database host to the path of a dblist file.  A dblist file has one
+        project per line, and lines starting with # are ignored.
+        The files are read only the first time this is called.
+
+        Returns:
+            dictionary from project name to the host that serves it, empty if
+            MEDIAWIKI_HOST_DBLISTS is not configured
+        """
+        with lock:
+            if self.mw_host_map is None:
+                mw_host_map = {}
+                dblists = self.config.get('MEDIAWIKI_HOST_DBLISTS') or {}
+                for host, dblist in dblists.items():
+                    with open(dblist) as projects:
+                        for line in projects:
+                            project = line.strip()
+                            if project and not project.startswith('#'):
+                                mw_host_map[project] = host
+
+                self.mw_host_map = mw_host_map
+            return self.mw_host_map
+
+    def get_mw_database_name(self, project):
+        """
+        Parameters:
+            project : string name of the mediawiki project (for example: wiki, arwiki)
+
+        Returns:
+            the name of the project's database, as given by
+            MEDIAWIKI_ENGINE_URL_TEMPLATE (for example: arwiki_p)
+        """
+        engine_template = self.config['MEDIAWIKI_ENGINE_URL_TEMPLATE']
+        return make_url(engine_template.format(project)).database
+
+    def get_mw_host(self, project):
+        """
+        Parameters:
+            project : string name of the mediawiki project (for example: wiki, arwiki)
+
+        Returns:
+            the name of the database host that serves the project
+        """
+        host = self.get_mw_host_map().get(project)
+        if host is not None:
+            return host
+        return self.get_mw_engine(project).url.host
+
+    def get_mw_host_semaphore(self, project):
+        """
+        Get the semaphore that bounds how many queries this process runs at the
+        same time against the database host of a project.  The bound is configured
+        with MEDIAWIKI_HOST_CONCURRENCY and defaults to 1.
+
+        Parameters:
+            project : string name of the mediawiki project (for example: wiki, arwiki)
+
+        Returns:
+            a threading.BoundedSemaphore shared by all projects on the same host
+        """
+        host = self.get_mw_host(project)
+        with lock:
+            if host not in self.mediawiki_host_semaphores:
+                self.mediawiki_host_semaphores[host] = BoundedSemaphore(
+                    self.config.get('MEDIAWIKI_HOST_CONCURRENCY', 1)
+                )
+            return self.mediawiki_host_semaphores[host]
+
     def get_ca_session(self):
         """
         On the first run, instantiates the centralauth session maker.
@@ -12,6 +12,7 @@ from newly_registered import *
 from rolling_active_editor import *
 from rolling_new_active_editor import *
 from rolling_surviving_new_active_editor import *
+from program_edit_metrics import *
 
 # ignore flake8 because of F403 violation
 # flake8: noqa
@@ -1,5 +1,3 @@
-from sqlalchemy import func, case, cast, Integer
-from sqlalchemy.sql.expression import label
 from wtforms.validators import Required
 
 from wikimetrics.utils import thirty_days_ago, today
@@ -23,38 +21,32 @@ class BytesAdded(TimeseriesMetric):
         * positive_only_sum : bytes added
         * negative_only_sum : bytes removed
     
-    This is the sql query that sqlalchemy generates from our Bytes Added logic
+    The byte changes are computed in two phases, so the revision table is only
+    read through its indexes.  First the revisions of the cohort in the window:
     
-     SELECT anon_1.rev_user AS anon_1_rev_user,
-            sum(anon_1.byte_change) AS net_sum,
-            sum(abs(anon_1.byte_change)) AS absolute_sum,
-            sum(CASE
-                    WHEN (anon_1.byte_change > 0)
-                    THEN anon_1.byte_change
-                    ELSE 0 END
-               ) AS positive_only_sum,
-            sum(CASE
-                    WHEN (anon_1.byte_change < 0)
-                    THEN anon_1.byte_change
-                    ELSE 0 END
-               ) AS negative_only_sum
-       FROM (SELECT revision.rev_user AS rev_user,
-                    (   cast(revision.rev_len as signed)
-                        - cast(coalesce(anon_2.rev_len, 0) as signed)
-                    ) AS byte_change
-               FROM revision
-                        INNER JOIN
-                    page        ON page.page_id = revision.rev_page
-                        LEFT OUTER JOIN
-                    (SELECT revision.rev_id AS rev_id,
-                            revision.rev_len AS rev_len
-                       FROM revision
-                    ) AS anon_2 ON revision.rev_parent_id = anon_2.rev_id
-              WHERE page.page_namespace IN ('0')
-                AND revision.rev_user IN (3174352)
-                AND revision.rev_timestamp BETWEEN '2013-06-18' AND '2013-07-18'
-            ) AS anon_1
-      GROUP BY anon_1.rev_user
+     SELECT revision.rev_user,
+            revision.rev_timestamp,
+            revision.rev_len,
+            revision.rev_parent_id
+       FROM revision
+                INNER JOIN
+            page        ON page.page_id = revision.rev_page
+      WHERE page.page_namespace IN ('0')
+        AND revision.rev_user IN (3174352)
+        AND revision.rev_timestamp > '2013-06-18'
+        AND revision.rev_timestamp <= '2013-07-18'
+    
+    then the lengths of their parents, by primary key, see Metric.parent_lengths:
+    
+     SELECT rev_id, rev_len
+       FROM revision
+      WHERE rev_id IN (<parent ids>)
+    
+    The byte change of a revision is its length minus the length of its parent, or
+    its length if it has no parent.  The sums are added up in python, by user and
+    by timeseries slice.  This used to be a single query, outer joined to a derived
+    table of the whole revision table to find the parent lengths, which MySQL
+    materialized in full.
     """
     show_in_ui          = True
     id                  = 'bytes-added'
@@ -65,6 +57,7 @@ class BytesAdded(TimeseriesMetric):
                        contributed or removed from a mediawiki project'
     # filled in below as the default depends on options
     default_result  = {}
+    additive        = True
     
     namespaces          = CommaSeparatedIntegerListField(
         None,
@@ -93,65 +86,60 @@ class BytesAdded(TimeseriesMetric):
         start_date = self.start_date.data
         end_date = self.end_date.data
         
-        PreviousRevision = session.query(Revision.rev_len, Revision.rev_id).subquery()
-        query = session.query(
+        revisions = session.query(
             Revision.rev_user,
             Revision.rev_timestamp,
-            label(
-                'byte_change',
-                cast(Revision.rev_len, Integer) -
-                cast(func.coalesce(PreviousRevision.c.rev_len, 0), Integer)
-            ),
+            Revision.rev_len,
+            Revision.rev_parent_id,
         )\
             .join(Page)\
-            .outerjoin(
-                PreviousRevision,
-                Revision.rev_parent_id == PreviousRevision.c.rev_id)\
             .filter(Page.page_namespace.in_(self.namespaces.data))\
             .filter(Revision.rev_timestamp > start_date)\
             .filter(Revision.rev_timestamp <= end_date)
-
-        query = self.filter(query, user_ids)
-        BC = query.subquery()
+        revisions = self.filter(revisions, user_ids)\
+            .execution_options(stream_results=True)\
+            .yield_per(self.revisions_chunk_size)
+        
+        # only what the sums need is kept from the streamed revisions
+        changes = [
+            (rev_user, self.date_pieces(rev_timestamp), rev_len, rev_parent_id)
+            for rev_user, rev_timestamp, rev_len, rev_parent_id in revisions
+            if rev_len is not None
+        ]
+        parent_lengths = self.parent_lengths(
+            session, set(change[3] for change in changes if change[3])
+        )
         
-        bytes_added_by_user = session.query(BC.c.rev_user).group_by(BC.c.rev_user)
+        # net, absolute, positive only and negative only sums by user and date slice
+        sums = {}
+        for rev_user, date_pieces, rev_len, rev_parent_id in changes:
+            byte_change = rev_len - (parent_lengths.get(rev_parent_id) or 0)
+            key = (rev_user, date_pieces)
+            user_sums = sums.get(key)
+            if user_sums is None:
+                user_sums = sums[key] = [0, 0, 0, 0]
+            user_sums[0] += byte_change
+            user_sums[1] += abs(byte_change)
+            if byte_change > 0:
+                user_sums[2] += byte_change
+            else:
+                user_sums[3] += byte_change
         
         # add submetrics as columns to the output
         submetrics = []
+        sum_indexes = []
         index = 1
-        if self.net_sum.data:
-            submetrics.append(('net_sum', index, 0))
-            bytes_added_by_user = bytes_added_by_user.add_column(
-                func.sum(BC.c.byte_change).label('net_sum')
-            )
-            index += 1
+        for sum_index, name in enumerate(
+                ('net_sum', 'absolute_sum', 'positive_only_sum', 'negative_only_sum')):
+            if getattr(self, name).data:
+                submetrics.append((name, index, 0))
+                sum_indexes.append(sum_index)
+                index += 1
         
-        if self.absolute_sum.data:
-            submetrics.append(('absolute_sum', index, 0))
-            bytes_added_by_user = bytes_added_by_user.add_column(
-                func.sum(func.abs(BC.c.byte_change)).label('absolute_sum'),
-            )
-            index += 1
-        
-        if self.positive_only_sum.data:
-            submetrics.append(('positive_only_sum', index, 0))
-            bytes_added_by_user = bytes_added_by_user.add_column(
-                func.sum(case(
-                    [(BC.c.byte_change > 0, BC.c.byte_change)], else_=0
-                )).label('positive_only_sum'),
-            )
-            index += 1
-        
-        if self.negative_only_sum.data:
-            submetrics.append(('negative_only_sum', index, 0))
-            bytes_added_by_user = bytes_added_by_user.add_column(
-                func.sum(case(
-                    [(BC.c.byte_change < 0, BC.c.byte_change)], else_=0
-                )).label('negative_only_sum'),
-            )
-            index += 1
-
         self.default_result = {s[0]: s[2] for s in submetrics}
-
-        query = self.apply_timeseries(bytes_added_by_user, column=BC.c.rev_timestamp)
-        return self.results_by_user(user_ids, query, submetrics, date_index=index)
+        
+        rows = [
+            (rev_user,) + tuple(values[i] for i in sum_indexes) + date_pieces
+            for (rev_user, date_pieces), values in sums.iteritems()
+        ]
+        return self.results_by_user(user_ids, rows, submetrics, date_index=index)
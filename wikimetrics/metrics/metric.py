@@ -1,5 +1,11 @@
+from uuid import uuid4
+from datetime import timedelta
+from sqlalchemy import Table, Column, MetaData, select
+from sqlalchemy.dialects.mysql import INTEGER
+from wikimetrics.configurables import db
 from wikimetrics.forms import WikimetricsSecureForm
-from wikimetrics.models import Revision
+from wikimetrics.models import Revision, Page, MediawikiUser
+from wikimetrics.utils import chunk
 
 
 class Metric(WikimetricsSecureForm):
@@ -22,6 +28,20 @@ class Metric(WikimetricsSecureForm):
     description     = None  # basic description of what the metric does
     default_result  = {}    # if results are empty, default to this
     
+    # the project the metric runs on, if known, see bot_user_ids
+    project         = None
+    
+    # users registered at most this many hours apart are read in the same query by
+    # revisions_in_windows, which streams revisions_chunk_size rows at a time
+    registration_bucket_hours = 24
+    revisions_chunk_size = 10000
+    
+    # number of parent revisions fetched by primary key at a time, see parent_lengths
+    parent_chunk_size = 10000
+    
+    # names of the temporary tables created by user_ids_table, until they're dropped
+    user_ids_tables = None
+    
     def __call__(self, user_ids, session):
         """
         This is the __call__ signature any child implementations should follow.
@@ -35,10 +55,31 @@ class Metric(WikimetricsSecureForm):
         """
         return {user: None for user in user_ids}
 
+    def bot_user_ids(self, session):
+        """
+        Finds the bots of the project the session is open on.  If the metric knows
+        its project, which MetricReport sets, they are cached by project in
+        bot_user_cache and shared by all the metrics that exclude bots.
+        
+        Parameters
+            session : sqlalchemy session open on a mediawiki database
+        
+        Returns
+            a frozenset of the user ids of the bots
+        """
+        # imported here as wikimetrics.api imports the models, which import metrics
+        from wikimetrics.api import bot_user_cache
+        return bot_user_cache.get(self.project, session)
+    
     def filter(self, query, user_ids, column=Revision.rev_user):
         """
         Filters the query by the provided user_ids.
         If user_ids is an empty list, does nothing.
+        Up to MEDIAWIKI_FILTER_INLINE_MAX user ids are inlined in an IN clause.
+        Longer lists are loaded into a temporary table, see user_ids_table, and the
+        query is semi-joined to it instead of sending one huge IN list to the server.
+        Lists in between are usually split into chunks before they get here, see
+        MetricReport.call_metric.
 
         Parameters
             query       : A sqlalchemy query that may need to be filtered
@@ -50,5 +91,197 @@ class Metric(WikimetricsSecureForm):
             The same query passed in, with any user_id filters necessary
         """
         if user_ids and len(user_ids):
-            query = query.filter(column.in_(user_ids))
+            if len(user_ids) > db.config.get('MEDIAWIKI_FILTER_INLINE_MAX', 1000):
+                users = self.user_ids_table(query.session, user_ids)
+                query = query.filter(column.in_(select([users.c.user_id])))
+            else:
+                query = query.filter(column.in_(user_ids))
         return query
+    
+    def user_ids_table(self, session, user_ids):
+        """
+        Loads user ids into a new temporary table on the connection of the session.
+        Temporary tables are only visible to the connection that created them, so
+        the queries filtered on it must run in the same session and transaction.
+        MySQL can't refer to a temporary table twice in the same statement, so
+        each call creates its own table, for example one for each part of a union.
+        The tables are dropped by drop_user_ids_tables.
+        
+        Parameters
+            session     : sqlalchemy session open on a mediawiki database
+            user_ids    : A list of user_ids to load
+        
+        Returns
+            the sqlalchemy Table holding the user ids, in its user_id column
+        """
+        name = 'wikimetrics_user_ids_{0}'.format(uuid4().hex[:16])
+        users = Table(
+            name, MetaData(),
+            Column('user_id', INTEGER(unsigned=True), primary_key=True),
+            prefixes=['TEMPORARY'],
+        )
+        
+        session.execute(
+            'CREATE TEMPORARY TABLE {0} '
+            '(user_id INT UNSIGNED NOT NULL PRIMARY KEY)'.format(name)
+        )
+        if self.user_ids_tables is None:
+            self.user_ids_tables = []
+        self.user_ids_tables.append(name)
+        
+        user_ids = sorted(set(int(user_id) for user_id in user_ids))
+        chunk_size = db.config.get('MEDIAWIKI_FILTER_INSERT_SIZE', 10000)
+        for user_ids_chunk in chunk(user_ids, chunk_size):
+            session.execute(
+                users.insert(),
+                [{'user_id': user_id} for user_id in user_ids_chunk]
+            )
+        return users
+    
+    def drop_user_ids_tables(self, session):
+        """
+        Drops the temporary tables created by user_ids_table.  Otherwise they would
+        live as long as the pooled connection they were created on.
+        
+        Parameters
+            session     : the sqlalchemy session the tables were created in
+        """
+        if not self.user_ids_tables:
+            return
+        if not session.is_active:
+            session.rollback()
+        for name in self.user_ids_tables:
+            session.execute('DROP TEMPORARY TABLE IF EXISTS {0}'.format(name))
+        self.user_ids_tables = None
+    
+    def nth_edits(self, revisions, number_of_edits):
+        """
+        Finds when each user made their Nth edit, in a single pass over their
+        revisions ordered by timestamp, instead of comparing each edit to all the
+        earlier ones.  This is linear in the number of edits.
+        
+        Parameters
+            revisions       : iterable of (user id, timestamp) of the qualifying
+                              revisions, ordered by user and timestamp, like the
+                              rows of revisions_in_windows
+            number_of_edits : N, the number of edits to reach
+        
+        Returns
+            dictionary from the ids of the users that made at least N edits to the
+            timestamp of their Nth edit
+        """
+        nth_edits = {}
+        user_id = None
+        edits = 0
+        for row in revisions:
+            if row[0] != user_id:
+                user_id = row[0]
+                edits = 0
+            edits += 1
+            if edits == number_of_edits:
+                nth_edits[user_id] = row[1]
+        return nth_edits
+    
+    def registrations(self, session, user_ids):
+        """
+        Parameters
+            session     : sqlalchemy session open on a mediawiki database
+            user_ids    : list of mediawiki user ids, None for all the users
+        
+        Returns
+            dictionary from user ids to their registration datetime, or None
+        """
+        users = session.query(MediawikiUser.user_id, MediawikiUser.user_registration)
+        return dict(self.filter(users, user_ids, MediawikiUser.user_id).all())
+    
+    def revisions_in_windows(self, session, registrations, namespaces,
+                             start=None, end=None, all_users=False):
+        """
+        Streams the revisions each user made in a window relative to their
+        registration, ordered by user and timestamp.  The windows are computed
+        here from the registrations, so the revisions are filtered with plain
+        ranges on rev_timestamp that the rev_user, rev_timestamp index can serve,
+        instead of arithmetic on unix_timestamp(rev_timestamp).
+        
+        Users are bucketed by registration, registration_bucket_hours at most
+        apart, and each bucket is one query over the union of the windows of its
+        users.  Rows outside the exact window of their user are dropped here.
+        Users without a registration have no window.
+        
+        Parameters
+            session         : sqlalchemy session open on a mediawiki database
+            registrations   : dictionary from user ids to registration, as
+                              returned by the registrations method
+            namespaces      : the namespaces of the pages to count revisions on
+            start           : timedelta from registration to the start of the
+                              window, included, None for no start
+            end             : timedelta from registration to the end of the window,
+                              included, None for no end
+            all_users       : True if registrations has all the users of the
+                              project, which are then read in a single query
+                              instead of being filtered by id
+        
+        Returns
+            a generator of (user id, rev_timestamp) tuples
+        """
+        users = sorted(
+            (registration, user_id)
+            for user_id, registration in registrations.iteritems()
+            if registration is not None
+        )
+        if all_users:
+            buckets = [users] if users else []
+        else:
+            buckets = []
+            span = timedelta(hours=self.registration_bucket_hours)
+            for registration, user_id in users:
+                if not buckets or registration - buckets[-1][0][0] > span:
+                    buckets.append([])
+                buckets[-1].append((registration, user_id))
+        
+        for bucket in buckets:
+            query = session.query(Revision.rev_user, Revision.rev_timestamp)\
+                .join(Page)\
+                .filter(Page.page_namespace.in_(namespaces))
+            if start is not None:
+                query = query.filter(Revision.rev_timestamp >= bucket[0][0] + start)
+            if end is not None:
+                query = query.filter(Revision.rev_timestamp <= bucket[-1][0] + end)
+            if not all_users:
+                query = self.filter(query, [user_id for r, user_id in bucket])
+            rows = query\
+                .order_by(Revision.rev_user, Revision.rev_timestamp)\
+                .execution_options(stream_results=True)\
+                .yield_per(self.revisions_chunk_size)
+            
+            for user_id, rev_timestamp in rows:
+                registration = registrations.get(user_id)
+                if registration is None:
+                    continue
+                if start is not None and rev_timestamp < registration + start:
+                    continue
+                if end is not None and rev_timestamp > registration + end:
+                    continue
+                yield user_id, rev_timestamp
+    
+    def parent_lengths(self, session, parent_ids):
+        """
+        Fetches the lengths of parent revisions by primary key, parent_chunk_size
+        ids at a time
+        
+        Parameters
+            session     : sqlalchemy session open on a mediawiki database
+            parent_ids  : set of revision ids
+        
+        Returns
+            dictionary from revision ids to their rev_len, missing the ids of
+            revisions that are not in the revision table anymore
+        """
+        parent_lengths = {}
+        for parent_ids_chunk in chunk(sorted(parent_ids), self.parent_chunk_size):
+            parent_lengths.update(
+                session.query(Revision.rev_id, Revision.rev_len)
+                .filter(Revision.rev_id.in_(parent_ids_chunk))
+                .all()
+            )
+        return parent_lengths
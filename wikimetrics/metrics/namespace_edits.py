@@ -50,6 +50,7 @@ class NamespaceEdits(TimeseriesMetric):
     default_result  = {
         'edits': 0,
     }
+    additive        = True
 
     include_deleted = BetterBooleanField(
         default=True,
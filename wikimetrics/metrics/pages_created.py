@@ -36,6 +36,7 @@ class PagesCreated(TimeseriesMetric):
     default_result  = {
         'pages_created': 0,
     }
+    additive        = True
 
     include_deleted = BetterBooleanField(
         default=True,
@@ -0,0 +1,167 @@
+from datetime import timedelta
+from wtforms import IntegerField
+from wtforms.validators import Required
+
+from wikimetrics.utils import thirty_days_ago, today
+from wikimetrics.models import Page, Revision, Archive
+from wikimetrics.forms.fields import BetterDateTimeField, CommaSeparatedIntegerListField
+from metric import Metric
+
+
+class ProgramEditMetrics(Metric):
+    """
+    This class computes the edit based metrics of the program global metrics
+    together, reading the revisions and archives of the cohort only once:
+
+        * rolling_active_editor : 1 if the user is not a bot and made number_of_edits
+                                  edits in any namespace between start_date minus
+                                  rolling_days and start_date, as RollingActiveEditor
+                                  with its end_date set to start_date
+        * pages_created         : as PagesCreated, deleted pages included
+        * pages_edited          : as PagesEdited, deleted pages included
+        * absolute_sum          : as the absolute_sum of BytesAdded, which only
+                                  reads visible revisions
+
+    The last three count edits to pages in namespaces, between start_date and
+    end_date.  Revisions and archives are read for the whole span of the metrics:
+
+     SELECT rev_user, rev_timestamp, rev_page, page_namespace, rev_parent_id, rev_len
+       FROM revision
+                LEFT JOIN
+            page        ON page.page_id = revision.rev_page
+      WHERE rev_user IN ([parameterized])
+        AND rev_timestamp >= [start_date - rolling_days]
+        AND rev_timestamp <= [end_date]
+
+     SELECT ar_user, ar_timestamp, ar_page_id, ar_namespace, ar_parent_id
+       FROM archive
+      WHERE ar_user IN ([parameterized])
+        AND ar_timestamp >= [start_date - rolling_days]
+        AND ar_timestamp <= [end_date]
+
+    and each row is counted by the metrics whose window it falls in.  The byte
+    changes then need the lengths of the parent revisions, see
+    Metric.parent_lengths.
+    """
+
+    show_in_ui  = False
+    id          = 'program_edit_metrics'
+    label       = 'Program Edit Metrics'
+    category    = 'Community'
+    description = (
+        'Compute the rolling active editors, pages created, pages edited and bytes'
+        ' added of the program global metrics in a single pass'
+    )
+    default_result = {
+        'rolling_active_editor': 0,
+        'pages_created': 0,
+        'pages_edited': 0,
+        'absolute_sum': 0,
+    }
+
+    start_date      = BetterDateTimeField(default=thirty_days_ago)
+    end_date        = BetterDateTimeField(default=today)
+    number_of_edits = IntegerField(default=5)
+    rolling_days    = IntegerField(default=30)
+    namespaces      = CommaSeparatedIntegerListField(
+        None,
+        [Required()],
+        default='0',
+        description='0, 2, 4, etc.',
+    )
+
+    def __call__(self, user_ids, session):
+        """
+        Parameters:
+            user_ids    : list of mediawiki user ids to restrict computation to
+            session     : sqlalchemy session open on a mediawiki database
+
+        Returns:
+            dictionary from user ids to a dictionary of the four results
+        """
+        start_date = self.start_date.data
+        end_date = self.end_date.data
+        rolling_start = start_date - timedelta(days=int(self.rolling_days.data))
+        number_of_edits = int(self.number_of_edits.data)
+        namespaces = set(self.namespaces.data)
+
+        revisions = session.query(
+            Revision.rev_user,
+            Revision.rev_timestamp,
+            Revision.rev_page,
+            Page.page_namespace,
+            Revision.rev_parent_id,
+            Revision.rev_len,
+        )\
+            .outerjoin(Page)\
+            .filter(Revision.rev_timestamp >= rolling_start)\
+            .filter(Revision.rev_timestamp <= end_date)
+        revisions = self.filter(revisions, user_ids, column=Revision.rev_user)
+
+        archives = session.query(
+            Archive.ar_user,
+            Archive.ar_timestamp,
+            Archive.ar_page_id,
+            Archive.ar_namespace,
+            Archive.ar_parent_id,
+        )\
+            .filter(Archive.ar_timestamp >= rolling_start)\
+            .filter(Archive.ar_timestamp <= end_date)
+        archives = self.filter(archives, user_ids, column=Archive.ar_user)
+
+        rolling_edits = {}
+        pages_created = {}
+        pages_edited = {}
+        # (user, length, parent) of the visible revisions, for the byte changes
+        changes = []
+
+        def count(user_id, timestamp, page_id, namespace, parent_id):
+            # the rolling window ends where the window of the other metrics starts
+            if timestamp <= start_date:
+                rolling_edits[user_id] = rolling_edits.get(user_id, 0) + 1
+                return False
+            if namespace not in namespaces:
+                return False
+            if parent_id == 0:
+                pages_created[user_id] = pages_created.get(user_id, 0) + 1
+            pages_edited.setdefault(user_id, set()).add(page_id)
+            return True
+
+        rows = revisions\
+            .execution_options(stream_results=True)\
+            .yield_per(self.revisions_chunk_size)
+        for user_id, timestamp, page_id, namespace, parent_id, length in rows:
+            if count(user_id, timestamp, page_id, namespace, parent_id):
+                changes.append((user_id, length, parent_id))
+
+        rows = archives\
+            .execution_options(stream_results=True)\
+            .yield_per(self.revisions_chunk_size)
+        for user_id, timestamp, page_id, namespace, parent_id in rows:
+            count(user_id, timestamp, page_id, namespace, parent_id)
+
+        parent_lengths = self.parent_lengths(
+            session, set(change[2] for change in changes if change[2])
+        )
+        absolute_sums = {}
+        for user_id, length, parent_id in changes:
+            if length is None:
+                continue
+            byte_change = length - (parent_lengths.get(parent_id) or 0)
+            absolute_sums[user_id] = absolute_sums.get(user_id, 0) + abs(byte_change)
+
+        bot_user_ids = self.bot_user_ids(session)
+        if user_ids is None:
+            user_ids = set(rolling_edits).union(pages_edited)
+        return {
+            user_id: {
+                'rolling_active_editor': int(
+                    rolling_edits.get(user_id, 0) >= number_of_edits and
+                    user_id not in bot_user_ids
+                ),
+                'pages_created': pages_created.get(user_id, 0),
+                'pages_edited': len(pages_edited.get(user_id, ())),
+                'absolute_sum': absolute_sums.get(user_id, 0),
+            }
+            for user_id in user_ids
+        }
@@ -7,7 +7,7 @@ from wtforms import IntegerField
 from wikimetrics.forms.fields import BetterDateTimeField
 from wikimetrics.utils import today
 from wikimetrics.models.mediawiki import (
-    Revision, MediawikiUser, Archive, MediawikiUserGroups
+    Revision, MediawikiUser, Archive
 )
 from metric import Metric
 
@@ -46,7 +46,7 @@ class RollingActiveEditor(Metric):
       GROUP BY user_id
      HAVING SUM(revisions) >= @n;
 
-    NOTE: updated to exclude bots as identified by:
+    NOTE: updated to exclude bots, see Metric.bot_user_ids, as identified by:
 
      SELECT ug_user
        FROM user_groups
@@ -102,17 +102,17 @@ class RollingActiveEditor(Metric):
             .group_by(Archive.ar_user)
         archived = self.filter(archived, user_ids, column=Archive.ar_user)
 
-        bot_user_ids = session.query(MediawikiUserGroups.ug_user)\
-            .filter(MediawikiUserGroups.ug_group == 'bot')\
-            .subquery()
-
         edits = revisions.union_all(archived).subquery()
         edits_by_user = session.query(edits.c.user_id)\
-            .filter(edits.c.user_id.notin_(bot_user_ids))\
             .group_by(edits.c.user_id)\
             .having(func.SUM(edits.c.count) >= number_of_edits)
 
-        metric_results = {r[0]: {self.id : 1} for r in edits_by_user.all()}
+        # bots are filtered out here, as their ids are cached by project
+        bot_user_ids = self.bot_user_ids(session)
+        metric_results = {
+            r[0]: {self.id : 1} for r in edits_by_user.all()
+            if r[0] not in bot_user_ids
+        }
 
         if user_ids is None:
             return metric_results
@@ -5,7 +5,7 @@ from wtforms import IntegerField
 
 from wikimetrics.forms.fields import BetterDateTimeField
 from wikimetrics.utils import today
-from wikimetrics.models.mediawiki import Revision, Archive, Logging, MediawikiUserGroups
+from wikimetrics.models.mediawiki import Revision, Archive, Logging
 from metric import Metric
 
 
@@ -52,7 +52,7 @@ class RollingNewActiveEditor(Metric):
       GROUP BY user_id
      HAVING SUM(revisions) >= @n;
 
-    NOTE: updated to exclude bots as identified by:
+    NOTE: updated to exclude bots, see Metric.bot_user_ids, as identified by:
 
      SELECT ug_user
        FROM user_groups
@@ -121,17 +121,17 @@ class RollingNewActiveEditor(Metric):
             .filter(Archive.ar_user.in_(filtered_new))\
             .group_by(Archive.ar_user)
 
-        bot_user_ids = session.query(MediawikiUserGroups.ug_user)\
-            .filter(MediawikiUserGroups.ug_group == 'bot')\
-            .subquery()
-
         new_edits = revisions.union_all(archived).subquery()
         new_edits_by_user = session.query(new_edits.c.user_id)\
-            .filter(new_edits.c.user_id.notin_(bot_user_ids))\
             .group_by(new_edits.c.user_id)\
             .having(func.SUM(new_edits.c.count) >= number_of_edits)
 
-        metric_results = {r[0]: {self.id : 1} for r in new_edits_by_user.all()}
+        # bots are filtered out here, as their ids are cached by project
+        bot_user_ids = self.bot_user_ids(session)
+        metric_results = {
+            r[0]: {self.id : 1} for r in new_edits_by_user.all()
+            if r[0] not in bot_user_ids
+        }
 
         if user_ids is None:
             return metric_results
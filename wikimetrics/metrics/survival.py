@@ -1,7 +1,7 @@
 import datetime
 import calendar
 from sqlalchemy import func, case, Integer
-from sqlalchemy.sql.expression import label, between, and_, or_
+from sqlalchemy.sql.expression import between, and_, or_
 from wtforms.validators import Required
 from wtforms import BooleanField, IntegerField
 
@@ -16,37 +16,27 @@ class Survival(Metric):
     Survival is a metric that determines whether an editor has performed >= n edits
     in a specified time window. It is used to measure early user activation.
     
-    The SQL query that inspired this metric was:
+    The registrations of the users are read first, and their revisions in the
+    survival window are then read by Metric.revisions_in_windows, for users bucketed
+    by registration, with plain ranges on rev_timestamp that the rev_user,
+    rev_timestamp index can serve:
     
- SELECT revs.user_id AS revs_user_id,
-        IF(revs.rev_count >= <number_of_edits>, 1, 0)
-            AS survived,
-        IF(revs.rev_count >= <number_of_edits>, 0, IF(unix_timestamp(now())
-            < unix_timestamp(revs.user_registration) + <survival_hours>, 1, 0))
-            AS censored
-
-   FROM (SELECT user.user_id AS user_id,
-                user.user_registration AS user_registration,
-                coalesce(rev_counts.rev_count, 0) AS rev_count
-           FROM user
-                        LEFT OUTER JOIN
-                (SELECT user.user_id AS user_id,
-                        count(*) as rev_count
-                   FROM user
-                                INNER JOIN
-                        revision    ON user.user_id = revision.rev_user
-                                INNER JOIN
-                        page        ON page.page_id = revision.rev_page
-                  WHERE user.user_id IN (<cohort>)
-                    AND page.page_namespace IN (<namespaces>)
-                    AND unix_timestamp(revision.rev_timestamp) -
-                        unix_timestamp(user.user_registration)
-                            BETWEEN
-                        <survival_hours> AND <now>
-                  GROUP BY user.user_id
-                ) AS rev_counts     ON user.user_id = rev_count.user_id
-          WHERE user.user_id IN (<cohort>)
-        ) AS revs
+ SELECT rev_user,
+        rev_timestamp
+   FROM revision
+            INNER JOIN
+        page            ON page.page_id = revision.rev_page
+  WHERE rev_user IN (<users of the bucket>)
+    AND page.page_namespace IN (<namespaces>)
+    AND rev_timestamp >= <first registration of the bucket> + <survival_hours>
+    AND rev_timestamp <= <last registration of the bucket> + <survival_hours>
+                                                           + <sunset_in_hours>
+  ORDER BY rev_user, rev_timestamp
+    
+    A user survived if Metric.nth_edits finds their <number_of_edits>th edit in
+    their own window.  The windows used to be computed in the WHERE clause, from
+    unix_timestamp(rev_timestamp) - unix_timestamp(user_registration), which could
+    not use that index.
     """
     
     show_in_ui  = True
@@ -93,80 +83,41 @@ class Survival(Metric):
         sunset_in_hours = int(self.sunset_in_hours.data)
         number_of_edits = int(self.number_of_edits.data)
         
-        revisions = session \
-            .query(
-                MediawikiUser.user_id,
-                label('rev_count', func.count())
-            ) \
-            .join(Revision) \
-            .join(Page) \
-            .group_by(MediawikiUser.user_id) \
-            .filter(Page.page_namespace.in_(self.namespaces.data))
+        registrations = self.registrations(session, user_ids)
         
-        revisions = self.filter(revisions, user_ids, column=MediawikiUser.user_id)
-
         # sunset_in_hours is zero, so we use the first case [T+t,today]
-        if sunset_in_hours == 0:
-            revisions = revisions.filter(
-                between(
-                    func.unix_timestamp(Revision.rev_timestamp) -
-                    func.unix_timestamp(MediawikiUser.user_registration)
-                    ,
-                    (survival_hours * 3600)
-                    ,
-                    func.unix_timestamp(func.now()) + 86400
-                )
-            )
         # otherwise use the sunset_in_hours [T+t,T+t+s]
-        else:
-            revisions = revisions.filter(
-                between(
-                    func.unix_timestamp(Revision.rev_timestamp) -
-                    func.unix_timestamp(MediawikiUser.user_registration)
-                    ,
-                    (survival_hours * 3600)
-                    ,
-                    ((survival_hours + sunset_in_hours) * 3600)
-                )
-            )
+        start = datetime.timedelta(hours=survival_hours)
+        end = None
+        if sunset_in_hours != 0:
+            end = datetime.timedelta(hours=survival_hours + sunset_in_hours)
         
-        revisions = revisions.subquery()
-        revs = session.query(
-            MediawikiUser.user_id,
-            MediawikiUser.user_registration,
-            label(
-                'rev_count',
-                func.coalesce(revisions.c.rev_count, 0)
+        if number_of_edits > 0:
+            survivors = self.nth_edits(
+                self.revisions_in_windows(
+                    session, registrations, self.namespaces.data,
+                    start=start, end=end, all_users=not user_ids,
+                ),
+                number_of_edits,
             )
-        ) \
-            .outerjoin(revisions, MediawikiUser.user_id == revisions.c.user_id)
-
-        revs = self.filter(revs, user_ids, MediawikiUser.user_id).subquery()
-        
-        metric = session.query(
-            revs.c.user_id,
-            label(Survival.id, func.IF(revs.c.rev_count >= number_of_edits, 1, 0)),
-            label(CENSORED, func.IF(
-                revs.c.rev_count >= number_of_edits,
-                0,
-                func.IF(
-                    func.unix_timestamp(func.now()) <
-                    func.unix_timestamp(revs.c.user_registration) +
-                    (survival_hours + sunset_in_hours) * 3600,
-                    1, 0
-                )
-            ))
-        )
+        else:
+            survivors = registrations
         
-        data = metric.all()
+        # registrations come from the database, so censoring follows its clock
+        now = session.query(func.now()).scalar()
+        window = datetime.timedelta(hours=survival_hours + sunset_in_hours)
         
-        metric_results = {
-            u.user_id: {
-                Survival.id : u.survived,
-                CENSORED    : u.censored,
+        metric_results = {}
+        for user_id, registration in registrations.iteritems():
+            if user_id in survivors:
+                survived, censored = 1, 0
+            else:
+                survived = 0
+                censored = registration is not None and now < registration + window
+            metric_results[user_id] = {
+                Survival.id : survived,
+                CENSORED    : 1 if censored else 0,
             }
-            for u in data
-        }
         
         r = {
             uid: metric_results.get(uid, self.default_result)
@@ -1,10 +1,8 @@
 import datetime
-import calendar
-from sqlalchemy import func, case, Integer
-from sqlalchemy.orm import aliased
-from sqlalchemy.sql.expression import label, between, and_, or_
+from decimal import Decimal
+from sqlalchemy import func
 from wtforms.validators import Required
-from wtforms import BooleanField, IntegerField
+from wtforms import IntegerField
 
 from wikimetrics.models import Page, Revision, MediawikiUser
 from wikimetrics.utils import thirty_days_ago, today, CENSORED
@@ -12,6 +10,10 @@ from wikimetrics.forms.fields import CommaSeparatedIntegerListField, BetterDateT
 from metric import Metric
 
 
+# hours to reach the threshold are rounded like MySQL divisions
+FOUR_PLACES = Decimal('0.0001')
+
+
 class Threshold(Metric):
     """
     Threshold is a metric that determines whether an editor has performed >= n edits
@@ -21,34 +23,26 @@ class Threshold(Metric):
     of hours that it took an editor to reach exactly n edits.  If the editor did not
     reach the threshold, None is returned.
     
-    The SQL that inspired this metric was:
+    The registrations of the users are read first, and the Nth edit of each user
+    is then found by Metric.nth_edits, in a single pass over their qualifying
+    revisions ordered by timestamp.  Those are read by Metric.revisions_in_windows,
+    for users bucketed by registration, with plain ranges on rev_timestamp:
+    
+ SELECT rev_user,
+        rev_timestamp
+   FROM revision
+            INNER JOIN
+        page            ON page.page_id = revision.rev_page
+  WHERE rev_user IN (<users of the bucket>)
+    AND page.page_namespace IN (<namespaces>)
+    AND rev_timestamp <= <last registration of the bucket> + <threshold_hours>
+  ORDER BY rev_user, rev_timestamp
     
- SELECT user_id,
-        IF(rev_timestamp is not null, 1, 0) as threshold,
-        IF(rev_timestamp is not null,
-            (unix_timestamp(rev_timestamp) - unix_timestamp(user_registration)) / 3600,
-            null
-        ) as time_to_threshold
-   FROM (SELECT r1.rev_user,
-                r1.rev_timestamp,
-                COUNT(*) AS number
-           FROM revision r1
-                    INNER JOIN
-                revision r2  ON r1.rev_user = r2.rev_user
-                             AND r1.rev_timestamp >= r2.rev_timestamp
-          WHERE user.user_id IN (<cohort>)
-            AND page.page_namespace IN (<namespaces>)
-            AND unix_timestamp(revision.rev_timestamp) -
-                unix_timestamp(user.user_registration)
-                    <= <threshold_hours>
-          GROUP BY
-                r1.rev_user,
-                r1.rev_timestamp
-        ) ordered_revisions
-            LEFT JOIN
-        user            on user.user_id = ordered_revisions.rev_user
-                        and ordered_revisions.number = <number_of_edits>
-  WHERE user_id IN (<cohort>)
+    This replaces a join of revision to itself on r1.rev_timestamp >= r2.rev_timestamp,
+    which counted the earlier edits of every edit and grew with the square of the
+    number of edits of each user, filtered on
+    unix_timestamp(rev_timestamp) - unix_timestamp(user_registration), which could
+    not use the rev_user, rev_timestamp index.
     """
     
     show_in_ui              = True
@@ -94,72 +88,36 @@ class Threshold(Metric):
         thresh_hours = int(self.threshold_hours.data)
         thresh_secs  = thresh_hours * 3600
         number_of_edits = int(self.number_of_edits.data)
+        window = datetime.timedelta(seconds=thresh_secs)
         
-        Revision2 = aliased(Revision, name='r2')
-        ordered_revisions = session \
-            .query(
-                Revision.rev_user,
-                Revision.rev_timestamp,
-                label('number', func.count()),
-            ) \
-            .join(MediawikiUser) \
-            .join(Page) \
-            .join(
-                Revision2,
-                and_(
-                    Revision.rev_user == Revision2.rev_user,
-                    Revision.rev_timestamp >= Revision2.rev_timestamp
-                )
-            ) \
-            .group_by(Revision.rev_user) \
-            .group_by(Revision.rev_timestamp) \
-            .filter(Page.page_namespace.in_(self.namespaces.data)) \
-            .filter(
-                func.unix_timestamp(Revision.rev_timestamp) -
-                func.unix_timestamp(MediawikiUser.user_registration) <= thresh_secs
-            )
-        
-        o_r = self.filter(ordered_revisions, user_ids).subquery()
-        
-        metric = session.query(
-            MediawikiUser.user_id,
-            label(
-                Threshold.id,
-                func.IF(o_r.c.rev_timestamp != None, 1, 0)
+        registrations = self.registrations(session, user_ids)
+        nth_edits = self.nth_edits(
+            self.revisions_in_windows(
+                session, registrations, self.namespaces.data,
+                end=window, all_users=not user_ids,
             ),
-            label(
-                Threshold.time_to_threshold_id,
-                func.IF(
-                    o_r.c.rev_timestamp != None,
-                    (func.unix_timestamp(o_r.c.rev_timestamp) -
-                        func.unix_timestamp(MediawikiUser.user_registration)) / 3600,
-                    None
-                )
-            ),
-            label(CENSORED, func.IF(
-                o_r.c.rev_timestamp != None,
-                0,
-                func.IF(
-                    func.unix_timestamp(MediawikiUser.user_registration) + thresh_secs >
-                    func.unix_timestamp(func.now()),
-                    1,
-                    0
-                )
-            ))
-        ) \
-            .outerjoin(
-                o_r,
-                and_(
-                    MediawikiUser.user_id == o_r.c.rev_user,
-                    o_r.c.number == number_of_edits))
-
-        metric = self.filter(metric, user_ids, MediawikiUser.user_id)
+            number_of_edits,
+        )
         
-        return {
-            u.user_id: {
-                Threshold.id                    : u.threshold,
-                Threshold.time_to_threshold_id  : u.time_to_threshold,
-                CENSORED                        : u.censored,
-            }
-            for u in metric.all()
-        }
+        # registrations come from the database, so censoring follows its clock
+        now = session.query(func.now()).scalar()
+        
+        results = {}
+        for user_id, registration in registrations.iteritems():
+            nth_edit = nth_edits.get(user_id)
+            if nth_edit is not None:
+                seconds = int((nth_edit - registration).total_seconds())
+                hours = (Decimal(seconds) / 3600).quantize(FOUR_PLACES)
+                results[user_id] = {
+                    Threshold.id                    : 1,
+                    Threshold.time_to_threshold_id  : hours,
+                    CENSORED                        : 0,
+                }
+            else:
+                censored = registration is not None and registration + window > now
+                results[user_id] = {
+                    Threshold.id                    : 0,
+                    Threshold.time_to_threshold_id  : None,
+                    CENSORED                        : 1 if censored else 0,
+                }
+        return results
@@ -1,11 +1,12 @@
 from collections import OrderedDict
-from sqlalchemy import func
-from datetime import datetime
+from copy import deepcopy
+from sqlalchemy import func, text
+from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from wtforms import SelectField
 
 from wikimetrics.models import Revision
-from wikimetrics.utils import thirty_days_ago, today, format_pretty_date
+from wikimetrics.utils import thirty_days_ago, today, format_pretty_date, strip_time
 from wikimetrics.enums import TimeseriesChoices
 from wikimetrics.forms.fields import CommaSeparatedIntegerListField, BetterDateTimeField
 from wikimetrics.forms.validators import NotGreater
@@ -35,6 +36,69 @@ class TimeseriesMetric(Metric):
         description='Report results by year, month, day, or hour',
     )
     
+    # number of rows submetrics_by_user fetches from the database at a time
+    stream_chunk_size = 10000
+    
+    # True if the results over a window are the sums of the results over the days
+    # the window spans, see split_by_day and sum_results
+    additive = False
+    
+    # if True, a timeseries slice covers (slice start, slice end] instead of
+    # [slice start, slice end), like the (start_date, end_date] window of the metric
+    # itself, see BackfillReport
+    slices_include_end = False
+    
+    def split_by_day(self):
+        """
+        Splits the window of this metric at each midnight between start_date and
+        end_date.  Only additive metrics without timeseries can be split.
+        
+        Returns
+            a list of copies of this metric, one per day of its window, where the
+            first and last days may be partial, or a list with just this metric if
+            it can not be split
+        """
+        start_date = self.start_date.data
+        end_date = self.end_date.data
+        if not self.additive or self.timeseries.data != TimeseriesChoices.NONE\
+                or not isinstance(start_date, datetime)\
+                or not isinstance(end_date, datetime):
+            return [self]
+        
+        boundaries = [start_date]
+        midnight = strip_time(start_date) + timedelta(days=1)
+        while midnight < end_date:
+            boundaries.append(midnight)
+            midnight += timedelta(days=1)
+        boundaries.append(end_date)
+        
+        day_metrics = []
+        for day_start, day_end in zip(boundaries, boundaries[1:]):
+            day_metric = deepcopy(self)
+            day_metric.start_date.data = day_start
+            day_metric.end_date.data = day_end
+            day_metrics.append(day_metric)
+        return day_metrics
+    
+    def sum_results(self, results_by_day):
+        """
+        Adds up the results of an additive metric over consecutive days
+        
+        Parameters
+            results_by_day  : list of dictionaries from user ids to results, as
+                              returned by the metrics of split_by_day
+        
+        Returns
+            dictionary from user ids to the results over the whole window
+        """
+        results = {}
+        for results_by_user in results_by_day:
+            for user_id, user_results in results_by_user.iteritems():
+                totals = results.setdefault(user_id, {})
+                for label, value in user_results.iteritems():
+                    totals[label] = totals.get(label, 0) + value
+        return results
+    
     def apply_timeseries(self, query, column=Revision.rev_timestamp):
         """
         Take a query and slice it up into equal time intervals
@@ -52,6 +116,9 @@ class TimeseriesMetric(Metric):
         if choice == TimeseriesChoices.NONE:
             return query
         
+        if self.slices_include_end:
+            column = func.timestampadd(text('SECOND'), -1, column)
+        
         query = query.add_column(func.year(column))
         query = query.group_by(func.year(column))
         
@@ -76,13 +143,42 @@ class TimeseriesMetric(Metric):
         if choice == TimeseriesChoices.HOUR:
             return query
     
+    def date_pieces(self, timestamp):
+        """
+        Computes in python the date pieces apply_timeseries adds to each row, for
+        metrics that aggregate their results themselves
+        
+        Parameters
+            timestamp   : a datetime
+        
+        Returns
+            a tuple of the year, month, day and hour of timestamp, as many of them
+            as the timeseries choice needs, or an empty tuple without timeseries
+        """
+        choice = self.timeseries.data
+        if choice == TimeseriesChoices.NONE:
+            return ()
+        
+        if self.slices_include_end:
+            timestamp -= timedelta(seconds=1)
+        
+        pieces = (timestamp.year, timestamp.month, timestamp.day, timestamp.hour)
+        if choice == TimeseriesChoices.YEAR:
+            return pieces[:1]
+        if choice == TimeseriesChoices.MONTH:
+            return pieces[:2]
+        if choice == TimeseriesChoices.DAY:
+            return pieces[:3]
+        return pieces
+    
     def results_by_user(self, user_ids, query, submetrics, date_index=None):
         """
         Get results by user for a timeseries-enabled metric
         
         Parameters
             user_ids            : list of integer ids to return results for
-            query               : sqlalchemy query to fetch results
+            query               : sqlalchemy query to fetch results, or the list
+                                  of its rows if they were computed in python
             submetrics          : list of tuples of the form (label, index, default)
             date_index          : index of the year date part in the result row,
                                   in case this is a timeseries query
@@ -136,31 +232,46 @@ class TimeseriesMetric(Metric):
         """
         Same as results_by_user, except doesn't return results for users not found in
         the query_results list.
+        Rows are streamed from the database stream_chunk_size at a time and folded
+        into the results as they arrive, so the full list of rows is never held
+        in memory.  Set stream_chunk_size to None to fetch all rows at once.
         """
-        query_results = query.all()
-        results = OrderedDict()
+        if isinstance(query, list):
+            query_results = query
+        elif self.stream_chunk_size:
+            query_results = query\
+                .execution_options(stream_results=True)\
+                .yield_per(self.stream_chunk_size)
+        else:
+            query_results = query.all()
         
-        # handle simple cases (no results or no timeseries)
-        if not query_results:
-            return results
+        results = OrderedDict()
+        is_timeseries = self.timeseries.data != TimeseriesChoices.NONE
+        # the same few date slices repeat for every user, so each one is
+        # formatted once and the resulting string is shared by all users
+        date_slices = dict()
         
         # get results by user and by date
         for row in query_results:
             user_id = row[0]
-            if user_id not in results:
-                results[user_id] = OrderedDict()
-            
-            date_slice = None
-            if self.timeseries.data != TimeseriesChoices.NONE:
-                date_slice = self.get_date_from_tuple(row, date_index, len(row))
+            user_results = results.get(user_id)
+            if user_results is None:
+                user_results = results[user_id] = OrderedDict()
             
-            for label, index, default in submetrics:
-                if date_slice:
-                    if label not in results[user_id]:
-                        results[user_id][label] = dict()
-                    results[user_id][label][date_slice] = row[index]
-                else:
-                    results[user_id][label] = row[index]
+            if is_timeseries:
+                date_pieces = tuple(row[date_index:])
+                date_slice = date_slices.get(date_pieces)
+                if date_slice is None:
+                    date_slice = self.get_date_from_tuple(row, date_index, len(row))
+                    date_slices[date_pieces] = date_slice
+                
+                for label, index, default in submetrics:
+                    if label not in user_results:
+                        user_results[label] = dict()
+                    user_results[label][date_slice] = row[index]
+            else:
+                for label, index, default in submetrics:
+                    user_results[label] = row[index]
         
         return results
     
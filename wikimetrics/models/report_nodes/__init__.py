@@ -2,9 +2,12 @@ from aggregate_report import *
 from metric_report import *
 from multi_project_metric_report import *
 from sum_aggregate_by_user_report import *
+from program_edit_metrics_report import *
 from report import *
 from run_report import *
+from backfill_report import *
 from run_program_metrics_report import *
 from validate_program_metrics_report import *
+from user_results import *
 # ignore flake8 because of F403 violation
 # flake8: noqa
@@ -1,5 +1,8 @@
-from math import sqrt
+from math import fsum, sqrt
+from array import array
 from decimal import Decimal
+from operator import mul
+from itertools import compress, imap
 from collections import OrderedDict
 from celery.utils.log import get_task_logger
 
@@ -7,6 +10,7 @@ from wikimetrics.utils import stringify, CENSORED, NO_RESULTS, r
 from wikimetrics.enums import Aggregation
 from report import ReportNode
 from multi_project_metric_report import MultiProjectMetricReport
+from user_results import UserResults
 
 
 task_logger = get_task_logger(__name__)
@@ -56,25 +60,16 @@ class AggregateReport(ReportNode):
         results_by_user = child_results[0]
         
         if self.aggregate:
+            types_of_aggregate = []
             if self.aggregate_sum:
-                aggregated_results[Aggregation.SUM] = self.calculate(
-                    results_by_user,
-                    Aggregation.SUM
-                )
+                types_of_aggregate.append(Aggregation.SUM)
             if self.aggregate_average:
-                aggregated_results[Aggregation.AVG] = self.calculate(
-                    results_by_user,
-                    Aggregation.AVG
-                )
+                types_of_aggregate.append(Aggregation.AVG)
             if self.aggregate_std_deviation:
-                if Aggregation.AVG not in aggregated_results:
-                    average = self.calculate(results_by_user, Aggregation.AVG)
-                else:
-                    average = aggregated_results[Aggregation.AVG]
-                aggregated_results[Aggregation.STD] = self.calculate(
-                    results_by_user,
-                    Aggregation.STD,
-                    average=average
+                types_of_aggregate.append(Aggregation.STD)
+            if types_of_aggregate:
+                aggregated_results.update(
+                    self.calculate(results_by_user, types_of_aggregate)
                 )
         
         if self.individual:
@@ -84,100 +79,130 @@ class AggregateReport(ReportNode):
         
         return aggregated_results
     
-    def calculate(self, results_by_user, type_of_aggregate, average=None):
-        # TODO: terrible redo this
+    def calculate(self, results_by_user, types_of_aggregate):
         """
-        Calculates one type of aggregate by just iterating over the individual results
-        Takes into account that results and aggregates may be split up by timeseries
-        Also makes sure to ignore censored records when appropriate
+        Calculates any of the types of aggregate in a single pass over the individual
+        results.  Takes into account that results and aggregates may be split up by
+        timeseries.  Also makes sure to ignore censored records when appropriate
         
         Parameters
-            list_of_results     : list of individual results
-            type_of_aggregate   : can be SUM, AVG, STD
-            average             : None by default but required when computing STD
+            results_by_user     : individual results, a UserResults instance or
+                                  a dictionary of results by user
+            types_of_aggregate  : list of any of SUM, AVG, STD
         
         Returns
-            The aggregate specified, computed at the timeseries level if applicable
+            A dictionary from each type of aggregate to the aggregate, computed
+            at the timeseries level if applicable
+        """
+        if isinstance(results_by_user, UserResults) and not results_by_user.other:
+            values_by_key = self.values_by_column(results_by_user)
+        else:
+            values_by_key = self.values_by_key(results_by_user)
+        
+        aggregations = dict((t, dict()) for t in types_of_aggregate)
+        for (key, subkey), values in values_by_key:
+            count, total, square_diffs = summarize(values)
+            
+            for type_of_aggregate, aggregation in aggregations.iteritems():
+                if type_of_aggregate == Aggregation.SUM:
+                    aggregate = r(total)
+                elif type_of_aggregate == Aggregation.AVG:
+                    aggregate = r(safe_average(Decimal(total), count))
+                elif type_of_aggregate == Aggregation.STD:
+                    aggregate = r(sqrt(safe_average(square_diffs, count)))
+                
+                if subkey is None:
+                    aggregation[key] = aggregate
+                else:
+                    aggregation.setdefault(key, OrderedDict())[subkey] = aggregate
+        
+        return aggregations
+    
+    def values_by_column(self, results_by_user):
+        """
+        Goes down the columns of a UserResults instance
+        
+        Returns
+            an iterator of ((submetric, date slice), values) for all the columns,
+            leaving out the values of users with censored results
+        """
+        censored = results_by_user.columns.get((CENSORED, None))
+        for (key, subkey), values in results_by_user.columns.iteritems():
+            if key == CENSORED:
+                continue
+            if censored is not None:
+                values = compress(values, (flag != 1 for flag in censored))
+            yield (key, subkey), values
+    
+    def values_by_key(self, results_by_user):
+        """
+        Collects the values of a dictionary of results by user, for the same keys
+        that values_by_column would find in the equivalent UserResults
         """
-        aggregation = dict()
-        helper = dict()
-        for user_id in results_by_user.keys():
-            for key in results_by_user[user_id]:
-                # the CENSORED key indicates that this user has censored
-                # results for this metric.  It is not aggregate-able
+        values_by_key = OrderedDict()
+        for result in results_by_user.itervalues():
+            # the CENSORED key indicates that this user has censored
+            # results for this metric.  It is not aggregate-able
+            is_censored = CENSORED in result and result[CENSORED] == 1
+            for key, value in result.iteritems():
                 if key == CENSORED:
                     continue
                 
-                value = results_by_user[user_id][key]
-                value_is_not_censored = CENSORED not in results_by_user[user_id]\
-                    or results_by_user[user_id][CENSORED] != 1
-                
                 # handle timeseries aggregation
                 if isinstance(value, dict):
-                    if key not in aggregation:
-                        aggregation[key] = OrderedDict()
-                        helper[key] = dict()
-                    
-                    for subkey in value:
-                        if subkey not in aggregation[key]:
-                            aggregation[key][subkey] = 0
-                            helper[key][subkey] = dict()
-                            helper[key][subkey]['sum'] = Decimal(0.0)
-                            helper[key][subkey]['square_diffs'] = Decimal(0.0)
-                            helper[key][subkey]['count'] = 0
-                        
-                        if value_is_not_censored and not value[subkey] is None:
-                            helper[key][subkey]['sum'] += Decimal(value[subkey])
-                            helper[key][subkey]['count'] += 1
-                            if type_of_aggregate == Aggregation.STD:
-                                diff = Decimal(value[subkey]) - average[key][subkey]
-                                helper[key][subkey]['square_diffs'] += Decimal(
-                                    pow(diff, 2)
-                                )
-                        
-                        if type_of_aggregate == Aggregation.SUM:
-                            aggregation[key][subkey] = r(helper[key][subkey]['sum'])
-                        elif type_of_aggregate == Aggregation.AVG:
-                            aggregation[key][subkey] = r(safe_average(
-                                helper[key][subkey]['sum'],
-                                helper[key][subkey]['count']
-                            ))
-                        elif type_of_aggregate == Aggregation.STD:
-                            aggregation[key][subkey] = r(sqrt(safe_average(
-                                helper[key][subkey]['square_diffs'],
-                                helper[key][subkey]['count']
-                            )))
+                    for subkey, subvalue in value.iteritems():
+                        key_values = values_by_key.setdefault((key, subkey), [])
+                        if not is_censored:
+                            key_values.append(subvalue)
                 
                 # handle normal aggregation
                 else:
-                    if key not in aggregation:
-                        aggregation[key] = 0
-                        helper[key] = dict()
-                        helper[key]['sum'] = Decimal(0.0)
-                        helper[key]['square_diffs'] = Decimal(0.0)
-                        helper[key]['count'] = 0
-                    
-                    if value_is_not_censored and value is not None:
-                        helper[key]['sum'] += Decimal(value)
-                        helper[key]['count'] += 1
-                        if type_of_aggregate == Aggregation.STD:
-                            diff = Decimal(value) - average[key]
-                            helper[key]['square_diffs'] += Decimal(pow(diff, 2))
-                    
-                    if type_of_aggregate == Aggregation.SUM:
-                        aggregation[key] = r(helper[key]['sum'])
-                    elif type_of_aggregate == Aggregation.AVG:
-                        aggregation[key] = r(safe_average(
-                            helper[key]['sum'],
-                            helper[key]['count']
-                        ))
-                    elif type_of_aggregate == Aggregation.STD:
-                        aggregation[key] = r(sqrt(safe_average(
-                            helper[key]['square_diffs'],
-                            helper[key]['count']
-                        )))
+                    key_values = values_by_key.setdefault((key, None), [])
+                    if not is_censored:
+                        key_values.append(value)
         
-        return aggregation
+        return values_by_key.iteritems()
+
+
+def summarize(values):
+    """
+    Computes the count, the sum, and the sum of squared differences from the mean
+    of values, in a single pass and ignoring None.  Exact values, integers and
+    Decimals, use the sum of their squares.  Floats use Welford's online algorithm,
+    which does not lose precision when the mean is large compared to the spread.
+    
+    Parameters
+        values  : iterable of numbers
+    
+    Returns
+        a tuple of count, sum, and sum of squared differences as a Decimal
+    """
+    if not (isinstance(values, array) and values.typecode == 'l'):
+        values = [value for value in values if value is not None]
+    
+    count = len(values)
+    if not count:
+        return 0, 0, Decimal(0)
+    
+    try:
+        total = sum(values)
+    except TypeError:
+        # Decimals and floats don't add up, so go with floats
+        values = [float(value) for value in values]
+        total = sum(values)
+    
+    if isinstance(total, float):
+        total = fsum(values)
+        mean = 0.0
+        square_diffs = 0.0
+        for n, value in enumerate(values, 1):
+            delta = value - mean
+            mean += delta / n
+            square_diffs += delta * (value - mean)
+        return count, total, Decimal(square_diffs)
+    
+    squares = sum(imap(mul, values, values))
+    return count, total, Decimal(count * squares - total * total) / count
 
 
 def safe_average(cummulative_sum, count):
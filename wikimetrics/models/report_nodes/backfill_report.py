@@ -0,0 +1,142 @@
+import json
+from collections import Mapping
+from datetime import timedelta
+from celery.utils.log import get_task_logger
+
+from wikimetrics.configurables import db, queue
+from wikimetrics.enums import TimeseriesChoices
+from wikimetrics.metrics import metric_classes, TimeseriesMetric
+from wikimetrics.utils import format_pretty_date
+from wikimetrics.api import CohortService
+from report import ReportNode, ReportLeaf
+from aggregate_report import AggregateReport
+
+
+__all__ = ['BackfillReport']
+task_logger = get_task_logger(__name__)
+
+
+class BackfillReport(ReportNode):
+    """
+    Computes the missed daily runs of a recurrent report together.  Instead of
+    running the metric once per day, it runs once over all the missed days, with
+    results grouped by day by TimeseriesMetric.apply_timeseries.  The results of
+    each day are then split out and handed to the RunReport of that day, which
+    stores them and writes its public file as if it had computed them itself.
+
+    Only recurrent reports on timeseries metrics, run without a timeseries, can be
+    backfilled this way, see can_backfill.
+    """
+
+    show_in_ui = False
+
+    def __init__(self, parent, day_runs, *args, **kwargs):
+        """
+        Parameters:
+            parent      : the ReportStore of the recurrent report
+            day_runs    : the RunReport instances of the missed days, as created
+                          by RunReport.create_reports_for_missed_days
+            args        : should include any parameters needed by ReportNode
+            kwargs      : should include any parameters needed by ReportNode
+        """
+        super(BackfillReport, self).__init__(*args, **kwargs)
+
+        self.day_runs = sorted(day_runs, key=lambda day_run: day_run.created)
+        # the days are computed here, so the day runs don't need their own trees
+        for day_run in self.day_runs:
+            day_run.children = []
+
+        parameters = json.loads(parent.parameters)
+        parameters['recurrent'] = False
+        metric_dict = parameters['metric']
+        metric_dict['start_date'] = self.day_runs[0].created - timedelta(days=1)
+        metric_dict['end_date'] = self.day_runs[-1].created
+        metric_dict['timeseries'] = TimeseriesChoices.DAY
+        metric = metric_classes[metric_dict['name']](**metric_dict)
+        metric.slices_include_end = True
+
+        cohort = CohortService().get(
+            db.get_session(), parent.user_id, by_id=parameters['cohort']['id']
+        )
+        self.children = [AggregateReport(
+            metric, cohort, metric_dict, parameters=parameters, user_id=parent.user_id
+        )]
+
+    @classmethod
+    def can_backfill(cls, parent, day_runs):
+        """
+        Returns True if the missed daily runs of parent should be computed together.
+        That takes at least BACKFILL_BATCH_MIN_DAYS valid runs of a timeseries
+        metric that is not itself reported as a timeseries.
+
+        Parameters:
+            parent      : the ReportStore of the recurrent report
+            day_runs    : the RunReport instances of the missed days
+        """
+        min_days = queue.conf.get('BACKFILL_BATCH_MIN_DAYS', 0)
+        if not min_days or len(day_runs) < min_days:
+            return False
+
+        metric_dict = json.loads(parent.parameters)['metric']
+        metric_class = metric_classes.get(metric_dict['name'])
+        if metric_class is None or not issubclass(metric_class, TimeseriesMetric):
+            return False
+        if metric_dict.get('timeseries', TimeseriesChoices.NONE)\
+                != TimeseriesChoices.NONE:
+            return False
+
+        return all(
+            day_run.children and isinstance(day_run.children[0], AggregateReport)
+            for day_run in day_runs
+        )
+
+    def finish(self, child_results):
+        """
+        Splits the aggregated results by day and queues the run of each day
+        """
+        aggregated_results = child_results[0]
+        for day_run in self.day_runs:
+            day_slice = format_pretty_date(day_run.created - timedelta(days=1))
+            day_run.children = [PrecomputedReport(
+                pick_slice(aggregated_results, day_slice)
+            )]
+            day_run.task.delay(day_run)
+
+        task_logger.info('backfilled {0} days with {1}'.format(
+            len(self.day_runs), self
+        ))
+        return {}
+
+
+class PrecomputedReport(ReportLeaf):
+    """
+    Report that returns results computed by another report, see BackfillReport
+    """
+
+    def __init__(self, results, *args, **kwargs):
+        super(PrecomputedReport, self).__init__(*args, **kwargs)
+        self.results = results
+
+    def run(self):
+        return self.results
+
+
+def pick_slice(results, date_slice):
+    """
+    Replaces each timeseries in results, at any depth, by its value at date_slice
+
+    Parameters:
+        results     : results of an AggregateReport on a timeseries metric
+        date_slice  : the formatted start of a timeseries slice
+
+    Returns:
+        the results of that slice, shaped like the results of the same report
+        without a timeseries
+    """
+    if not isinstance(results, Mapping):
+        return results
+    if date_slice in results:
+        return results[date_slice]
+    return dict(
+        (key, pick_slice(value, date_slice)) for key, value in results.iteritems()
+    )
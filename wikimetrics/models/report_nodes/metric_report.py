@@ -1,7 +1,12 @@
-from wikimetrics.configurables import db
+from copy import copy, deepcopy
+from itertools import groupby
+from wikimetrics.api import metric_result_cache
+from wikimetrics.configurables import db, queue
 from report import ReportLeaf
-from wikimetrics.models.storage.wikiuser import WikiUserKey
-from wikimetrics.utils import NO_RESULTS
+from user_results import UserResults
+from wikimetrics.enums import TimeseriesChoices
+from wikimetrics.models.storage import DailyResultStore
+from wikimetrics.utils import NO_RESULTS, chunk, format_pretty_date
 
 
 class MetricReport(ReportLeaf):
@@ -29,12 +34,202 @@ class MetricReport(ReportLeaf):
         self.project = project
 
     def run(self):
-        session = db.get_mw_session(self.project)
-        results_by_user = self.metric(self.user_ids, session)
-        results = {
-            str(WikiUserKey(key, self.project, self.cohort_id)) : value
-            for key, value in results_by_user.items()
-        }
+        metric_key = metric_result_cache.metric_key(self.metric, self.project)
+        cache_key = metric_result_cache.users_key(metric_key, self.user_ids)
+        results_by_user = metric_result_cache.get(cache_key)
+        if results_by_user is None:
+            results_by_user = self.run_metric(metric_key)
+            metric_result_cache.set(cache_key, results_by_user)
+        
+        results = UserResults.from_metric_results(
+            results_by_user, self.project, self.cohort_id
+        )
         if not len(results):
-            results = {NO_RESULTS : self.metric.default_result}
+            results.add_by_key(NO_RESULTS, self.metric.default_result)
         return results
+    
+    def run_metric(self, metric_key):
+        """
+        Runs the metric on the users of this report.  If results by user are cached
+        under metric_key, only the users without cached results are queried.
+        
+        Parameters:
+            metric_key  : see MetricResultCache.metric_key, None to skip the cache
+        
+        Returns:
+            dictionary from user ids to the metric results
+        """
+        if metric_key is None or self.user_ids is None:
+            return self.call_metric(self.user_ids, db.get_mw_session(self.project))
+        
+        if getattr(self.metric, 'additive', False):
+            results_by_user = self.run_by_day()
+            if results_by_user is not None:
+                return results_by_user
+        
+        results_by_user, missing_user_ids = metric_result_cache.get_users(
+            metric_key, self.user_ids
+        )
+        if missing_user_ids:
+            session = db.get_mw_session(self.project)
+            fresh_results = self.call_metric(missing_user_ids, session)
+            metric_result_cache.set_users(metric_key, fresh_results)
+            results_by_user.update(fresh_results)
+        return results_by_user
+    
+    def run_by_day(self):
+        """
+        Computes an additive metric from its results on each day of its window,
+        stored by user, see get_day_results.  Overlapping reports, like the daily
+        runs of a recurrent report or a window rerun a day later, then only query
+        the days that were not computed before.
+        
+        Returns:
+            dictionary from user ids to the metric results, or None if the window
+            is a single day or if more than METRIC_CACHE_MAX_MISSING_DAYS days are
+            missing from the cache, in which case a single query over the whole
+            window is cheaper
+        """
+        day_metrics = self.metric.split_by_day()
+        if len(day_metrics) < 2:
+            return None
+        
+        days = []
+        for day_metric in day_metrics:
+            day_key = metric_result_cache.metric_key(day_metric, self.project)
+            if day_key is None:
+                cached, missing_user_ids = {}, self.user_ids
+            else:
+                cached, missing_user_ids = self.get_day_results(day_key)
+            days.append((day_metric, day_key, cached, missing_user_ids))
+        
+        missing_days = len([day for day in days if day[3]])
+        if missing_days > queue.conf.get('METRIC_CACHE_MAX_MISSING_DAYS', 7):
+            return None
+        
+        # consecutive days missing the same users are queried together, so a window
+        # that is not cached at all still takes a single query
+        session = db.get_mw_session(self.project)
+        results_by_day = []
+        for missing, run in groupby(days, key=lambda day: frozenset(day[3])):
+            run = list(run)
+            if missing:
+                fresh_by_day = self.call_metric_by_day(
+                    [day[0] for day in run], run[0][3], session
+                )
+            else:
+                fresh_by_day = [{} for day in run]
+            
+            for (day_metric, day_key, cached, missing_user_ids), fresh_results in zip(
+                    run, fresh_by_day):
+                if day_key is not None and fresh_results:
+                    self.set_day_results(day_key, fresh_results)
+                cached.update(fresh_results)
+                results_by_day.append(cached)
+        return self.metric.sum_results(results_by_day)
+    
+    def get_day_results(self, day_key):
+        """
+        Looks up the results of the users of this report on a day, in the cache of
+        this worker first, then in the results stored in the database by any
+        worker, which are valid for METRIC_CACHE_DAILY_TTL seconds.
+        
+        Returns:
+            a tuple of a dictionary of the results found by user, and the list of
+            the user ids that have no results yet
+        """
+        cached, missing_user_ids = metric_result_cache.get_users(day_key, self.user_ids)
+        if not missing_user_ids:
+            return cached, missing_user_ids
+        
+        ttl = queue.conf.get('METRIC_CACHE_DAILY_TTL', 2592000)
+        stored, missing_user_ids = DailyResultStore.get_users(
+            db.get_session(), day_key, missing_user_ids, ttl
+        )
+        if stored:
+            metric_result_cache.set_users(day_key, stored, ttl=ttl)
+            cached.update(stored)
+        return cached, missing_user_ids
+    
+    def set_day_results(self, day_key, results_by_user):
+        """
+        Keeps the results of users on a day in the cache of this worker and in the
+        database, see get_day_results
+        """
+        ttl = queue.conf.get('METRIC_CACHE_DAILY_TTL', 2592000)
+        metric_result_cache.set_users(day_key, results_by_user, ttl=ttl)
+        DailyResultStore.set_users(db.get_session(), day_key, results_by_user)
+    
+    def call_metric_by_day(self, day_metrics, user_ids, session):
+        """
+        Computes the results of consecutive days of an additive metric with a single
+        query, as a timeseries by day whose slices cover the same (start, end]
+        windows as the days of split_by_day.
+        
+        Parameters:
+            day_metrics : consecutive metrics returned by split_by_day
+            user_ids    : list of mediawiki user ids
+            session     : sqlalchemy session open on a mediawiki database
+        
+        Returns:
+            list of the dictionaries from user ids to the results of each day
+        """
+        if len(day_metrics) == 1:
+            return [self.call_metric(user_ids, session, metric=day_metrics[0])]
+        
+        metric = deepcopy(day_metrics[0])
+        metric.end_date.data = day_metrics[-1].end_date.data
+        metric.timeseries.data = TimeseriesChoices.DAY
+        metric.slices_include_end = True
+        results = self.call_metric(user_ids, session, metric=metric)
+        
+        # the first slice is named after the start of the window, the others after
+        # their midnight, which are the start dates of the days
+        results_by_day = []
+        for day_metric in day_metrics:
+            day_slice = format_pretty_date(day_metric.start_date.data)
+            results_by_day.append(dict(
+                (user_id, dict(
+                    (label, timeseries.get(day_slice, 0))
+                    for label, timeseries in user_results.iteritems()
+                ))
+                for user_id, user_results in results.iteritems()
+            ))
+        return results_by_day
+    
+    def call_metric(self, user_ids, session, metric=None):
+        """
+        Calls the metric on user_ids.  Lists longer than MEDIAWIKI_FILTER_INLINE_MAX
+        but shorter than MEDIAWIKI_FILTER_TEMP_TABLE_MIN are split into chunks that
+        each fit in the inline IN clause of Metric.filter, and the results of the
+        chunks are merged, as metrics compute each user independently.  Longer
+        lists are passed whole, and Metric.filter loads them into temporary tables,
+        dropped once the metric returns.
+        
+        Parameters:
+            user_ids    : list of mediawiki user ids, or None for the whole project
+            session     : sqlalchemy session open on a mediawiki database
+            metric      : the metric to call, defaults to the metric of this report
+        
+        Returns:
+            dictionary from user ids to the metric results
+        """
+        if metric is None:
+            metric = self.metric
+        if metric.project != self.project:
+            # the metric can be shared by the reports of several projects
+            metric = copy(metric)
+            metric.project = self.project
+            metric.user_ids_tables = None
+        inline_max = db.config.get('MEDIAWIKI_FILTER_INLINE_MAX', 1000)
+        temp_table_min = db.config.get('MEDIAWIKI_FILTER_TEMP_TABLE_MIN', 20000)
+        if user_ids is None or not inline_max < len(user_ids) < temp_table_min:
+            try:
+                return metric(user_ids, session)
+            finally:
+                metric.drop_user_ids_tables(session)
+        
+        results_by_user = {}
+        for user_ids_chunk in chunk(user_ids, inline_max):
+            results_by_user.update(metric(user_ids_chunk, session))
+        return results_by_user
@@ -1,7 +1,10 @@
+from multiprocessing.pool import ThreadPool
 from celery.utils.log import get_task_logger
 from wikimetrics.api import CohortService
+from wikimetrics.configurables import db, queue
 from report import ReportNode
 from metric_report import MetricReport
+from user_results import UserResults
 
 
 __all__ = ['MultiProjectMetricReport']
@@ -17,6 +20,8 @@ class MultiProjectMetricReport(ReportNode):
     each project-homogenous list of user_ids.
     """
     show_in_ui = False
+    # each project can run in its own task, see ReportNode.run_distributed
+    distribute_children = True
     
     def __init__(self, cohort, metric, *args, **kwargs):
         """
@@ -36,9 +41,50 @@ class MultiProjectMetricReport(ReportNode):
                 MetricReport(metric, cohort.id, user_ids, project, *args, **kwargs)
             )
     
-    def finish(self, metric_results):
-        merged_individual_results = {}
-        for res in metric_results:
-            merged_individual_results.update(res)
+    def run_children(self):
+        """
+        Runs the per-project MetricReport children in a pool of threads.
+        The size of the pool is bounded by MEDIAWIKI_REPORT_CONCURRENCY, and the
+        number of children querying the same database host at the same time is
+        bounded by MEDIAWIKI_HOST_CONCURRENCY.  With a concurrency of 1, or a
+        single child, this falls back to running the children one after the other.
         
-        return merged_individual_results
+        Returns:
+            array of the results of each child, in the order of self.children
+        """
+        concurrency = min(
+            len(self.children),
+            db.config.get('MEDIAWIKI_REPORT_CONCURRENCY', 1),
+        )
+        if concurrency <= 1:
+            return super(MultiProjectMetricReport, self).run_children()
+        
+        task_logger.info('running {0} projects for {1} with {2} threads'.format(
+            len(self.children), self, concurrency
+        ))
+        pool = ThreadPool(concurrency)
+        try:
+            pending = pool.map_async(run_metric_report, self.children)
+            # NOTE: waiting with a timeout, as opposed to a plain get(), lets the
+            # main thread receive celery's SoftTimeLimitExceeded while it waits
+            return pending.get(queue.conf.get('CELERYD_TASK_TIME_LIMIT', 3630))
+        finally:
+            pool.terminate()
+    
+    def finish(self, metric_results):
+        return UserResults.merge(metric_results)
+
+
+def run_metric_report(metric_report):
+    """
+    Runs a MetricReport from a worker thread.  Holds the semaphore of the
+    project's database host while it runs, and removes the thread-local
+    mediawiki session afterwards so connections are not left behind.
+    """
+    with db.get_mw_host_semaphore(metric_report.project):
+        try:
+            return metric_report.run()
+        finally:
+            session = db.mediawiki_sessions.get(metric_report.project)
+            if session is not None:
+                session.remove()
@@ -0,0 +1,55 @@
+from collections import defaultdict
+from sum_aggregate_by_user_report import SumAggregateByUserReport
+from wikimetrics.models.storage.wikiuser import WikiUserKey
+from wikimetrics.enums import Aggregation
+from wikimetrics.utils import NO_RESULTS, r
+
+
+__all__ = ['ProgramEditMetricsReport']
+
+# submetrics of ProgramEditMetrics aggregated across projects by user, like
+# SumAggregateByUserReport does, the others are summed like AggregateReport does
+BY_USER_SUBMETRICS = ['rolling_active_editor', 'pages_edited']
+SUM_SUBMETRICS = ['pages_created', 'absolute_sum']
+
+
+class ProgramEditMetricsReport(SumAggregateByUserReport):
+    """
+    A node responsible for running ProgramEditMetrics on a cohort and splitting its
+    results into the results of the reports it replaces in RunProgramMetricsReport:
+    the active editors, pages created, pages edited and bytes added reports.
+    """
+    show_in_ui = False
+
+    def finish(self, child_results):
+        """
+        Returns:
+            a list of the four results, in the order above, each shaped like the
+            result of the report it replaces: {Aggregation.SUM: {submetric: value}}
+        """
+        results = child_results[0]  # One child only.
+
+        aggregated_results = defaultdict(lambda: defaultdict(lambda: 0))
+        summed_results = dict((name, 0) for name in SUM_SUBMETRICS)
+        for key_str, result in results.iteritems():
+            if key_str == NO_RESULTS:
+                continue
+            username = self.usernames[WikiUserKey.fromstr(key_str)]
+            for metric_name in BY_USER_SUBMETRICS:
+                aggregated_results[username][metric_name] |= result[metric_name]
+            for metric_name in SUM_SUBMETRICS:
+                summed_results[metric_name] += result[metric_name]
+
+        for metric_name in BY_USER_SUBMETRICS:
+            summed_results[metric_name] = sum(
+                by_user[metric_name] for by_user in aggregated_results.itervalues()
+            )
+
+        return [
+            {Aggregation.SUM: {
+                'rolling_active_editor': summed_results['rolling_active_editor']
+            }},
+            {Aggregation.SUM: {'pages_created': r(summed_results['pages_created'])}},
+            {Aggregation.SUM: {'pages_edited': summed_results['pages_edited']}},
+            {Aggregation.SUM: {'absolute_sum': r(summed_results['absolute_sum'])}},
+        ]
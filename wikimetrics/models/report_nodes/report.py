@@ -1,7 +1,9 @@
 import celery
 import traceback
 from uuid import uuid4
-from celery import current_task
+from collections import OrderedDict
+from threading import Lock
+from celery import current_task, chord, group
 from datetime import datetime
 # AsyncResult shows up as un-needed but actually is (for celery.states to work)
 from celery.result import AsyncResult
@@ -19,6 +21,7 @@ __all__ = [
     'Report',
     'ReportNode',
     'ReportLeaf',
+    'ReportStatusWriter',
     'queue_task',
 ]
 
@@ -52,18 +55,120 @@ def queue_task(report):
     try:
         return report.run()
     except Exception, e:
-        # Create a task error with the failure information.
-        if report.persistent_id is not None:
-            message = '%s: %s' % (type(e).__name__, e.message)
-            trace = traceback.format_exc()
-            TaskErrorStore.add('report', report.persistent_id, message, trace)
+        record_task_error(report, e)
         raise e
 
 
+@queue.task()
+def run_leaf_task(report):
+    """
+    Runs one of the remote leaves of a distributed report tree,
+    see ReportNode.run_distributed
+    """
+    task_logger.info('running {0} on celery as {1}'.format(
+        report,
+        current_task.request.id,
+    ))
+    try:
+        return report.run()
+    finally:
+        for project, session in db.mediawiki_sessions.items():
+            session.remove()
+
+
+@queue.task()
+def finish_tree_task(remote_results, report):
+    """
+    The callback of the chord started by ReportNode.run_distributed.
+    
+    Parameters:
+        remote_results  : the results of the remote leaves of the tree, in order
+        report          : the root of the tree
+    """
+    task_logger.info('finishing {0} on celery as {1}'.format(
+        report,
+        current_task.request.id,
+    ))
+    try:
+        return report.finish_distributed(remote_results)
+    except Exception, e:
+        record_task_error(report, e)
+        raise e
+
+
+@queue.task()
+def fail_tree_task(task_id, report):
+    """
+    The error callback of the remote leaves of the chord started by
+    ReportNode.run_distributed.  When a leaf fails the chord's callback never
+    runs, so this marks the whole tree as failed and records the leaf's error.
+    
+    Parameters:
+        task_id : the id of the leaf task that failed
+        report  : the root of the tree
+    """
+    failed = AsyncResult(task_id)
+    task_logger.error('leaf {0} of {1} failed'.format(task_id, report))
+    report.fail_distributed(failed.result, failed.traceback)
+
+
+def record_task_error(report, e):
+    """
+    Creates a task error with the failure information, if the report is stored.
+    Must be called while handling the exception, to get its traceback.
+    """
+    if report.persistent_id is not None:
+        message = '%s: %s' % (type(e).__name__, e.message)
+        trace = traceback.format_exc()
+        TaskErrorStore.add('report', report.persistent_id, message, trace)
+
+
+class ReportStatusWriter(object):
+    """
+    Buffers the status and result key changes of the stored nodes in a report tree.
+    The root of the tree flushes them when the tree starts and when it is done, so
+    all the changes of a phase are written with a few bulk UPDATEs and one commit,
+    instead of one query and one commit per change.  Children that run in a
+    thread pool share the writer, so the pending changes are guarded by a lock.
+    """
+    
+    def __init__(self, root_id=None, root_only=False):
+        """
+        Parameters:
+            root_id     : the persistent_id of the root of the tree
+            root_only   : if True, drop the changes to any report but the root
+        """
+        self.root_id = root_id
+        self.root_only = root_only
+        self.pending = OrderedDict()
+        self.lock = Lock()
+    
+    def set(self, persistent_id, **values):
+        """
+        Records that the ReportStore with this id should get these column values
+        """
+        if self.root_only and persistent_id != self.root_id:
+            return
+        with self.lock:
+            self.pending.setdefault(persistent_id, {}).update(values)
+    
+    def flush(self):
+        """
+        Writes all the pending changes to the database
+        """
+        with self.lock:
+            pending, self.pending = self.pending, OrderedDict()
+        if not pending:
+            return
+        ReportStore.update_by_id(db.get_session(), pending)
+
+
 class Report(object):
     
     show_in_ui = False
     task = queue_task
+    # set while the report runs as part of a tree, see ReportNode.run
+    status_writer = None
     
     def __init__(self,
                  user_id=None,
@@ -114,7 +219,8 @@ class Report(object):
             try:
                 session = db.get_session()
                 session.add(pj)
-                session.commit()
+                # flush to get an id, which the default name needs
+                session.flush()
                 self.persistent_id = pj.id
                 self.created = pj.created
                 pj.name = self.name or str(self)
@@ -135,26 +241,94 @@ class Report(object):
     def set_status(self, status, task_id=None):
         """
         helper function for updating database status after celery
-        task has been started
+        task has been started.  If the report is running as part of a tree,
+        the change is buffered and written when the root of the tree flushes.
         """
         self.status = status
         if self.store is True:
-            session = db.get_session()
-            pj = session.query(ReportStore).get(self.persistent_id)
-            pj.status = status
+            values = {'status': status}
             if task_id:
-                pj.queue_result_key = task_id
-            session.commit()
+                values['queue_result_key'] = task_id
+            self.write(values)
+    
+    def write(self, values):
+        """
+        Writes column values to this report's ReportStore, or buffers them in
+        status_writer if there is one.
+        
+        Parameters:
+            values  : dictionary of ReportStore column names to their new values
+        """
+        if self.status_writer is not None:
+            self.status_writer.set(self.persistent_id, **values)
+        else:
+            ReportStore.update_by_id(db.get_session(), {self.persistent_id: values})
     
     def run(self):
         """
         each report subclass should implement this method to do the
         meat of the task.  The return type can be anything"""
         pass
+    
+    def remote_leaves(self):
+        """
+        Returns the reports under this one that run as their own celery tasks when
+        the tree is distributed, see ReportNode.run_distributed
+        """
+        return []
+    
+    def fail_distributed(self, error, trace=None):
+        """
+        Marks a tree started with run_distributed as failed, with all its stored
+        nodes, and records the error for the root.  Otherwise the root would stay
+        STARTED, and a failed run of a recurrent report would never be retried.
+        
+        Parameters:
+            error   : the exception of the leaf that failed, or None if unknown
+            trace   : the formatted traceback of the error, if known
+        """
+        self.status_writer = ReportStatusWriter(
+            root_id=self.persistent_id,
+            root_only=queue.conf.get('REPORT_STATUS_ROOT_ONLY', False),
+        )
+        try:
+            self.fail_tree()
+        finally:
+            self.status_writer.flush()
+            self.status_writer = None
+        
+        if self.persistent_id is not None:
+            if isinstance(error, Exception):
+                message = '%s: %s' % (type(error).__name__, error)
+            else:
+                message = 'a remote leaf of the report failed'
+            TaskErrorStore.add('report', self.persistent_id, message, trace or '')
+    
+    def fail_tree(self):
+        self.set_status(celery.states.FAILURE)
+        for child in self.children:
+            child.status_writer = self.status_writer
+            if isinstance(child, ReportNode):
+                child.fail_tree()
+            else:
+                child.set_status(celery.states.FAILURE)
+    
+    def finish_tree(self, remote_results):
+        """
+        Computes the results of this report as part of a distributed tree.
+        A report that is not a remote leaf just runs.
+        
+        Parameters:
+            remote_results  : iterator over the results of the remote leaves
+        """
+        return self.run()
 
 
 class ReportNode(Report):
     
+    # if True, the children of this node are the remote leaves of distributed trees
+    distribute_children = False
+    
     def run(self):
         """
         This specialized version of run first runs all the children, then
@@ -165,28 +339,163 @@ class ReportNode(Report):
         So now this just runs all the children's run methods, collects the results,
         and passes them to the finish method.  Deadlocking and celery worker starvation
         are *much* less likely now.  Thank you Ori :)
+        
+        The root of the tree shares a ReportStatusWriter with all its descendants,
+        and writes their status changes when the tree starts and when it finishes.
+        With REPORT_STATUS_ROOT_ONLY configured, only the root's changes are written.
+        
+        With DISTRIBUTED_REPORTS configured, the root hands the tree over to
+        run_distributed instead, if the tree has any remote leaves.
         """
-        self.set_status(celery.states.STARTED, task_id=current_task.request.id)
-        results = []
-        if self.children:
-            try:
-                child_results = []
-                for child in self.children:
-                    child_results.append(child.run())
-                    for project, session in db.mediawiki_sessions.items():
-                        session.remove()
-                results = self.finish(child_results)
-            except SoftTimeLimitExceeded:
-                self.set_status(celery.states.FAILURE)
-                task_logger.error('timeout exceeded for {0}'.format(
-                    current_task.request.id
-                ))
-                raise
+        is_root = self.status_writer is None
+        if is_root and queue.conf.get('DISTRIBUTED_REPORTS', False):
+            remote_leaves = self.remote_leaves()
+            if remote_leaves:
+                return self.run_distributed(remote_leaves)
+        
+        if is_root:
+            self.status_writer = ReportStatusWriter(
+                root_id=self.persistent_id,
+                root_only=queue.conf.get('REPORT_STATUS_ROOT_ONLY', False),
+            )
+        for child in self.children:
+            child.status_writer = self.status_writer
+        
+        try:
+            self.set_status(celery.states.STARTED, task_id=current_task.request.id)
+            if is_root:
+                self.status_writer.flush()
+            
+            results = []
+            if self.children:
+                try:
+                    child_results = self.run_children()
+                    results = self.finish(child_results)
+                except SoftTimeLimitExceeded:
+                    self.set_status(celery.states.FAILURE)
+                    task_logger.error('timeout exceeded for {0}'.format(
+                        current_task.request.id
+                    ))
+                    raise
+            
+            self.set_status(celery.states.SUCCESS)
+        finally:
+            if is_root:
+                # result keys and final statuses of the whole tree, written together
+                self.status_writer.flush()
+                self.status_writer = None
+        
+        self.post_process(results)
+        return results
+    
+    def run_children(self):
+        """
+        Runs all the children of this node, one after the other, removing the
+        mediawiki sessions after each one.  Subclasses can override this to change
+        the way children are executed, as long as the results keep the same order.
         
+        Returns:
+            array of the results of each child, in the order of self.children
+        """
+        child_results = []
+        for child in self.children:
+            child_results.append(child.run())
+            for project, session in db.mediawiki_sessions.items():
+                session.remove()
+        return child_results
+    
+    def remote_leaves(self):
+        if self.distribute_children:
+            return list(self.children)
+        return [leaf for child in self.children for leaf in child.remote_leaves()]
+    
+    def run_distributed(self, remote_leaves):
+        """
+        Runs the remote leaves of this tree as a celery chord.  Each leaf is a task
+        on the METRIC_QUEUE, and the callback, on the REPORT_QUEUE, finishes the
+        whole tree.  This does not wait for the chord, so no worker is held while
+        the leaves run.  The callback's task id becomes the queue_result_key of this
+        report, so that is where its status and results are looked up.  If a leaf
+        fails, its error callback fails the tree instead, see fail_distributed.
+        
+        Parameters:
+            remote_leaves   : the reports to run as separate tasks, in the order
+                              finish_tree expects their results
+        """
+        callback_id = str(uuid4())
+        # written before the chord starts, so it can't overwrite the callback's status
+        self.set_status(celery.states.STARTED, task_id=callback_id)
+        
+        task_logger.info('running {0} leaves of {1} as chord {2}'.format(
+            len(remote_leaves), self, callback_id
+        ))
+        metric_queue = queue.conf.get('METRIC_QUEUE', 'metric')
+        report_queue = queue.conf.get('REPORT_QUEUE', 'report')
+        errback = fail_tree_task.s(self).set(queue=report_queue)
+        leaf_tasks = []
+        for leaf in remote_leaves:
+            leaf_task = run_leaf_task.s(leaf).set(queue=metric_queue)
+            leaf_task.link_error(errback)
+            leaf_tasks.append(leaf_task)
+        callback = finish_tree_task.s(self).set(
+            queue=report_queue,
+            task_id=callback_id,
+        )
+        chord(group(leaf_tasks))(callback)
+    
+    def finish_distributed(self, remote_results):
+        """
+        Finishes a tree started with run_distributed, once all its remote leaves
+        are done.  Status changes are buffered and flushed like in run.
+        
+        Parameters:
+            remote_results  : list of the results of the remote leaves, in order
+        """
+        self.status_writer = ReportStatusWriter(
+            root_id=self.persistent_id,
+            root_only=queue.conf.get('REPORT_STATUS_ROOT_ONLY', False),
+        )
+        try:
+            for result in remote_results:
+                # failed leaves are passed as their exceptions when run eagerly
+                if isinstance(result, Exception):
+                    raise result
+            results = self.finish(self.finish_children(iter(remote_results)))
+            self.set_status(celery.states.SUCCESS)
+        except Exception:
+            self.set_status(celery.states.FAILURE)
+            raise
+        finally:
+            self.status_writer.flush()
+            self.status_writer = None
+        
+        self.post_process(results)
+        return results
+    
+    def finish_tree(self, remote_results):
+        results = self.finish(self.finish_children(remote_results))
         self.set_status(celery.states.SUCCESS)
         self.post_process(results)
         return results
     
+    def finish_children(self, remote_results):
+        """
+        Collects the results of the children of this node in a distributed tree.
+        They either are remote leaves, or are computed with finish_tree.
+        
+        Parameters:
+            remote_results  : iterator over the results of the remote leaves
+        
+        Returns:
+            array of the results of each child, in the order of self.children
+        """
+        for child in self.children:
+            child.status_writer = self.status_writer
+        
+        if self.distribute_children:
+            return [next(remote_results) for child in self.children]
+        return [child.finish_tree(remote_results) for child in self.children]
+    
     def finish(self, child_results):
         """
         Each ReportNode subclass should implement this method to deal with
@@ -232,11 +541,7 @@ class ReportNode(Report):
         self.result_key = str(uuid4())
 
         if self.store:
-            db_session = db.get_session()
-            pj = db_session.query(ReportStore).get(self.persistent_id)
-            pj.result_key = self.result_key
-            db_session.add(pj)
-            db_session.commit()
+            self.write({'result_key': self.result_key})
         
         merged = {self.result_key: results}
         for child_result in child_results:
@@ -7,8 +7,9 @@ from report import ReportNode
 from aggregate_report import AggregateReport
 from validate_program_metrics_report import ValidateProgramMetricsReport
 from sum_aggregate_by_user_report import SumAggregateByUserReport
+from program_edit_metrics_report import ProgramEditMetricsReport
 from wikimetrics.api import ReportService, CohortService
-from wikimetrics.configurables import db
+from wikimetrics.configurables import db, queue
 
 __all__ = ['RunProgramMetricsReport']
 task_logger = get_task_logger(__name__)
@@ -42,6 +43,8 @@ class RunProgramMetricsReport(ReportNode):
         self.user_id = user_id
         self.recurrent_parent_id = None
         self.persistent_id = None
+        # compute the edit based metrics in one pass, see ProgramEditMetricsReport
+        self.single_scan = queue.conf.get('PROGRAM_METRICS_SINGLE_SCAN', False)
 
     def run(self):
         """
@@ -85,7 +88,10 @@ class RunProgramMetricsReport(ReportNode):
                 persistent_id=self.persistent_id,
             )
             
-            if validate_report.valid():
+            if validate_report.valid() and self.single_scan:
+                self.children = [self.get_edit_metrics_report(),
+                                 self.get_new_editors_report()]
+            elif validate_report.valid():
                 self.children = [self.get_active_editors_report(),
                                  self.get_new_editors_report(),
                                  self.get_pages_created_report(),
@@ -107,6 +113,13 @@ class RunProgramMetricsReport(ReportNode):
         # Delete the cohort - we don't want to store these cohorts permanently
         cohort_service.delete_owner_cohort(None, self.cohort_id)
         if len(aggregated_results) > 1:
+            if self.single_scan:
+                # Put the results of the edit metrics back in the order of the
+                # reports they replace, around the new editors results
+                edit_results, new_editors_results = aggregated_results
+                aggregated_results = edit_results
+                aggregated_results.insert(1, new_editors_results)
+
             # Get all the results into the desired shape and return them
             new_editors_count = aggregated_results[1][Aggregation.SUM]['newly_registered']
 
@@ -186,6 +199,23 @@ class RunProgramMetricsReport(ReportNode):
             },
         })
 
+    def get_edit_metrics_report(self):
+        metric = metric_classes['ProgramEditMetrics'](
+            start_date=self.start_date,
+            end_date=self.end_date,
+            namespaces=[0],
+        )
+        return ProgramEditMetricsReport(self.cohort,
+                                        metric,
+                                        parameters={
+                                            'name': 'Program Edit Metrics report',
+                                            'cohort': {
+                                                'id': self.cohort.id,
+                                                'name': self.cohort.name,
+                                            },
+                                        },
+                                        user_id=self.user_id)
+
     def get_new_editors_report(self):
         return self.get_aggregate_by_user_report({
             'name': 'New Editors report',
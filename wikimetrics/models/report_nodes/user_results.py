@@ -0,0 +1,287 @@
+from array import array
+from collections import Mapping, OrderedDict
+from wikimetrics.models.storage.wikiuser import WikiUserKey
+
+
+__all__ = ['UserResults']
+
+
+class UserResults(Mapping):
+    """
+    Columnar container for the results of a metric by user, as they flow through
+    the report tree.  It is read like the dictionary it replaces:
+
+        {
+            'user_id|project|cohort_id': {
+                'submetric': value,
+                'timeseries submetric': {'date slice': value, ...},
+            },
+            ...
+        }
+
+    but instead of one dictionary per user, it keeps:
+
+        * user_ids      : an array of mediawiki user ids
+        * group_codes   : an array of indexes into groups, one per user
+        * groups        : the distinct (project, cohort_id) pairs of the users
+        * columns       : one list of values per submetric or per (submetric, date
+                          slice), shrunk to a typed array when all values are
+                          integers or all values are floats
+
+    Entries that do not fit the columns, like NO_RESULTS or results that are not
+    dictionaries of submetrics, are kept as they are in self.other.
+
+    This keeps the celery payloads small and makes merging results cheap.  It is
+    turned back into plain dictionaries only where the results leave the tree:
+    the JSON encoder handles any Mapping, and the CSV export iterates it.
+    """
+
+    def __init__(self):
+        self.groups = []
+        self.group_codes = array('i')
+        self.user_ids = array('l')
+        self.columns = OrderedDict()
+        self.other = OrderedDict()
+        self._group_index = {}
+        self._row_index = None
+
+    @classmethod
+    def from_metric_results(cls, results_by_user, project, cohort_id):
+        """
+        Parameters:
+            results_by_user : the output of a metric, a dictionary of user ids
+                              to results
+            project         : the mediawiki project the metric ran on
+            cohort_id       : the cohort the users belong to
+
+        Returns:
+            an instance of UserResults
+        """
+        results = cls()
+        for user_id, result in results_by_user.iteritems():
+            results.add(user_id, project, cohort_id, result)
+        results.compact()
+        return results
+
+    @classmethod
+    def merge(cls, parts):
+        """
+        Merges UserResults instances, or plain dictionaries keyed like the
+        results of MetricReport.  Each part is expected to hold different users,
+        as each part comes from a different project.
+
+        Parameters:
+            parts   : list of UserResults instances or dictionaries
+
+        Returns:
+            an instance of UserResults
+        """
+        results = cls()
+        for part in parts:
+            if isinstance(part, UserResults) and results.fits(part):
+                results.extend(part)
+            else:
+                for key, result in part.iteritems():
+                    results.add_by_key(key, result)
+        results.compact()
+        return results
+
+    def add(self, user_id, project, cohort_id, result):
+        """
+        Appends the result of one user
+        """
+        cells = split_result(result)
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            cells = None
+
+        if cells is not None and not self.user_ids:
+            self.columns = OrderedDict((column, []) for column in cells)
+
+        if cells is None or len(cells) != len(self.columns)\
+                or any(column not in self.columns for column in cells):
+            self.other[str(WikiUserKey(user_id, project, cohort_id))] = result
+            return
+
+        for column, values in self.columns.iteritems():
+            if not isinstance(values, list):
+                values = self.columns[column] = list(values)
+            values.append(cells[column])
+        self.user_ids.append(user_id)
+        self.group_codes.append(self.group_code(project, cohort_id))
+        self._row_index = None
+
+    def add_by_key(self, key, result):
+        """
+        Appends the result of one user, identified by its WikiUserKey string, or
+        any other entry of a legacy results dictionary
+        """
+        try:
+            wiki_user_key = WikiUserKey.fromstr(key)
+        except (AttributeError, ValueError):
+            self.other[key] = result
+            return
+
+        self.add(
+            wiki_user_key.user_id,
+            wiki_user_key.user_project,
+            wiki_user_key.cohort_id,
+            result,
+        )
+
+    def fits(self, other):
+        """
+        Returns True if the user results of other can be appended column by column
+        """
+        return not self.user_ids or self.columns.keys() == other.columns.keys()
+
+    def extend(self, other):
+        """
+        Appends all the results of another UserResults instance with the same columns
+        """
+        if not self.user_ids:
+            self.columns = OrderedDict(
+                (column, list(values)) for column, values in other.columns.iteritems()
+            )
+        else:
+            for column, values in self.columns.iteritems():
+                if not isinstance(values, list):
+                    values = self.columns[column] = list(values)
+                values.extend(other.columns[column])
+
+        recode = [self.group_code(*group) for group in other.groups]
+        self.group_codes.extend(array('i', [recode[code] for code in other.group_codes]))
+        self.user_ids.extend(other.user_ids)
+        for key, result in other.other.iteritems():
+            self.other[key] = result
+        self._row_index = None
+
+    def compact(self):
+        """
+        Shrinks columns to typed arrays where possible
+        """
+        for column, values in self.columns.iteritems():
+            self.columns[column] = compact_values(values)
+
+    def group_code(self, project, cohort_id):
+        group = (str(project), str(cohort_id))
+        if group not in self._group_index:
+            self._group_index[group] = len(self.groups)
+            self.groups.append(group)
+        return self._group_index[group]
+
+    def row_key(self, row):
+        project, cohort_id = self.groups[self.group_codes[row]]
+        return WikiUserKey.SEPARATOR.join((str(self.user_ids[row]), project, cohort_id))
+
+    def row(self, row):
+        """
+        Returns the result of the user in this row, shaped like a metric's result
+        """
+        result = OrderedDict()
+        for (label, date_slice), values in self.columns.iteritems():
+            if date_slice is None:
+                result[label] = values[row]
+            else:
+                result.setdefault(label, OrderedDict())[date_slice] = values[row]
+        return result
+
+    def find_row(self, key):
+        if self._row_index is None:
+            self._row_index = dict(
+                ((user_id, code), row) for row, (user_id, code)
+                in enumerate(zip(self.user_ids, self.group_codes))
+            )
+
+        try:
+            wiki_user_key = WikiUserKey.fromstr(key)
+            code = self._group_index[
+                (wiki_user_key.user_project, wiki_user_key.cohort_id)
+            ]
+            return self._row_index[(int(wiki_user_key.user_id), code)]
+        except (AttributeError, ValueError, KeyError):
+            return None
+
+    def __getitem__(self, key):
+        if key in self.other:
+            return self.other[key]
+        row = self.find_row(key)
+        if row is None:
+            raise KeyError(key)
+        return self.row(row)
+
+    def __contains__(self, key):
+        return key in self.other or self.find_row(key) is not None
+
+    def __iter__(self):
+        for row in xrange(len(self.user_ids)):
+            yield self.row_key(row)
+        for key in self.other:
+            yield key
+
+    def iteritems(self):
+        for row in xrange(len(self.user_ids)):
+            yield self.row_key(row), self.row(row)
+        for item in self.other.iteritems():
+            yield item
+
+    def itervalues(self):
+        for row in xrange(len(self.user_ids)):
+            yield self.row(row)
+        for value in self.other.itervalues():
+            yield value
+
+    def values(self):
+        return list(self.itervalues())
+
+    def __len__(self):
+        return len(self.user_ids) + len(self.other)
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_row_index'] = None
+        return state
+
+
+def split_result(result):
+    """
+    Splits the result of one user into cells keyed by (submetric, date slice),
+    with a date slice of None for submetrics that are not timeseries.
+    Returns None if the result can not be split into columns.
+    """
+    if not isinstance(result, dict):
+        return None
+
+    cells = OrderedDict()
+    for label, value in result.iteritems():
+        if isinstance(value, dict):
+            if not value:
+                return None
+            for date_slice, date_value in value.iteritems():
+                cells[(label, date_slice)] = date_value
+        else:
+            cells[(label, None)] = value
+    return cells
+
+
+def compact_values(values):
+    """
+    Returns values as an array of longs if they are all integers, an array of
+    doubles if they are all floats, or a list otherwise
+    """
+    if not isinstance(values, list):
+        return values
+
+    types = set(type(value) for value in values)
+    try:
+        if types and types <= set([int, long]):
+            return array('l', values)
+        if types == set([float]):
+            return array('d', values)
+    except OverflowError:
+        pass
+    return values
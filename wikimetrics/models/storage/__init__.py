@@ -7,6 +7,7 @@ from report import *
 from user import *
 from wikiuser import *
 from task_error import *
+from daily_result import *
 
 # ignore flake8 because of F403 violation
 # flake8: noqa
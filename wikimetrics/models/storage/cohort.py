@@ -101,6 +101,23 @@ class CohortStore(db.WikimetricsBase):
             for project, users in groups
         )
 
+    def projects(self):
+        """
+        Lists the projects of this cohort without fetching its users
+
+        Returns:
+            list of the projects group_by_project groups the users of this cohort by
+        """
+        db_session = db.get_session()
+        projects = self.filter_wikiuser_query(
+            db_session.query(WikiUserStore.project)
+        ).distinct().all()
+
+        if not len(projects):
+            return [self.default_project]
+
+        return [r[0] or self.default_project for r in projects]
+
     def filter_wikiuser_query(self, wikiusers_query):
         """
         Parameters:
@@ -0,0 +1,107 @@
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import Column, Integer, String, DateTime, func
+from wikimetrics.configurables import db
+from wikimetrics.utils import BetterEncoder, chunk
+
+
+# user ids looked up or replaced per statement
+USERS_PER_STATEMENT = 1000
+
+
+class DailyResultStore(db.WikimetricsBase):
+    """
+    Stores the results by user of additive metrics on single days, so that the
+    daily runs of a recurrent report and other overlapping reports can reuse them
+    from any worker, even after a restart, see MetricReport.run_by_day.
+
+    Rows are keyed on the metric_key of the metric of the day, see
+    MetricResultCache.metric_key, which covers the metric class, its parameters,
+    the day and the project.  The result is stored as JSON.
+    """
+    __tablename__ = 'daily_result'
+
+    metric_key = Column(String(40), primary_key=True)
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    result = Column(String(1000), nullable=False)
+    created = Column(DateTime, nullable=False, default=func.now())
+
+    @staticmethod
+    def get_users(db_session, metric_key, user_ids, ttl):
+        """
+        Looks up the stored results of users under a metric_key
+
+        Parameters:
+            db_session  : session to the wikimetrics database
+            metric_key  : the key of the metric of a day
+            user_ids    : list of mediawiki user ids
+            ttl         : seconds a stored result stays valid
+
+        Returns:
+            a tuple of a dictionary of the stored results of those users,
+            and the list of the user ids that have no stored results
+        """
+        oldest = datetime.now() - timedelta(seconds=ttl)
+        stored = {}
+        for user_ids_chunk in chunk(user_ids, USERS_PER_STATEMENT):
+            rows = db_session.query(DailyResultStore.user_id, DailyResultStore.result)\
+                .filter(DailyResultStore.metric_key == metric_key)\
+                .filter(DailyResultStore.user_id.in_(user_ids_chunk))\
+                .filter(DailyResultStore.created >= oldest)\
+                .all()
+            for user_id, result in rows:
+                stored[user_id] = json.loads(result)
+        db_session.commit()
+
+        missing = [user_id for user_id in user_ids if user_id not in stored]
+        return stored, missing
+
+    @staticmethod
+    def set_users(db_session, metric_key, results_by_user):
+        """
+        Stores results by user under a metric_key, replacing any older ones
+
+        Parameters:
+            db_session      : session to the wikimetrics database
+            metric_key      : the key of the metric of a day
+            results_by_user : dictionary from user ids to results
+        """
+        now = datetime.now()
+        try:
+            for user_ids_chunk in chunk(results_by_user.keys(), USERS_PER_STATEMENT):
+                db_session.query(DailyResultStore)\
+                    .filter(DailyResultStore.metric_key == metric_key)\
+                    .filter(DailyResultStore.user_id.in_(user_ids_chunk))\
+                    .delete(synchronize_session=False)
+                # another worker may store the same day at the same time
+                db_session.execute(
+                    DailyResultStore.__table__.insert().prefix_with('IGNORE'),
+                    [{
+                        'metric_key': metric_key,
+                        'user_id': user_id,
+                        'result': json.dumps(results_by_user[user_id], cls=BetterEncoder),
+                        'created': now,
+                    } for user_id in user_ids_chunk]
+                )
+            db_session.commit()
+        except Exception:
+            db_session.rollback()
+            raise
+
+    @staticmethod
+    def delete_expired(db_session, ttl):
+        """
+        Deletes the results stored more than ttl seconds ago
+
+        Returns:
+            the number of deleted results
+        """
+        oldest = datetime.now() - timedelta(seconds=ttl)
+        deleted = db_session.query(DailyResultStore)\
+            .filter(DailyResultStore.created < oldest)\
+            .delete(synchronize_session=False)
+        db_session.commit()
+        return deleted
+
+    def __repr__(self):
+        return '<DailyResultStore("{0}", {1})>'.format(self.metric_key, self.user_id)
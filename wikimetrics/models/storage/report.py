@@ -1,9 +1,12 @@
 import celery
 import json
+from collections import defaultdict
 from sqlalchemy import Column, Integer, String, DateTime, Boolean, func, ForeignKey
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.schema import UniqueConstraint, Index
-from sqlalchemy.sql.expression import and_
+from sqlalchemy.sql.expression import and_, case
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.dialects.mysql import VARBINARY
 from wikimetrics.configurables import db, app
@@ -96,6 +99,53 @@ class ReportStore(db.WikimetricsBase):
                 'Unauthorized access to report by {0}'.format(owner_id)
             )
 
+    @staticmethod
+    def update_by_id(db_session, values_by_id):
+        """
+        Updates columns of several reports with a single UPDATE, where each column
+        is set to a CASE on the report id, and commits the changes.  Instances of
+        these reports that are already loaded in db_session get the new values as
+        well.
+
+         UPDATE report
+            SET status = CASE id WHEN 1 THEN 'SUCCESS' WHEN 2 THEN ... ELSE status END
+          WHERE id IN (1, 2, ...)
+
+        Parameters:
+            db_session      : session to the wikimetrics database
+            values_by_id    : dictionary from ReportStore.id to a dictionary
+                              of column names to the values they should be set to
+        """
+        if not values_by_id:
+            return
+
+        values_by_column = defaultdict(dict)
+        for report_id, values in values_by_id.items():
+            for column, value in values.items():
+                values_by_column[column][report_id] = value
+
+        columns = {}
+        for column, values in values_by_column.items():
+            table_column = ReportStore.__table__.c[column]
+            columns[column] = case(values, value=ReportStore.id, else_=table_column)
+
+        try:
+            db_session.execute(
+                ReportStore.__table__.update()
+                .values(**columns)
+                .where(ReportStore.id.in_(values_by_id.keys()))
+            )
+            db_session.commit()
+        except Exception:
+            db_session.rollback()
+            raise
+
+        for report_id, values in values_by_id.items():
+            loaded = db_session.identity_map.get(identity_key(ReportStore, report_id))
+            if loaded is not None:
+                for column, value in values.items():
+                    set_committed_value(loaded, column, value)
+
     @staticmethod
     def make_report_public(report_id, owner_id, file_manager, data):
         """
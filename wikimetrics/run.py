@@ -24,7 +24,15 @@ def run_test():
 def run_queue():
     from configurables import queue
     from wikimetrics.schedules import daily
-    queue.start(argv=['celery', 'worker', '-l', queue.conf['LOG_LEVEL']])
+    argv = ['celery', 'worker', '-l', queue.conf['LOG_LEVEL']]
+    if queue.conf.get('DISTRIBUTED_REPORTS', False):
+        # also consume the queues that distributed reports send their tasks to
+        argv.extend(['-Q', ','.join((
+            queue.conf.get('CELERY_DEFAULT_QUEUE', 'celery'),
+            queue.conf.get('METRIC_QUEUE', 'metric'),
+            queue.conf.get('REPORT_QUEUE', 'report'),
+        ))])
+    queue.start(argv=argv)
 
 
 def run_scheduler():
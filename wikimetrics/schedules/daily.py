@@ -1,3 +1,4 @@
+import json
 import traceback
 from celery import group, chain
 from celery.utils.log import get_task_logger
@@ -11,57 +12,48 @@ task_logger = get_task_logger(__name__)
 
 
 # NOTE: We found an interesting problem leading to the default timeouts expiring.
-#       The scheduler would run, create the generator of child reports, and delay each one
-#       This works but causes the scheduler to execute more slowly (we think because the
-#       workers handling the report tasks are taking up resources).  So in a situation
-#       where reports are running quickly, this task will need to be allowed to live
-#       for the entire life of all the other tasks.  Therefore, extending timeout to 3
-#       times the amount allotted to normal tasks.
-configured_soft_limit = queue.conf.get('CELERYD_TASK_SOFT_TIME_LIMIT', 3600)
-new_limit = 3 * configured_soft_limit
+#       The scheduler used to create the generator of child reports of every
+#       recurrent report, and delay each one, all in one task.  That task had to live
+#       for the entire life of all the other tasks, so its timeout was 3 times the
+#       amount allotted to normal tasks.  Now the scheduler only looks up the ids of
+#       the recurrent reports, and plans them in parallel, in batches of
+#       RECURRENT_REPORTS_PER_TASK reports, so it finishes quickly and a report that
+#       is slow to plan only delays the other reports of its batch.
 
 
-@queue.task(time_limit=new_limit, soft_time_limit=new_limit)
+@queue.task()
 def recurring_reports(report_id=None):
     from wikimetrics.configurables import db
-    from wikimetrics.models import ReportStore, RunReport
+    from wikimetrics.models import ReportStore, DailyResultStore
     
-    replication_lag_service = ReplicationLagService()
-    if replication_lag_service.is_any_lagged():
+    lagged_projects = ReplicationLagService().get_lagged_projects()
+    if lagged_projects:
         task_logger.warning(
-            'Replication lag detected. '
-            'Hence, skipping creating new recurring reports.'
+            'Replication lag detected on {0}. '
+            'Hence, deferring recurring reports on those projects.'.format(
+                ', '.join(sorted(lagged_projects))
+            )
         )
-        return
-
+    
     try:
         session = db.get_session()
-        query = session.query(ReportStore) \
-            .filter(ReportStore.recurrent) \
+        query = session.query(ReportStore.id) \
+            .filter(ReportStore.recurrent)
         
         if report_id is not None:
             query = query.filter(ReportStore.id == report_id)
         
-        for report in query.all():
-            try:
-                task_logger.info('Running recurring report "{0}"'.format(report))
-                no_more_than = queue.conf.get('MAX_INSTANCES_PER_RECURRENT_REPORT')
-                kwargs = dict()
-                if no_more_than:
-                    kwargs['no_more_than'] = no_more_than
-                
-                days_to_run = RunReport.create_reports_for_missed_days(
-                    report,
-                    session,
-                    **kwargs
-                )
-                for day_to_run in days_to_run:
-                    day_to_run.task.delay(day_to_run)
-            
-            except Exception:
-                task_logger.error('Problem running recurring report "{}": {}'.format(
-                    report, traceback.format_exc()
-                ))
+        report_ids = [row[0] for row in query.all()]
+        
+        DailyResultStore.delete_expired(
+            session, queue.conf.get('METRIC_CACHE_DAILY_TTL', 2592000)
+        )
+        
+        batch_size = queue.conf.get('RECURRENT_REPORTS_PER_TASK', 10)
+        group([
+            plan_recurring_reports.s(batch, list(lagged_projects))
+            for batch in chunk(report_ids, batch_size)
+        ]).delay()
     
     except Exception:
         task_logger.error('Problem running recurring reports: {}'.format(
@@ -69,6 +61,80 @@ def recurring_reports(report_id=None):
         ))
 
 
+@queue.task()
+def plan_recurring_reports(report_ids, lagged_projects=None):
+    """
+    Creates and delays the runs that a batch of recurrent reports missed.
+    Reports on cohorts with users in lagged projects are deferred, their missed
+    runs are created by a later run of the scheduler.  Besides the monitored
+    projects, the projects of the cohorts in the batch are checked, all at once,
+    unless REPLICATION_LAG_CHECK_COHORT_PROJECTS is False.
+    
+    Parameters:
+        report_ids      : ids of recurrent ReportStore rows
+        lagged_projects : monitored projects whose replicas are lagged
+    """
+    from wikimetrics.configurables import db
+    from wikimetrics.models import ReportStore, RunReport, BackfillReport, CohortStore
+    
+    lagged_projects = set(lagged_projects or [])
+    session = db.get_session()
+    reports = session.query(ReportStore) \
+        .filter(ReportStore.id.in_(report_ids)) \
+        .all()
+    
+    projects_by_report = {}
+    for report in reports:
+        try:
+            cohort_id = json.loads(report.parameters)['cohort']['id']
+            cohort = session.query(CohortStore).get(cohort_id)
+            if cohort is not None:
+                projects_by_report[report.id] = set(cohort.projects())
+        except Exception:
+            task_logger.error('Problem finding the projects of "{}": {}'.format(
+                report, traceback.format_exc()
+            ))
+    
+    if db.config.get('REPLICATION_LAG_CHECK_COHORT_PROJECTS', True):
+        to_check = set().union(*projects_by_report.values()) - lagged_projects
+        if to_check:
+            lagged_projects |= ReplicationLagService().get_lagged_projects(to_check)
+    
+    for report in reports:
+        try:
+            if lagged_projects & projects_by_report.get(report.id, set()):
+                task_logger.warning(
+                    'Deferring recurring report "{0}" on lagged projects'.format(
+                        report
+                    )
+                )
+                continue
+            
+            task_logger.info('Running recurring report "{0}"'.format(report))
+            no_more_than = queue.conf.get('MAX_INSTANCES_PER_RECURRENT_REPORT')
+            kwargs = dict()
+            if no_more_than:
+                kwargs['no_more_than'] = no_more_than
+            
+            days_to_run = list(RunReport.create_reports_for_missed_days(
+                report,
+                session,
+                **kwargs
+            ))
+            if BackfillReport.can_backfill(report, days_to_run):
+                backfill = BackfillReport(report, days_to_run)
+                backfill.task.delay(backfill)
+                continue
+            
+            for day_to_run in days_to_run:
+                day_to_run.task.delay(day_to_run)
+        
+        except Exception:
+            task_logger.error('Problem running recurring report "{}": {}'.format(
+                report, traceback.format_exc()
+            ))
+
+
 if queue.conf.get('DEBUG'):
     @queue.task
     def get_session_and_leave_open(*args, **kwargs):
@@ -137,6 +137,10 @@ class BetterEncoder(json.JSONEncoder):
 
         if isinstance(obj, Decimal):
             return float(obj)
+
+        # dictionary-like containers, like the results of reports
+        if isinstance(obj, collections.Mapping):
+            return dict(obj.iteritems())
         return json.JSONEncoder.default(self, obj)
 
 